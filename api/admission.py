@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+from flask import jsonify, make_response, request
+from monitoring.metrics import CallbackMetric, Counter, Histogram
+
+# Limit how many requests each worker process serves at once, queue the rest
+# in priority order for a bounded time and answer 503 to those that cannot be
+# served in time, instead of letting them pile up until SQLite times out
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'false').lower() in ('1', 'true', 'yes')
+
+# Requests a worker process serves at once; more only adds lock and GIL
+# contention. Run more gunicorn threads than this so requests can wait here,
+# where the cheap ones go first, rather than in the socket backlog.
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '4'))
+
+# Requests a worker process lets wait for a slot; the next one is shed at once
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '32'))
+
+# Seconds a shed client is asked to wait before retrying
+ADMISSION_RETRY_AFTER_S = int(os.getenv('ADMISSION_RETRY_AFTER_S', '1'))
+
+# A class of routes: waiting requests of a lower priority value are served
+# first; limit caps the class's requests served at once (0: only the worker
+# limit), and a request waits at most timeout_ms for a slot
+RouteClass = namedtuple('RouteClass', ('priority', 'limit', 'timeout_ms'))
+
+
+def _route_class(name, priority, limit, timeout_ms):
+    return RouteClass(
+        priority,
+        int(os.getenv(f'ADMISSION_{name.upper()}_LIMIT', str(limit))),
+        float(os.getenv(f'ADMISSION_{name.upper()}_TIMEOUT_MS', str(timeout_ms))),
+    )
+
+
+# Route classes, in priority order:
+# - point: single cars by id, the dimension tables and name search, index seeks
+# - write: single and batch writes
+# - query: filtered lists, multi-gets and statistics
+# - bulk: every car at once (/all, /export, /import), by default one per worker
+ROUTE_CLASSES = {
+    'point': _route_class('point', 0, 0, 250),
+    'write': _route_class('write', 1, 0, 1000),
+    'query': _route_class('query', 2, 0, 1000),
+    'bulk': _route_class('bulk', 3, 1, 2000),
+}
+
+admission_queued = Counter('admission_queued_total', 'Requests that waited for a slot', ('class',))
+admission_shed = Counter('admission_shed_total', 'Requests answered 503 by admission control', ('class', 'reason'))
+admission_wait = Histogram('admission_wait_seconds', 'Time queued requests waited for a slot', ('class',))
+
+
+# A request waiting for a slot; granted is set under the controller's lock
+class _Waiter:
+    __slots__ = ('route_class', 'event', 'granted', 'cancelled')
+
+    def __init__(self, route_class):
+        self.route_class = route_class
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+# Per-process slots shared by every route class. A free slot goes straight to
+# an arriving request whose class is under its limit; otherwise the request
+# waits, and each released slot goes to the waiting request of the highest
+# priority whose class is under its limit, oldest first within a class.
+class AdmissionController:
+    def __init__(self, max_concurrent, queue_size, classes):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.classes = classes
+        self.in_flight = dict.fromkeys(classes, 0)
+        self.waiting = dict.fromkeys(classes, 0)
+        self._running = 0
+        # (priority, arrival, waiter)
+        self._queue = []
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+
+    # Take a slot for a request of the class, waiting at most timeout seconds.
+    # Returns None once admitted, or why the request is shed: 'queue_full' or 'timeout'.
+    def acquire(self, name, timeout):
+        route_class = self.classes[name]
+        with self._lock:
+            if self._has_slot(name, route_class):
+                self._start(name)
+                return None
+            if timeout <= 0:
+                return 'timeout'
+            if sum(self.waiting.values()) >= self.queue_size:
+                return 'queue_full'
+            if len(self._queue) > 2 * self.queue_size:
+                # Drop the requests that gave up while slots stayed taken
+                self._queue = [entry for entry in self._queue if not entry[2].cancelled]
+                heapq.heapify(self._queue)
+            waiter = _Waiter(name)
+            heapq.heappush(self._queue, (route_class.priority, next(self._arrivals), waiter))
+            self.waiting[name] += 1
+
+        admission_queued.inc((name,))
+        started = time.monotonic()
+        waiter.event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                # Left in the queue and skipped when it reaches the front
+                waiter.cancelled = True
+                self.waiting[name] -= 1
+        admission_wait.observe(time.monotonic() - started, (name,))
+        return None if waiter.granted else 'timeout'
+
+    # Free a slot taken by acquire and hand it to the next waiting request
+    def release(self, name):
+        with self._lock:
+            self._running -= 1
+            self.in_flight[name] -= 1
+            self._grant()
+
+    def _has_slot(self, name, route_class):
+        return self._running < self.max_concurrent and (not route_class.limit or self.in_flight[name] < route_class.limit)
+
+    def _start(self, name):
+        self._running += 1
+        self.in_flight[name] += 1
+
+    def _grant(self):
+        blocked = []
+        while self._queue and self._running < self.max_concurrent:
+            entry = heapq.heappop(self._queue)
+            waiter = entry[2]
+            if waiter.cancelled:
+                continue
+            if not self._has_slot(waiter.route_class, self.classes[waiter.route_class]):
+                blocked.append(entry)
+                continue
+            self.waiting[waiter.route_class] -= 1
+            self._start(waiter.route_class)
+            waiter.granted = True
+            waiter.event.set()
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+
+
+admission_controller = AdmissionController(ADMISSION_MAX_CONCURRENT, ADMISSION_QUEUE_SIZE, ROUTE_CLASSES)
+
+CallbackMetric(
+    'admission_in_flight', 'Requests being served, by route class', 'gauge',
+    lambda: {(name,): count for name, count in admission_controller.in_flight.items()}, ('class',)
+)
+CallbackMetric(
+    'admission_waiting', 'Requests waiting for a slot, by route class', 'gauge',
+    lambda: {(name,): count for name, count in admission_controller.waiting.items()}, ('class',)
+)
+
+
+# Seconds the request spent before reaching this worker, from the
+# X-Request-Start header a proxy sets on arrival (t=<seconds>, milliseconds
+# or microseconds since the epoch); 0 without it
+def _upstream_wait():
+    header = request.headers.get('X-Request-Start', '')
+    try:
+        started = float(header.removeprefix('t='))
+    except ValueError:
+        return 0.0
+    while started > 1e11:
+        started /= 1000
+    waited = time.time() - started
+    return waited if 0 < waited < 3600 else 0.0
+
+
+# Serve a route under admission control as part of a route class. The time a
+# request already spent queued upstream counts against its class's timeout,
+# so requests the client has likely given up on are shed without running.
+# A streamed response keeps its slot until the stream is closed.
+def admission(name):
+    route_class = ROUTE_CLASSES[name]
+
+    def decorator(view):
+        if not ADMISSION_CONTROL:
+            return view
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            upstream = _upstream_wait()
+            if upstream > route_class.timeout_ms / 1000:
+                reason = 'expired'
+            else:
+                reason = admission_controller.acquire(name, route_class.timeout_ms / 1000 - upstream)
+            if reason is not None:
+                admission_shed.inc((name, reason))
+                response = jsonify({'error': 'The server is overloaded, retry later'})
+                response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER_S)
+                return response, 503
+
+            released = False
+            try:
+                response = make_response(view(*args, **kwargs))
+                if response.is_streamed:
+                    response.call_on_close(lambda: admission_controller.release(name))
+                    released = True
+                return response
+            finally:
+                if not released:
+                    admission_controller.release(name)
+        return wrapper
+    return decorator
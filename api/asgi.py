@@ -0,0 +1,327 @@
+import asyncio
+import fcntl
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MultiDict
+from api.routes import CHANGES_POLL_INTERVAL_S, changes_arguments, changes_body, changes_ready, changes_start
+from database import connection as db_connection
+from database.initialize import init_db
+from monitoring.metrics import http_request_duration
+from repositories import async_repository
+from repositories.async_repository import run_db
+
+# The long-poll route served on the event loop; every other request goes to the Flask app
+CHANGES_PATH = '/api/v1/car-management/changes'
+
+# Response bytes read from a WSGI response per trip to a database thread
+RESPONSE_READ_SIZE = 65536
+
+# Largest request body accepted, e.g. an uncompressed POST /import; larger
+# ones are answered 413. Bodies are received on the event loop, in memory up
+# to REQUEST_BODY_MEMORY_BYTES and in a temporary file beyond that.
+ASGI_MAX_BODY_BYTES = int(os.getenv('ASGI_MAX_BODY_BYTES', str(1024 ** 3)))
+REQUEST_BODY_MEMORY_BYTES = 1024 ** 2
+
+
+# ASGI application serving the Flask app, for servers such as uvicorn.
+#
+# Requests run the Flask app on the database threads of
+# repositories/async_repository.py through a WSGI bridge, so routes,
+# responses, caching and admission control are those of the WSGI app, while
+# idle keep-alive connections and slow clients only cost the event loop a
+# socket: a request takes a thread once its whole body has arrived. GET
+# /changes is served on the event loop with the async repository: a
+# long-poll holds no thread while it waits, and one watcher per process
+# polls for new changes on behalf of every waiting client.
+class AsgiApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = flask_app.wsgi_app
+        self._change_watcher = ChangeWatcher()
+        # Change reads in progress, by (since, limit)
+        self._change_reads = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+        elif scope['path'] == CHANGES_PATH and scope['method'] == 'GET':
+            await self._serve_changes(scope, send)
+        else:
+            await self._serve_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await run_db(_init_database)
+                except Exception as error:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(error)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Receive the request body, run the Flask app on a database thread and stream its response
+    async def _serve_wsgi(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=REQUEST_BODY_MEMORY_BYTES)
+        try:
+            received = await _receive_body(scope, receive, body)
+            if received is None:
+                return
+            if not received:
+                await self._send_json(send, {'error': f'Request body exceeds {ASGI_MAX_BODY_BYTES} bytes'}, 413)
+                return
+            body.seek(0)
+            await self._run_wsgi(scope, receive, send, body)
+        finally:
+            body.close()
+
+    async def _run_wsgi(self, scope, receive, send, body):
+        response = WsgiResponse(self.wsgi_app, _environ(scope, body))
+        chunks, finished = await run_db(response.start)
+
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': response.headers})
+        if finished:
+            await send({'type': 'http.response.body', 'body': chunks})
+            return
+
+        # A streamed response stops early when the client goes away, which
+        # is all receive() reports once the request body has been read
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            while not finished:
+                await send({'type': 'http.response.body', 'body': chunks, 'more_body': True})
+                if disconnected.done():
+                    return
+                chunks, finished = await run_db(response.read)
+            await send({'type': 'http.response.body', 'body': chunks})
+        finally:
+            disconnected.cancel()
+            if not finished:
+                await run_db(response.close)
+
+    # GET /changes on the event loop, with the same arguments and responses
+    # as the Flask route (api/routes.py)
+    async def _serve_changes(self, scope, send):
+        started = time.perf_counter()
+        try:
+            args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+            arguments, error = changes_arguments(args)
+            if error is not None:
+                body, status = error
+            else:
+                body, status = await self._changes(*arguments)
+        except Exception as error:
+            body, status = {'error': str(error)}, 500
+
+        http_request_duration.observe(time.perf_counter() - started, ('GET', CHANGES_PATH, status))
+        await self._send_json(send, body, status)
+
+    # Send a JSON response serialized as the Flask app serializes its own
+    async def _send_json(self, send, body, status):
+        response = self.flask_app.json.response(body)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.to_wsgi_list()],
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def _changes(self, since, limit, wait):
+        if since is None:
+            _, latest = await async_repository.db_retrieve_change_versions()
+            return changes_start(latest), 200
+
+        deadline = asyncio.get_running_loop().time() + wait
+        while True:
+            result = await self._read_changes(since, limit)
+            if changes_ready(result, since) or asyncio.get_running_loop().time() >= deadline:
+                break
+            await self._change_watcher.wait_past(since, deadline)
+        return changes_body(result, since)
+
+    # The long-polls a write wakes ask for the same changes at once; one read
+    # on a database thread serves every request for the same page
+    async def _read_changes(self, since, limit):
+        key = (since, limit)
+        read = self._change_reads.get(key)
+        if read is None:
+            read = self._change_reads[key] = asyncio.ensure_future(async_repository.db_retrieve_changes(since, limit))
+            read.add_done_callback(lambda _: self._change_reads.pop(key, None))
+        return await asyncio.shield(read)
+
+
+# Wakes the long-polls of one event loop when the latest change version
+# moves. One task reads the latest version every CHANGES_POLL_INTERVAL_S
+# while any long-poll waits, however many there are, and sees writes
+# committed by any worker process.
+class ChangeWatcher:
+    def __init__(self):
+        self.latest = None
+        self._changed = asyncio.Event()
+        self._waiting = 0
+        self._task = None
+
+    # Wait until the latest version is past since, or the event loop time reaches deadline
+    async def wait_past(self, since, deadline):
+        loop = asyncio.get_running_loop()
+        self._waiting += 1
+        try:
+            if self._task is None:
+                self._task = loop.create_task(self._watch())
+            while self.latest is None or self.latest <= since:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except TimeoutError:
+                    return
+        finally:
+            self._waiting -= 1
+
+    async def _watch(self):
+        try:
+            while self._waiting:
+                # None after a database error, which the repository reported; try again next poll
+                versions = await async_repository.db_retrieve_change_versions()
+                if versions is not None and versions[1] != self.latest:
+                    self.latest = versions[1]
+                    # Wake every waiting long-poll; later ones wait on a fresh event
+                    self._changed.set()
+                    self._changed = asyncio.Event()
+                await asyncio.sleep(CHANGES_POLL_INTERVAL_S)
+        finally:
+            self._task = None
+            self.latest = None
+
+
+# One request's WSGI call, run on the database threads: start() calls the app
+# and read() collects the response body, each returning (bytes, finished)
+# with up to RESPONSE_READ_SIZE bytes at a time. The response is closed once
+# finished, or by close() when it is abandoned.
+class WsgiResponse:
+    def __init__(self, wsgi_app, environ):
+        self.wsgi_app = wsgi_app
+        self.environ = environ
+        self.status = None
+        self.headers = None
+        self._iterable = None
+        self._iterator = None
+        # Bytes passed to the legacy write() callable, sent before the next chunk
+        self._written = []
+
+    def start(self):
+        self._iterable = self.wsgi_app(self.environ, self._start_response)
+        self._iterator = iter(self._iterable)
+        return self.read()
+
+    def read(self):
+        chunks = self._written
+        self._written = []
+        size = sum(map(len, chunks))
+        try:
+            while size < RESPONSE_READ_SIZE:
+                chunk = next(self._iterator, None)
+                chunks += self._written
+                size += sum(map(len, self._written))
+                self._written = []
+                if chunk is None:
+                    self.close()
+                    return b''.join(chunks), True
+                chunks.append(chunk)
+                size += len(chunk)
+        except BaseException:
+            self.close()
+            raise
+        return b''.join(chunks), False
+
+    def close(self):
+        if hasattr(self._iterable, 'close'):
+            self._iterable.close()
+
+    def _start_response(self, status, headers, exc_info=None):
+        if exc_info is not None and self.status is not None:
+            raise exc_info[1].with_traceback(exc_info[2])
+        self.status = int(status.split(' ', 1)[0])
+        self.headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return self._write
+
+    # The legacy write() callable: the bytes go out ahead of the next chunk
+    # of the returned iterable, as if it had yielded them
+    def _write(self, data):
+        self._written.append(bytes(data))
+
+
+# Receive a request body on the event loop into file. Returns True once it is
+# complete, False as soon as it exceeds ASGI_MAX_BODY_BYTES, and None if the
+# client disconnected before sending all of it.
+async def _receive_body(scope, receive, file):
+    for name, value in scope['headers']:
+        if name.lower() == b'content-length' and value.isdigit() and int(value) > ASGI_MAX_BODY_BYTES:
+            return False
+
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > ASGI_MAX_BODY_BYTES:
+            return False
+        if chunk:
+            file.write(chunk)
+        if not message.get('more_body', False):
+            return True
+
+
+# The WSGI environ of an ASGI HTTP request
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        if name in environ:
+            value = f"{environ[name]}{'; ' if name == 'HTTP_COOKIE' else ','}{value}"
+        environ[name] = value
+    return environ
+
+
+# Initialize the database once across the worker processes uvicorn starts
+# side by side: they take turns, and the ones after the first find the data
+# loaded (under gunicorn the master does this, see gunicorn.conf.py)
+def _init_database():
+    with open(f'{db_connection.SQLITE_DB_PATH}.init.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        init_db()
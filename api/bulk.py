@@ -0,0 +1,174 @@
+import csv
+import datetime
+import gzip
+import io
+import math
+import os
+import re
+import zlib
+from api.json_provider import dumps_compact, loads_json
+from repositories.dimension_cache import expand_names
+
+# Columns of an exported car, in file order. The names behind the ids are
+# included so an import into another environment maps them to its own ids.
+EXPORT_COLUMNS = (
+    'id', 'purchase_date', 'purchase_price', 'car_make_id', 'fuel_type_id', 'pickup_location_id',
+    'car_make_name', 'fuel_type_name', 'pickup_location_name',
+)
+
+# Export formats and their uncompressed media types
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# zlib compression level of gzip exports, from 1 (fastest) to 9 (smallest)
+EXPORT_GZIP_LEVEL = int(os.getenv('EXPORT_GZIP_LEVEL', '1'))
+
+# Id columns of an imported car and the name columns that take precedence over them
+DIMENSION_FIELDS = (
+    ('car_make_id', 'car_make_name'),
+    ('fuel_type_id', 'fuel_type_name'),
+    ('pickup_location_id', 'pickup_location_name'),
+)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Text of an integer field
+INTEGER_PATTERN = re.compile(r'[+-]?[0-9]+')
+
+
+# A malformed record in an uploaded file, with its 1-based line number
+class ImportFormatError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+# Encode batches of cars as CSV or NDJSON, yielding bytes as each batch is
+# encoded and, with compress, gzip-compressing them on the fly. Memory stays
+# bounded by one batch however many cars are exported.
+def encode_export(batches, export_format, compress=True):
+    # wbits 31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    for text in _encode(batches, export_format):
+        data = text.encode()
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def _encode(batches, export_format):
+    if export_format == 'csv':
+        yield ','.join(EXPORT_COLUMNS) + '\n'
+    for cars in batches:
+        expand_names(cars)
+        yield _encode_csv(cars) if export_format == 'csv' else _encode_ndjson(cars)
+
+
+def _encode_csv(cars):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows([car[column] for column in EXPORT_COLUMNS] for car in cars)
+    return buffer.getvalue()
+
+
+def _encode_ndjson(cars):
+    return ''.join(dumps_compact(car) + '\n' for car in cars)
+
+
+# Parse an uploaded CSV or NDJSON file, gzip-compressed or not (detected from
+# its first bytes), yielding one validated car per record. The stream is read
+# incrementally, so memory does not grow with the size of the upload. Any
+# problem with the upload is raised as ImportFormatError.
+def decode_import(stream, import_format):
+    head = stream.read(2)
+    binary = io.BufferedReader(_PrefixedStream(head, stream))
+    if head == GZIP_MAGIC:
+        binary = gzip.GzipFile(fileobj=binary, mode='rb')
+    text = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+
+    line = 0
+    try:
+        if import_format == 'csv':
+            reader = csv.DictReader(text)
+            for record in reader:
+                line = reader.line_num
+                yield _parse_car(line, record)
+        else:
+            for line, record in enumerate(text, start=1):
+                if record.strip():
+                    yield _parse_car(line, _json_record(line, record))
+    except (csv.Error, UnicodeDecodeError, EOFError, OSError, zlib.error) as error:
+        # Truncated or corrupt gzip data, undecodable text or broken CSV quoting
+        raise ImportFormatError(line + 1, f"unreadable upload ({error})") from None
+
+
+def _json_record(line, text):
+    try:
+        record = loads_json(text)
+    except ValueError:
+        record = None
+    if not isinstance(record, dict):
+        raise ImportFormatError(line, "not a JSON object")
+    return record
+
+
+# Validate one record into a car: purchase_date, purchase_price, an optional
+# id, and for each dimension its name or, without one, its id
+def _parse_car(line, record):
+    car = {'id': None}
+    try:
+        car['purchase_date'] = datetime.date.fromisoformat(record.get('purchase_date')).isoformat()
+    except (TypeError, ValueError):
+        raise ImportFormatError(line, "purchase_date must be a date in YYYY-MM-DD format") from None
+
+    try:
+        car['purchase_price'] = float(record.get('purchase_price'))
+    except (TypeError, ValueError):
+        car['purchase_price'] = math.nan
+    if not math.isfinite(car['purchase_price']):
+        raise ImportFormatError(line, "purchase_price must be a number")
+
+    if record.get('id') not in (None, ''):
+        car['id'] = _parse_int(line, record, 'id')
+
+    for id_column, name_column in DIMENSION_FIELDS:
+        if record.get(name_column) not in (None, ''):
+            car[name_column] = str(record[name_column])
+        elif record.get(id_column) not in (None, ''):
+            car[id_column] = _parse_int(line, record, id_column)
+        else:
+            raise ImportFormatError(line, f"{name_column} or {id_column} is required")
+    return car
+
+
+# An integer field: a JSON integer, or the digits of one as read from CSV.
+# int() would also take true, 1.5 or "1_0" and quietly turn them into numbers.
+def _parse_int(line, record, name):
+    value = record[name]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and INTEGER_PATTERN.fullmatch(value.strip()):
+        return int(value)
+    raise ImportFormatError(line, f"{name} must be an integer")
+
+
+# Raw stream that returns already-read leading bytes before the rest of the
+# wrapped stream, so the gzip check does not need a seekable upload
+class _PrefixedStream(io.RawIOBase):
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from flask import Response, make_response, request
+from monitoring.metrics import CallbackMetric
+from repositories.repository import db_retrieve_snapshot_version, db_retrieve_table_generation, db_retrieve_table_generations
+
+# Maximum number of responses kept per worker process
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1024'))
+
+# Responses with a larger body are served with an ETag but not stored
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(1024 * 1024)))
+
+
+# Bounded, thread-safe LRU mapping of cache keys to serialized responses
+class ResponseCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
+CallbackMetric('response_cache_hits_total', 'GET responses served from the response cache', 'counter', lambda: response_cache.hits)
+CallbackMetric('response_cache_misses_total', 'GET responses computed because they were not cached', 'counter', lambda: response_cache.misses)
+CallbackMetric('response_cache_entries', 'Responses currently held in the response cache', 'gauge', lambda: len(response_cache))
+
+
+# Runs at most one computation per key at a time. Callers arriving while a
+# key's computation is in flight wait for it and share its result instead of
+# repeating the work; the next caller after it finishes starts a new one.
+class SingleFlight:
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # Return (function(), shared), where shared is True for callers that got
+    # another caller's result. The leader's exception is raised to every caller.
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = function()
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
+
+    def __len__(self):
+        return len(self._calls)
+
+
+response_flights = SingleFlight()
+
+CallbackMetric('single_flight_leaders_total', 'GET responses computed on a cache miss while no identical request was in flight', 'counter', lambda: response_flights.leaders)
+CallbackMetric('single_flight_coalesced_total', 'GET requests that waited for an identical in-flight request and shared its response', 'counter', lambda: response_flights.coalesced)
+CallbackMetric('single_flight_in_flight', 'Distinct GET responses being computed right now', 'gauge', lambda: len(response_flights))
+
+
+# Serve a GET route from the response cache, keyed by path, query parameters
+# and the current write generations of the tables it reads. Any write to one of
+# those tables changes its generation, so stale entries are never served and
+# simply age out of the LRU. Concurrent misses on the same key are computed
+# once (see SingleFlight). Every 200 response carries an ETag and honours
+# If-None-Match with 304 Not Modified.
+#
+# Routes whose cars are read from the database snapshot when snapshot reads
+# are on pass snapshot=True. Their cars then change only when a new snapshot
+# replaces the file, so the snapshot's version stands in for the
+# car_management generation, and writes do not evict them.
+def cached_response(*tables, snapshot=False):
+    tables = tables or ('car_management',)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            snapshot_version = db_retrieve_snapshot_version() if snapshot else None
+            live_tables = tables
+            if snapshot_version is not None:
+                live_tables = tuple(table for table in tables if table != 'car_management')
+
+            generation = _generation(live_tables)
+            if generation is None:
+                return view(*args, **kwargs)
+
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), generation, snapshot_version)
+            entry = response_cache.get(key)
+            response = None
+            if entry is None:
+                # Identical requests arriving during the computation share its
+                # serialized body, including bodies too large to cache
+                def compute():
+                    nonlocal response
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return None
+                    body = response.get_data()
+                    computed = (body, response.mimetype, hashlib.blake2b(body, digest_size=16).hexdigest())
+                    if len(body) <= RESPONSE_CACHE_MAX_BYTES:
+                        response_cache.put(key, computed)
+                    return computed
+
+                entry, _ = response_flights.do(key, compute)
+                if entry is None:
+                    # Errors and streams are not shared; a waiting request computes its own
+                    return response if response is not None else view(*args, **kwargs)
+
+            body, mimetype, etag = entry
+            if response is None:
+                response = Response(body, mimetype=mimetype)
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+# Current write generation of one table, or a tuple of those of several (an
+# empty tuple for none); None if it cannot be read
+def _generation(tables):
+    if not tables:
+        return ()
+    if len(tables) == 1:
+        return db_retrieve_table_generation(tables[0])
+    generations = db_retrieve_table_generations(tables)
+    return tuple(generations.get(table) for table in tables) if generations else None
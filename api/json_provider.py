@@ -0,0 +1,57 @@
+import json
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; Flask's default provider is used without it
+    orjson = None
+
+# Accept non-str dict keys, as the standard library encoder does
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+# JSON provider backed by orjson, which serializes the list-of-dict responses of
+# the car routes several times faster than the standard library encoder.
+# Keys keep their column order instead of being sorted.
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        # Callers asking for stdlib-specific options (indent, cls, ...) get the stdlib encoder
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            # Types orjson rejects outright, such as integers beyond 64 bits
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+# Install the fastest available JSON provider on the app
+def init_json_provider(app):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+# Compact JSON text for code outside a request context, such as streaming generators
+def dumps_compact(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+    return json.dumps(obj, separators=(',', ':'))
+
+
+# Parse JSON text outside a request context, such as lines of an uploaded file
+def loads_json(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
@@ -1,37 +1,227 @@
-from flask import Blueprint, jsonify, request
-from flasgger import swag_from
+import datetime
+import math
+import os
+import time
+from flask import Blueprint, Response, jsonify, request
+from swagger.config import swag_from
+from api.admission import admission
+from api.bulk import EXPORT_FORMATS, ImportFormatError, decode_import, encode_export
+from api.cache import cached_response
+from api.json_provider import dumps_compact
+from database.shards import SHARD_COUNT
+from database.snapshot import snapshot_in_progress, snapshot_info, start_snapshot
+from repositories.dimension_cache import dimension_cache, expand_names
 from repositories.repository import (
     db_retrieve_all_cars,
+    db_retrieve_cars_page,
+    db_iter_all_cars,
     db_retrieve_car_by_id,
+    db_retrieve_cars_by_ids,
     db_retrieve_car_by_make,
     db_retrieve_car_by_fuel_type,
     db_retrieve_car_by_pickup_location,
+    db_retrieve_cars_by_filters,
+    db_retrieve_car_stats,
+    db_retrieve_filtered_car_stats,
+    db_retrieve_changes,
+    db_retrieve_change_versions,
     db_add_new_car,
     db_remove_car_by_id,
-    db_update_pickup_location
+    db_update_pickup_location,
+    db_add_new_cars,
+    db_update_pickup_locations,
+    db_remove_cars_by_id,
+    db_import_cars,
+    db_retrieve_snapshot_version,
+    SORT_COLUMNS
     )
 
 car_management_routes = Blueprint('car_management_routes', __name__)
 
+# Tables whose writes invalidate cached car responses; the dimension tables
+# matter because ?expand=names embeds their names
+CAR_TABLES = ('car_management', 'car_make', 'fuel_types', 'pickup_location')
+
+# Largest page a client may request from /all
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+
+# Rows fetched from the cursor per streamed chunk
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '1000'))
+
+# Longest a GET /changes long-poll may wait, kept below the gunicorn worker timeout
+CHANGES_MAX_WAIT_S = int(os.getenv('CHANGES_MAX_WAIT_S', '20'))
+
+# How often a waiting long-poll checks for new changes, in seconds
+CHANGES_POLL_INTERVAL_S = 0.1
+
+# Cars written per transaction by POST /import
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '10000'))
+
+# Largest number of items accepted by the batch routes
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '5000'))
+
 
 # Get all cars
 @car_management_routes.route('/all', methods=['GET'])
 @swag_from('../swagger/docs/get_all_cars.yml')
+@cached_response(*CAR_TABLES, snapshot=True)
+@admission('bulk')
 def get_all_cars():
     try:
-        cars = db_retrieve_all_cars()
+        expand, error = _expand_arg()
+        if error:
+            return error
+
+        stream = request.args.get('stream')
+        if stream is not None:
+            if stream == 'ndjson':
+                return Response(_stream_ndjson(expand), mimetype='application/x-ndjson'), 200
+            if stream == 'json':
+                return Response(_stream_json_array(expand), mimetype='application/json'), 200
+            return jsonify({'error': "stream must be 'ndjson' or 'json'"}), 400
+
+        if 'limit' in request.args or 'after' in request.args:
+            limit = _int_arg('limit', default=MAX_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+            after = _int_arg('after', default=0, minimum=0)
+            if limit is None or after is None:
+                return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE} and after must be a non-negative integer'}), 400
+
+            cars = db_retrieve_cars_page(limit, after)
+            next_after = cars[-1]['id'] if len(cars) == limit else None
+            if expand:
+                expand_names(cars)
+            return jsonify({'cars': cars, 'next_after': next_after}), 200
+
+        columnar, error = _columnar_arg()
+        if error:
+            return error
+        cars = db_retrieve_all_cars(columnar=columnar)
+        if expand:
+            expand_names(cars)
         return jsonify(cars), 200
     except Exception as error:
         return jsonify({'error': str(error)}), 500
+
+
+# Parse an integer query parameter (of the current request unless other
+# arguments are given), returning None when it is malformed or out of range
+def _int_arg(name, default, minimum=None, maximum=None, args=None):
+    value = (request.args if args is None else args).get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        return None
+    return value
+
+
+# Read the car filters shared by /cars and /stats/<dimension>, returning
+# (filters, error_response): ids of the make, fuel type and pickup location,
+# and inclusive purchase date and price ranges
+def _car_filters():
+    filters = {}
+    for name in ('car_make_id', 'fuel_type_id', 'pickup_location_id'):
+        if name in request.args:
+            value = _int_arg(name, default=None)
+            if value is None:
+                return None, (jsonify({'error': f'{name} must be an integer'}), 400)
+            filters[name] = value
+
+    for name in ('purchase_date_from', 'purchase_date_to'):
+        if name in request.args:
+            value = _date_arg(name)
+            if value is None:
+                return None, (jsonify({'error': f'{name} must be a date in YYYY-MM-DD format'}), 400)
+            filters[name] = value
+
+    for name in ('min_price', 'max_price'):
+        if name in request.args:
+            value = _float_arg(name)
+            if value is None:
+                return None, (jsonify({'error': f'{name} must be a number'}), 400)
+            filters[name] = value
+    return filters, None
+
+
+# Parse a YYYY-MM-DD query parameter, returning None if it is not a valid date
+def _date_arg(name):
+    try:
+        return datetime.date.fromisoformat(request.args[name]).isoformat()
+    except ValueError:
+        return None
+
+
+# Parse a finite numeric query parameter, returning None if it is not one
+def _float_arg(name):
+    try:
+        value = float(request.args[name])
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+# Read the format query parameter, returning (columnar, error_response).
+# format=columnar returns one object with an array per column instead of one object per car.
+def _columnar_arg():
+    value = request.args.get('format', 'rows')
+    if value not in ('rows', 'columnar'):
+        return None, (jsonify({'error': "format must be 'rows' or 'columnar'"}), 400)
+    return value == 'columnar', None
+
+
+# Read the expand query parameter, returning (expand, error_response).
+# expand=names adds car_make_name, fuel_type_name and pickup_location_name to every car.
+def _expand_arg():
+    value = request.args.get('expand')
+    if value not in (None, 'names'):
+        return None, (jsonify({'error': "expand must be 'names'"}), 400)
+    return value == 'names', None
+
+
+# Whether a row or columnar result holds at least one car
+def _has_cars(cars):
+    if isinstance(cars, dict):
+        return bool(cars.get('id'))
+    return bool(cars)
+
+
+# Stream all cars as newline-delimited JSON, one car per line
+def _stream_ndjson(expand=False):
+    for cars in db_iter_all_cars(STREAM_BATCH_SIZE):
+        if expand:
+            expand_names(cars)
+        yield ''.join(dumps_compact(car) + '\n' for car in cars)
+
+
+# Stream all cars as a single JSON array, one chunk per cursor batch
+def _stream_json_array(expand=False):
+    yield '['
+    separator = ''
+    for cars in db_iter_all_cars(STREAM_BATCH_SIZE):
+        if expand:
+            expand_names(cars)
+        yield separator + ','.join(dumps_compact(car) for car in cars)
+        separator = ','
+    yield ']'
     
 
 # Retrieve a car by ID
 @car_management_routes.route('/car/<int:id>', methods=['GET'])
 @swag_from('../swagger/docs/get_car_by_id.yml')
+@cached_response(*CAR_TABLES)
+@admission('point')
 def get_car_by_id(id):
     try:
+        expand, error = _expand_arg()
+        if error:
+            return error
         car = db_retrieve_car_by_id(id)
         if car:
+            if expand:
+                expand_names(car)
             return jsonify(car), 200
         else:
             return jsonify({'error': 'Car not found'}), 404
@@ -41,10 +231,20 @@ def get_car_by_id(id):
 # Retrieve cars by make
 @car_management_routes.route('/car/make/<int:car_make_id>', methods=['GET'])
 @swag_from('../swagger/docs/get_cars_by_make_id.yml')
+@cached_response(*CAR_TABLES)
+@admission('query')
 def get_cars_by_make(car_make_id):
     try:
-        cars = db_retrieve_car_by_make(car_make_id)
-        if cars:
+        columnar, error = _columnar_arg()
+        if error:
+            return error
+        expand, error = _expand_arg()
+        if error:
+            return error
+        cars = db_retrieve_car_by_make(car_make_id, columnar=columnar)
+        if _has_cars(cars):
+            if expand:
+                expand_names(cars)
             return jsonify(cars), 200
         else:
             return jsonify({'error': 'No cars found for the given make'}), 404
@@ -54,10 +254,20 @@ def get_cars_by_make(car_make_id):
 # Retrieve cars by fuel type
 @car_management_routes.route('/car/fuel/<int:fuel_type_id>', methods=['GET'])
 @swag_from('../swagger/docs/get_cars_by_fuel_type.yml')
+@cached_response(*CAR_TABLES)
+@admission('query')
 def get_cars_by_fuel_type(fuel_type_id):
     try:
-        cars = db_retrieve_car_by_fuel_type(fuel_type_id)
-        if cars:
+        columnar, error = _columnar_arg()
+        if error:
+            return error
+        expand, error = _expand_arg()
+        if error:
+            return error
+        cars = db_retrieve_car_by_fuel_type(fuel_type_id, columnar=columnar)
+        if _has_cars(cars):
+            if expand:
+                expand_names(cars)
             return jsonify(cars), 200
         else:
             return jsonify({'error': 'No cars found for the given fuel type'}), 404
@@ -67,19 +277,328 @@ def get_cars_by_fuel_type(fuel_type_id):
 # Retrieve cars by pickup location
 @car_management_routes.route('/car/location/<int:pickup_location_id>', methods=['GET'])
 @swag_from('../swagger/docs/get_cars_by_pickup_location_id.yml')
+@cached_response(*CAR_TABLES)
+@admission('query')
 def get_cars_by_pickup_location(pickup_location_id):
     try:
-        cars = db_retrieve_car_by_pickup_location(pickup_location_id)
-        if cars:
+        columnar, error = _columnar_arg()
+        if error:
+            return error
+        expand, error = _expand_arg()
+        if error:
+            return error
+        cars = db_retrieve_car_by_pickup_location(pickup_location_id, columnar=columnar)
+        if _has_cars(cars):
+            if expand:
+                expand_names(cars)
             return jsonify(cars), 200
         else:
             return jsonify({'error': 'No cars found for the given pickup location'}), 404
     except Exception as error:
         return jsonify({'error': str(error)}), 500
 
+# Retrieve cars by any combination of make, fuel type and pickup location,
+# or with ids=1,2,3 by a list of ids
+@car_management_routes.route('/cars', methods=['GET'])
+@swag_from('../swagger/docs/get_cars_by_filters.yml')
+@cached_response(*CAR_TABLES)
+@admission('query')
+def get_cars_by_filters():
+    try:
+        if 'ids' in request.args:
+            if len(request.args) > 1 + ('expand' in request.args):
+                return jsonify({'error': 'ids cannot be combined with filters, sort or limit'}), 400
+            try:
+                ids = [int(value) for value in request.args['ids'].split(',')]
+            except ValueError:
+                return jsonify({'error': 'ids must be a comma-separated list of integers'}), 400
+            return _cars_by_ids(ids)
+
+        filters, error = _car_filters()
+        if error:
+            return error
+
+        # sort=purchase_price orders ascending, sort=-purchase_price descending
+        sort = request.args.get('sort')
+        descending = sort is not None and sort.startswith('-')
+        if descending:
+            sort = sort[1:]
+        if sort is not None and sort not in SORT_COLUMNS:
+            return jsonify({'error': f"sort must be one of {', '.join(SORT_COLUMNS)}, prefixed with '-' for descending order"}), 400
+
+        limit = _int_arg('limit', default=None, minimum=1, maximum=MAX_PAGE_SIZE)
+        if 'limit' in request.args and limit is None:
+            return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+        if not filters and limit is None:
+            return jsonify({'error': 'At least one filter or a limit is required'}), 400
+
+        expand, error = _expand_arg()
+        if error:
+            return error
+        cars = db_retrieve_cars_by_filters(**filters, sort=sort, descending=descending, limit=limit)
+        if cars:
+            if expand:
+                expand_names(cars)
+            return jsonify(cars), 200
+        else:
+            return jsonify({'error': 'No cars found for the given filters'}), 404
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Retrieve cars by a list of ids given in the JSON body, for lists too long for a URL
+@car_management_routes.route('/cars/lookup', methods=['POST'])
+@swag_from('../swagger/docs/lookup_cars.yml')
+@admission('query')
+def lookup_cars():
+    try:
+        ids, error = _batch_items('ids')
+        if error:
+            return error
+        if not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+            return jsonify({'error': "'ids' must be a list of integers"}), 400
+        return _cars_by_ids(ids)
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+
+# Respond with the cars of a list of ids in request order, first occurrence
+# of each id only, and the ids that do not exist
+def _cars_by_ids(ids):
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'{len(ids)} ids exceed the limit of {MAX_BATCH_SIZE}'}), 413
+    expand, error = _expand_arg()
+    if error:
+        return error
+
+    found = db_retrieve_cars_by_ids(ids)
+    if found is None:
+        return jsonify({'error': 'Database error'}), 500
+    cars_by_id = {car['id']: car for car in found}
+    cars = [cars_by_id[id] for id in ids if id in cars_by_id]
+    if expand:
+        expand_names(cars)
+    return jsonify({'cars': cars, 'not_found': [id for id in ids if id not in cars_by_id]}), 200
+
+# Retrieve all car makes
+@car_management_routes.route('/makes', methods=['GET'])
+@swag_from('../swagger/docs/get_car_makes.yml')
+@cached_response('car_make')
+@admission('point')
+def get_car_makes():
+    try:
+        return jsonify(dimension_cache.rows('car_make')), 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Retrieve all fuel types
+@car_management_routes.route('/fuel-types', methods=['GET'])
+@swag_from('../swagger/docs/get_fuel_types.yml')
+@cached_response('fuel_types')
+@admission('point')
+def get_fuel_types():
+    try:
+        return jsonify(dimension_cache.rows('fuel_types')), 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Retrieve all pickup locations
+@car_management_routes.route('/locations', methods=['GET'])
+@swag_from('../swagger/docs/get_pickup_locations.yml')
+@cached_response('pickup_location')
+@admission('point')
+def get_pickup_locations():
+    try:
+        return jsonify(dimension_cache.rows('pickup_location')), 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Search types, the dimension table searched for each and the car_management column its ids filter
+SEARCH_TYPES = {
+    'make': ('car_make', 'car_make_id'),
+    'fuel': ('fuel_types', 'fuel_type_id'),
+    'location': ('pickup_location', 'pickup_location_id'),
+}
+
+# How a search match relates to the query, by NameIndex rank
+SEARCH_MATCHES = ('exact', 'prefix', 'word_prefix', 'substring')
+
+# Most matches a search returns, and the longest query accepted
+MAX_SEARCH_RESULTS = 50
+MAX_SEARCH_QUERY_LENGTH = 100
+
+# Search make, fuel type and pickup location names, e.g. to turn typed text
+# into the ids the other routes take, optionally with each match's cars
+@car_management_routes.route('/search', methods=['GET'])
+@swag_from('../swagger/docs/search.yml')
+@cached_response(*CAR_TABLES)
+@admission('point')
+def search_names():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query or len(query) > MAX_SEARCH_QUERY_LENGTH:
+            return jsonify({'error': f'q must be between 1 and {MAX_SEARCH_QUERY_LENGTH} characters'}), 400
+
+        types = request.args.get('type', ','.join(SEARCH_TYPES)).split(',')
+        if not all(search_type in SEARCH_TYPES for search_type in types):
+            return jsonify({'error': f"type must be a comma-separated list of: {', '.join(SEARCH_TYPES)}"}), 400
+
+        limit = _int_arg('limit', default=10, minimum=1, maximum=MAX_SEARCH_RESULTS)
+        cars_per_match = _int_arg('cars', default=0, minimum=0, maximum=MAX_PAGE_SIZE)
+        if limit is None or cars_per_match is None:
+            return jsonify({'error': f'limit must be between 1 and {MAX_SEARCH_RESULTS} and cars between 0 and {MAX_PAGE_SIZE}'}), 400
+        expand, error = _expand_arg()
+        if error:
+            return error
+
+        search_types = {SEARCH_TYPES[search_type][0]: search_type for search_type in dict.fromkeys(types)}
+        matches = []
+        for table_name, rank, id, name in dimension_cache.search(query, tuple(search_types), limit):
+            match = {'type': search_types[table_name], 'id': id, 'name': name, 'match': SEARCH_MATCHES[rank]}
+            if cars_per_match:
+                # The first cars by id of the match, one index range scan each
+                column = SEARCH_TYPES[match['type']][1]
+                match['cars'] = db_retrieve_cars_by_filters(**{column: id}, sort='id', limit=cars_per_match) or []
+                if expand:
+                    expand_names(match['cars'])
+            matches.append(match)
+        return jsonify({'query': query, 'matches': matches}), 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Path names of the stats groupings and the car_management column behind each
+STATS_DIMENSIONS = {
+    'make': 'car_make_id',
+    'fuel': 'fuel_type_id',
+    'location': 'pickup_location_id',
+}
+
+# Retrieve fleet totals across all cars
+@car_management_routes.route('/stats', methods=['GET'])
+@swag_from('../swagger/docs/get_fleet_stats.yml')
+@cached_response(snapshot=True)
+@admission('query')
+def get_fleet_stats():
+    try:
+        # Any one grouping partitions the whole fleet, so totals come from its groups
+        groups = db_retrieve_car_stats('car_make_id')
+        if not groups:
+            return jsonify({'count': 0, 'purchase_price': None, 'purchase_date': None}), 200
+
+        count = sum(group['count'] for group in groups)
+        price_sum = sum(group['purchase_price']['sum'] for group in groups)
+        return jsonify({
+            'count': count,
+            'purchase_price': {
+                'sum': price_sum,
+                'avg': price_sum / count,
+                'min': min(group['purchase_price']['min'] for group in groups),
+                'max': max(group['purchase_price']['max'] for group in groups),
+            },
+            'purchase_date': {
+                'min': min(group['purchase_date']['min'] for group in groups),
+                'max': max(group['purchase_date']['max'] for group in groups),
+            },
+        }), 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Retrieve fleet statistics grouped by make, fuel type or pickup location
+@car_management_routes.route('/stats/<dimension>', methods=['GET'])
+@swag_from('../swagger/docs/get_car_stats.yml')
+@cached_response(snapshot=True)
+@admission('query')
+def get_car_stats(dimension):
+    try:
+        if dimension not in STATS_DIMENSIONS:
+            return jsonify({'error': f"dimension must be one of: {', '.join(STATS_DIMENSIONS)}"}), 404
+
+        # Unfiltered statistics come from the trigger-maintained summary rows;
+        # filtered ones are aggregated over the matching cars
+        filters, error = _car_filters()
+        if error:
+            return error
+        if filters:
+            return jsonify(db_retrieve_filtered_car_stats(STATS_DIMENSIONS[dimension], **filters)), 200
+        return jsonify(db_retrieve_car_stats(STATS_DIMENSIONS[dimension])), 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Retrieve changes to cars after a version, optionally waiting for the next
+# one (long-poll). Without since, returns the current version to start from.
+# The ASGI app serves this route itself, see api/asgi.py.
+@car_management_routes.route('/changes', methods=['GET'])
+@swag_from('../swagger/docs/get_changes.yml')
+def get_changes():
+    try:
+        arguments, error = changes_arguments(request.args)
+        if error is not None:
+            return jsonify(error[0]), error[1]
+        since, limit, wait = arguments
+
+        if since is None:
+            _, latest = db_retrieve_change_versions()
+            return jsonify(changes_start(latest)), 200
+
+        # Waiting only reads the latest version, one primary key lookup per
+        # poll, and sees writes committed by any worker process
+        deadline = time.monotonic() + wait
+        while True:
+            result = db_retrieve_changes(since, limit)
+            if changes_ready(result, since) or time.monotonic() >= deadline:
+                break
+            while db_retrieve_change_versions()[1] <= since and time.monotonic() < deadline:
+                time.sleep(CHANGES_POLL_INTERVAL_S)
+
+        body, status = changes_body(result, since)
+        return jsonify(body), status
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+
+# Validate the GET /changes query arguments, returning ((since, limit, wait), None),
+# or (None, (error body, status)) when the request cannot be served
+def changes_arguments(args):
+    # Shards keep no change log, see database/shards.py
+    if SHARD_COUNT:
+        return None, ({'error': 'The change feed is not available with partitioned storage (SHARD_COUNT)'}, 501)
+
+    limit = _int_arg('limit', default=MAX_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE, args=args)
+    wait = _int_arg('wait', default=0, minimum=0, maximum=CHANGES_MAX_WAIT_S, args=args)
+    since = _int_arg('since', default=None, minimum=0, args=args)
+    if limit is None or wait is None or ('since' in args and since is None):
+        return None, ({'error': f'since must be a non-negative integer, limit between 1 and {MAX_PAGE_SIZE} and wait between 0 and {CHANGES_MAX_WAIT_S}'}, 400)
+    return (since, limit, wait), None
+
+
+# GET /changes body for a client without since, starting at the latest version
+def changes_start(latest):
+    return {'changes': [], 'next_since': latest, 'latest_version': latest}
+
+
+# Whether the changes read after since end a long-poll
+def changes_ready(result, since):
+    return bool(result['changes']) or result['latest_version'] > since
+
+
+# GET /changes body and status for the changes read after since
+def changes_body(result, since):
+    # Changes after since were removed by retention, or the database was replaced
+    if since < result['horizon'] or since > result['latest_version']:
+        return {
+            'error': 'Changes after this version are no longer available; reload the cars and restart from next_since',
+            'next_since': result['latest_version'],
+        }, 410
+
+    changes = result['changes']
+    next_since = changes[-1]['version'] if changes else result['latest_version']
+    return {'changes': changes, 'next_since': next_since, 'latest_version': result['latest_version']}, 200
+
 # Add a new car
 @car_management_routes.route('/car', methods=['POST'])
 @swag_from('../swagger/docs/add_new_car.yml')
+@admission('write')
 def add_car():
     try:
         data = request.get_json()
@@ -91,6 +610,7 @@ def add_car():
 # Remove a car by id
 @car_management_routes.route('/car/<int:id>', methods=['DELETE'])
 @swag_from('../swagger/docs/delete_car_by_id.yml')
+@admission('write')
 def delete_car(id):
     try:
         message = db_remove_car_by_id(id)
@@ -101,6 +621,7 @@ def delete_car(id):
 # Update pickup location of a car
 @car_management_routes.route('/car/<int:id>', methods=['PATCH'])
 @swag_from('../swagger/docs/update_car_location.yml')
+@admission('write')
 def update_car_location(id):
     try:
         data = request.get_json()
@@ -108,3 +629,151 @@ def update_car_location(id):
         return jsonify({'message': message}), 200
     except Exception as error:
         return jsonify({'error': str(error)}), 500
+
+
+# Add many cars in one transaction
+@car_management_routes.route('/cars/batch', methods=['POST'])
+@swag_from('../swagger/docs/add_new_cars_batch.yml')
+@admission('write')
+def add_cars_batch():
+    try:
+        cars, error = _batch_items('cars')
+        if error:
+            return error
+        return _batch_response(db_add_new_cars(cars), success_status=201)
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Update the pickup location of many cars in one transaction
+@car_management_routes.route('/cars/batch', methods=['PATCH'])
+@swag_from('../swagger/docs/update_car_locations_batch.yml')
+@admission('write')
+def update_car_locations_batch():
+    try:
+        updates, error = _batch_items('cars')
+        if error:
+            return error
+        return _batch_response(db_update_pickup_locations(updates))
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Remove many cars by id in one transaction
+@car_management_routes.route('/cars/batch', methods=['DELETE'])
+@swag_from('../swagger/docs/delete_cars_batch.yml')
+@admission('write')
+def delete_cars_batch():
+    try:
+        ids, error = _batch_items('ids')
+        if error:
+            return error
+        return _batch_response(db_remove_cars_by_id(ids))
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+
+# Export all cars as a CSV or NDJSON file, gzip-compressed on the fly, streamed from a server-side cursor
+@car_management_routes.route('/export', methods=['GET'])
+@swag_from('../swagger/docs/export_cars.yml')
+@admission('bulk')
+def export_cars():
+    try:
+        export_format = request.args.get('format', 'csv')
+        compression = request.args.get('compression', 'gzip')
+        if export_format not in EXPORT_FORMATS or compression not in ('gzip', 'none'):
+            return jsonify({'error': "format must be 'csv' or 'ndjson' and compression 'gzip' or 'none'"}), 400
+
+        # Read before the export starts, so following /changes from this
+        # version replays at most a few changes the file already holds
+        change_version = None if SHARD_COUNT else db_retrieve_change_versions(snapshot=True)[1]
+        compress = compression == 'gzip'
+        response = Response(
+            encode_export(db_iter_all_cars(STREAM_BATCH_SIZE), export_format, compress),
+            mimetype='application/gzip' if compress else EXPORT_FORMATS[export_format],
+        )
+        filename = f"cars.{export_format}{'.gz' if compress else ''}"
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        if change_version is not None:
+            response.headers['X-Change-Version'] = str(change_version)
+        return response, 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Import cars from an uploaded export, decompressing and inserting in bounded transactions
+@car_management_routes.route('/import', methods=['POST'])
+@swag_from('../swagger/docs/import_cars.yml')
+@admission('bulk')
+def import_cars():
+    import_format = request.args.get('format', 'csv')
+    ids = request.args.get('ids', 'keep')
+    if import_format not in EXPORT_FORMATS or ids not in ('keep', 'new'):
+        return jsonify({'error': "format must be 'csv' or 'ndjson' and ids 'keep' or 'new'"}), 400
+
+    # Chunks before a failure stay committed; the response says how many
+    # cars were imported, and with ids=keep the same file can be re-sent
+    imported = 0
+    try:
+        chunk = []
+        for car in decode_import(request.stream, import_format):
+            chunk.append(car)
+            if len(chunk) == IMPORT_CHUNK_SIZE:
+                imported += _import_chunk(chunk, ids == 'keep')
+                chunk = []
+        if chunk:
+            imported += _import_chunk(chunk, ids == 'keep')
+        return jsonify({'imported': imported}), 201
+    except ImportFormatError as error:
+        return jsonify({'error': str(error), 'line': error.line, 'imported': imported}), 400
+    except ValueError as error:
+        return jsonify({'error': str(error), 'imported': imported}), 400
+    except Exception as error:
+        return jsonify({'error': str(error), 'imported': imported}), 500
+
+
+# Start an online snapshot of the database in the background
+@car_management_routes.route('/admin/snapshot', methods=['POST'])
+@swag_from('../swagger/docs/create_snapshot.yml')
+def create_database_snapshot():
+    try:
+        if snapshot_in_progress() or not start_snapshot():
+            return jsonify({'error': 'A snapshot is already being taken'}), 409
+        return jsonify({'message': 'Snapshot started', 'snapshot': snapshot_info()}), 202
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+# Describe the current database snapshot and whether the heavy reads are served from it
+@car_management_routes.route('/admin/snapshot', methods=['GET'])
+@swag_from('../swagger/docs/get_snapshot.yml')
+def get_database_snapshot():
+    try:
+        return jsonify({
+            'snapshot': snapshot_info(),
+            'in_progress': snapshot_in_progress(),
+            'serving_reads': db_retrieve_snapshot_version() is not None,
+        }), 200
+    except Exception as error:
+        return jsonify({'error': str(error)}), 500
+
+
+def _import_chunk(cars, keep_ids):
+    written = db_import_cars(cars, keep_ids)
+    if written is None:
+        raise RuntimeError("Database error while importing")
+    return written
+
+
+# Read the list under key from the JSON body, returning (items, error_response)
+def _batch_items(key):
+    data = request.get_json(silent=True)
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({'error': f"Request body must be an object with a non-empty '{key}' list"}), 400)
+    if len(items) > MAX_BATCH_SIZE:
+        return None, (jsonify({'error': f'Batch size {len(items)} exceeds the limit of {MAX_BATCH_SIZE}'}), 413)
+    return items, None
+
+
+# Summarise per-item batch results; 207 signals that at least one item failed
+def _batch_response(results, success_status=200):
+    failed = sum(1 for result in results if result['status'] in ('error', 'not_found'))
+    body = {'succeeded': len(results) - failed, 'failed': failed, 'results': results}
+    return jsonify(body), (207 if failed else success_status)
@@ -1,15 +1,20 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 import os
+import time
 from database.initialize import init_db
 from api.routes import car_management_routes
 from swagger.config import init_swagger
-from flasgger import swag_from
+from api.json_provider import init_json_provider
+from monitoring.metrics import http_request_duration, render_metrics
 
 # Initialize Flask app
 app = Flask(__name__)
 
+# Serialize JSON responses with orjson when it is installed
+init_json_provider(app)
+
 # Initialize Swagger
-swagger = init_swagger(app)
+init_swagger(app)
 
 # Register the car_management_routes 
 app.register_blueprint(car_management_routes, url_prefix='/api/v1/car-management')
@@ -25,6 +30,11 @@ def home():
                 "endpoint": "/api/v1/",
                 "description": "Provides an overview of the API and its endpoints"
             },
+            {
+                "method": "GET",
+                "endpoint": "/metrics",
+                "description": "Prometheus metrics for the serving worker process"
+            },
             {
                 "method": "GET",
                 "endpoint": "/api/v1/car-management/all",
@@ -50,6 +60,61 @@ def home():
                 "endpoint": "/api/v1/car-management/car/location/<int:pickup_location_id>",
                 "description": "Retrieve cars by pickup location ID"
             },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/cars",
+                "description": "Retrieve cars by ids, purchase date and price ranges, optionally sorted and limited (top-k), or by a list of car IDs (?ids=)"
+            },
+            {
+                "method": "POST",
+                "endpoint": "/api/v1/car-management/cars/lookup",
+                "description": "Retrieve many cars by ID in request order, reporting the IDs not found"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/makes",
+                "description": "Retrieve all car makes"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/fuel-types",
+                "description": "Retrieve all fuel types"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/locations",
+                "description": "Retrieve all pickup locations"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/search",
+                "description": "Search make, fuel type and pickup location names, ranked, optionally with the matching cars"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/stats",
+                "description": "Retrieve fleet statistics"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/stats/<make|fuel|location>",
+                "description": "Retrieve fleet statistics grouped by make, fuel type or pickup location"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/changes",
+                "description": "Retrieve inserts, updates and deletes of cars since a version, optionally long-polling"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/export",
+                "description": "Export all cars as a gzip-compressed CSV or NDJSON stream"
+            },
+            {
+                "method": "POST",
+                "endpoint": "/api/v1/car-management/import",
+                "description": "Import cars from an export file in bounded transactions"
+            },
             {
                 "method": "POST",
                 "endpoint": "/api/v1/car-management/car",
@@ -64,11 +129,56 @@ def home():
                 "method": "PATCH",
                 "endpoint": "/api/v1/car-management/car/<int:id>",
                 "description": "Update pickup location of a car"
+            },
+            {
+                "method": "POST",
+                "endpoint": "/api/v1/car-management/cars/batch",
+                "description": "Add many cars in one transaction"
+            },
+            {
+                "method": "PATCH",
+                "endpoint": "/api/v1/car-management/cars/batch",
+                "description": "Update pickup location of many cars in one transaction"
+            },
+            {
+                "method": "DELETE",
+                "endpoint": "/api/v1/car-management/cars/batch",
+                "description": "Remove many cars by ID in one transaction"
+            },
+            {
+                "method": "POST",
+                "endpoint": "/api/v1/car-management/admin/snapshot",
+                "description": "Start an online snapshot of the database in the background"
+            },
+            {
+                "method": "GET",
+                "endpoint": "/api/v1/car-management/admin/snapshot",
+                "description": "Describe the current database snapshot and whether heavy reads are served from it"
             }
         ]
     })
 
 
+# Start the request timer
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Record request latency by route template, so /car/1 and /car/2 share a series.
+# Streamed responses are timed until their headers are ready.
+@app.after_request
+def record_request_latency(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_duration.observe(time.perf_counter() - started, (request.method, route, response.status_code))
+    return response
+
+# Prometheus metrics for this worker process
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 
 # Error handler for 404 not found
 @app.errorhandler(404)
@@ -0,0 +1,7 @@
+from api.asgi import AsgiApp
+from app import app as flask_app
+
+# ASGI entrypoint serving the same API as app.py, run with e.g.
+#   uvicorn asgi:app --host 0.0.0.0 --port 80 --workers 2
+# See "Serving over ASGI" in the README
+app = AsgiApp(flask_app)
@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from benchmarks.run import RESULTS_DIR, _git_commit
+from database import connection as db_connection
+
+# Routes, relative to the app root
+BASE = '/api/v1/car-management'
+
+# Repository root, where the servers are started
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Car written by the writer of the long-poll phase
+CAR = json.dumps({
+    'purchase_date': '2024-06-01', 'purchase_price': 500000.0,
+    'car_make_id': 1, 'fuel_type_id': 1, 'pickup_location_id': 1,
+}).encode()
+
+
+# Command line and environment of each serving setup, listening on port
+def _server(name, port, workers, threads):
+    if name == 'asgi':
+        command = ['uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(workers), '--log-level', 'warning']
+        return command, {'ASYNC_DB_THREADS': str(threads)}
+    command = ['gunicorn', '--config', 'gunicorn.conf.py', '--log-level', 'warning', 'app:app']
+    return command, {
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        'GUNICORN_WORKER_CLASS': name,
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_THREADS': str(threads),
+    }
+
+
+# A keep-alive HTTP/1.1 connection for requests with Content-Length
+# responses, reconnecting when the server closes it (gunicorn's sync workers
+# close every connection after its response)
+class Connection:
+    def __init__(self, port):
+        self.port = port
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=b''):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self._writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        try:
+            head = (await self._reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+        length = int(head.split('content-length:', 1)[1].split('\r\n', 1)[0])
+        payload = await self._reader.readexactly(length)
+        if 'connection: close' in head:
+            self.close()
+        return int(head.split(' ', 2)[1]), payload
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+# Latency statistics of a list of seconds, in milliseconds
+def _latencies(seconds):
+    seconds = sorted(seconds)
+    if not seconds:
+        return {'p50_ms': None, 'p99_ms': None}
+    return {
+        'p50_ms': round(seconds[len(seconds) // 2] * 1000, 2),
+        'p99_ms': round(seconds[max(int(len(seconds) * 0.99) - 1, 0)] * 1000, 2),
+    }
+
+
+# GET /car/<id> of random cars in a loop until the deadline
+async def _point_reader(port, cars, deadline, latencies, errors):
+    connection = Connection(port)
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            status, _ = await asyncio.wait_for(
+                connection.request('GET', f'{BASE}/car/{random.randint(1, cars)}'), deadline - time.monotonic() + 5
+            )
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+            connection.close()
+            errors.append('connection')
+            continue
+        if status == 200:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(status)
+    connection.close()
+
+
+# Follow GET /changes with long-polls until the deadline, recording how long
+# after each write's response its change reached this client
+async def _long_poller(port, since, wait, deadline, written, notified, errors):
+    connection = Connection(port)
+    while time.monotonic() < deadline:
+        try:
+            status, payload = await asyncio.wait_for(connection.request('GET', f'{BASE}/changes?since={since}&wait={wait}'), wait + 30)
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+            connection.close()
+            errors.append('connection')
+            await asyncio.sleep(0.1)
+            continue
+        received = time.monotonic()
+        if status != 200:
+            errors.append(status)
+            await asyncio.sleep(0.1)
+            continue
+        page = json.loads(payload)
+        for change in page['changes']:
+            if change['version'] in written:
+                notified.append(received - written[change['version']])
+        since = page['next_since']
+    connection.close()
+
+
+# Add a car every interval until the deadline, recording when each change version was written
+async def _writer(port, first_version, interval, deadline, written):
+    connection = Connection(port)
+    version = first_version
+    while time.monotonic() < deadline:
+        try:
+            status, _ = await asyncio.wait_for(connection.request('POST', f'{BASE}/car', CAR), deadline - time.monotonic())
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+            connection.close()
+            continue
+        if status == 201:
+            version += 1
+            written[version] = time.monotonic()
+        await asyncio.sleep(interval)
+    connection.close()
+
+
+# Point reads from clients concurrent connections for seconds, alongside
+# long_polls clients following the change feed while a car is written every
+# write_interval seconds. Requests still waiting when the phase ends are
+# abandoned, so a server that cannot keep up reports it instead of stalling.
+async def _phase(port, cars, clients, long_polls, seconds, wait, write_interval):
+    connection = Connection(port)
+    _, payload = await connection.request('GET', f'{BASE}/changes')
+    connection.close()
+    latest = json.loads(payload)['latest_version']
+
+    written, notified, poll_errors = {}, [], []
+    polls_deadline = time.monotonic() + seconds + 2
+    pollers = [
+        asyncio.create_task(_long_poller(port, latest, wait, polls_deadline, written, notified, poll_errors))
+        for _ in range(long_polls)
+    ]
+    if long_polls:
+        # Let the long-polls connect and start waiting
+        await asyncio.sleep(2)
+        writer = asyncio.create_task(_writer(port, latest, write_interval, polls_deadline - 1, written))
+
+    latencies, errors = [], []
+    started = time.monotonic()
+    await asyncio.gather(*(_point_reader(port, cars, started + seconds, latencies, errors) for _ in range(clients)))
+    elapsed = time.monotonic() - started
+
+    result = {
+        'point_reads': len(latencies),
+        'point_reads_per_second': round(len(latencies) / elapsed),
+        **_latencies(latencies),
+        'point_read_errors': len(errors),
+    }
+    if long_polls:
+        # The last write gets two seconds to reach the long-polls
+        await asyncio.sleep(max(polls_deadline + 1 - time.monotonic(), 0))
+        for task in (writer, *pollers):
+            task.cancel()
+        await asyncio.gather(writer, *pollers, return_exceptions=True)
+        expected = len(written) * long_polls
+        notify = _latencies(notified)
+        result.update({
+            'writes': len(written),
+            'notifications': len(notified),
+            'notified_fraction': round(len(notified) / expected, 3) if expected else None,
+            'notify_p50_ms': notify['p50_ms'],
+            'notify_p99_ms': notify['p99_ms'],
+            'long_poll_errors': len(poll_errors),
+        })
+    return result
+
+
+# Resident memory of a process and its children, in megabytes
+def _tree_rss_mb(pid):
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/status') as status:
+                total += next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as children:
+                    pids += [int(child) for child in children.read().split()]
+        except (FileNotFoundError, StopIteration):
+            continue
+    return round(total / 1024, 1)
+
+
+# Start a server on a fresh copy of the database and wait until it answers
+def _start(name, source, directory, port, workers, threads):
+    database = os.path.join(directory, f'{name}.db')
+    shutil.copyfile(source, database)
+    command, environment = _server(name, port, workers, threads)
+    process = subprocess.Popen(
+        command, cwd=ROOT, env=dict(os.environ, SQLITE_DB_PATH=database, **environment),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            _stop(process)
+            raise SystemExit(f"{name} exited: {process.stderr.read().decode()}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/v1/', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    _stop(process)
+    raise SystemExit(f"{name} did not start")
+
+
+# Kill a server with its workers; a graceful stop would wait for abandoned long-polls
+def _stop(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the gunicorn worker models with the ASGI app under point reads and long-polls.")
+    parser.add_argument('--database', help="benchmark database, e.g. from benchmarks.generate_fleet (default: SQLITE_DB_PATH)")
+    parser.add_argument('--servers', default='sync,gthread,asgi', help="comma-separated setups to measure: sync, gthread, asgi (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes of every setup (default: %(default)s)")
+    parser.add_argument('--threads', type=int, default=8, help="gthread threads and ASYNC_DB_THREADS per worker (default: %(default)s)")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent point-read connections (default: %(default)s)")
+    parser.add_argument('--long-polls', type=int, default=500, help="concurrent GET /changes long-poll clients (default: %(default)s)")
+    parser.add_argument('--wait', type=int, default=10, help="wait= of each long-poll, in seconds (default: %(default)s)")
+    parser.add_argument('--write-interval', type=float, default=0.5, help="seconds between the writes the long-polls follow (default: %(default)s)")
+    parser.add_argument('--seconds', type=float, default=10, help="length of each phase (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=8700, help="first port to listen on (default: %(default)s)")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>-asgi.json)")
+    args = parser.parse_args(argv)
+
+    source = os.path.abspath(args.database or db_connection.SQLITE_DB_PATH)
+    with sqlite3.connect(source) as connection:
+        cars = connection.execute("SELECT MAX(id) FROM car_management").fetchone()[0]
+
+    results = {}
+    print(f"{'setup':<9} {'phase':<11} {'reads/s':>8} {'p50 ms':>8} {'p99 ms':>9} {'errors':>7} "
+          f"{'writes':>7} {'notified':>9} {'notify p50':>11} {'notify p99':>11} {'RSS MB':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for offset, name in enumerate(args.servers.split(',')):
+            port = args.port + offset
+            process = _start(name, source, directory, port, args.workers, args.threads)
+            try:
+                results[name] = {}
+                for phase, long_polls in (('reads', 0), ('long-polls', args.long_polls)):
+                    result = asyncio.run(_phase(port, cars, args.clients, long_polls, args.seconds, args.wait, args.write_interval))
+                    result['server_rss_mb'] = _tree_rss_mb(process.pid)
+                    results[name][phase] = result
+                    notified = f"{result['notified_fraction']:.0%}" if result.get('notified_fraction') is not None else ''
+                    print(f"{name:<9} {phase:<11} {result['point_reads_per_second']:>8} {result['p50_ms']!s:>8} {result['p99_ms']!s:>9} "
+                          f"{result['point_read_errors'] + result.get('long_poll_errors', 0):>7} {result.get('writes', ''):>7} {notified:>9} "
+                          f"{result.get('notify_p50_ms') or '':>11} {result.get('notify_p99_ms') or '':>11} {result['server_rss_mb']:>7}")
+            finally:
+                _stop(process)
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'workers': args.workers,
+        'threads': args.threads,
+        'clients': args.clients,
+        'long_polls': args.long_polls,
+        'wait': args.wait,
+        'seconds': args.seconds,
+        'setups': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}-asgi.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from benchmarks.run import RESULTS_DIR, _git_commit
+from database import connection as db_connection
+
+# Export and import routes, relative to the app root
+BASE = '/api/v1/car-management'
+
+
+# Samples the process's anonymous resident memory (heap and stacks, without
+# the memory-mapped database file) while a phase runs and keeps the peak
+class MemorySampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.peak_mb = _anonymous_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _anonymous_rss_mb())
+
+
+def _anonymous_rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('RssAnon:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+# Stream GET /export into a file and return its statistics
+def _export(client, export_format, compression, path, cars):
+    with MemorySampler() as memory:
+        started = time.perf_counter()
+        response = client.get(f'{BASE}/export?format={export_format}&compression={compression}', buffered=False)
+        if response.status_code != 200:
+            raise SystemExit(f"Export failed with {response.status_code}")
+        size = 0
+        with open(path, 'wb') as file:
+            for chunk in response.response:
+                file.write(chunk)
+                size += len(chunk)
+        response.close()
+        seconds = time.perf_counter() - started
+    return {
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(cars / seconds),
+        'bytes': size,
+        'megabytes_per_second': round(size / seconds / 1e6, 1),
+        'peak_heap_mb': memory.peak_mb,
+    }
+
+
+# Stream a file into POST /import on an empty database and return its statistics
+def _import(client, export_format, path):
+    with MemorySampler() as memory, open(path, 'rb') as file:
+        started = time.perf_counter()
+        response = client.post(
+            f'{BASE}/import?format={export_format}',
+            input_stream=file,
+            headers={'Content-Length': str(os.path.getsize(path))},
+        )
+        seconds = time.perf_counter() - started
+    if response.status_code != 201:
+        raise SystemExit(f"Import failed with {response.status_code}: {response.get_json()}")
+    imported = response.get_json()['imported']
+    return {
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(imported / seconds),
+        'rows': imported,
+        'peak_heap_mb': memory.peak_mb,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure streaming export and import throughput and memory.")
+    parser.add_argument('--database', help="database to export, e.g. from benchmarks.generate_fleet (default: SQLITE_DB_PATH)")
+    parser.add_argument('--formats', default='csv,ndjson', help="comma-separated formats to measure (default: %(default)s)")
+    parser.add_argument('--compression', choices=('gzip', 'none'), default='gzip', help="export compression (default: %(default)s)")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>-bulk.json)")
+    args = parser.parse_args(argv)
+
+    source = os.path.abspath(args.database or db_connection.SQLITE_DB_PATH)
+    db_connection.SQLITE_DB_PATH = source
+
+    # Imported after the database path is set
+    from app import app
+    from database.initialize import init_schema
+    from repositories.dimension_cache import dimension_cache
+    init_schema()
+    client = app.test_client()
+    cars = db_connection.get_connection().execute("SELECT COUNT(*) FROM car_management").fetchone()[0]
+    baseline_heap = _anonymous_rss_mb()
+
+    results = {}
+    print(f"{cars} cars, heap after start-up {baseline_heap} MB\n")
+    print(f"{'phase':<16} {'seconds':>9} {'rows/s':>10} {'MB':>8} {'MB/s':>7} {'peak heap MB':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        for export_format in args.formats.split(','):
+            path = os.path.join(directory, f'cars.{export_format}')
+            db_connection.close_connection()
+            db_connection.SQLITE_DB_PATH = source
+            dimension_cache.clear()
+            exported = _export(client, export_format, args.compression, path, cars)
+            print(f"{'export ' + export_format:<16} {exported['seconds']:>9} {exported['rows_per_second']:>10} "
+                  f"{exported['bytes'] / 1e6:>8.1f} {exported['megabytes_per_second']:>7} {exported['peak_heap_mb']:>13}")
+
+            # Import into a fresh database, as when moving a fleet to a new environment
+            db_connection.close_connection()
+            db_connection.SQLITE_DB_PATH = os.path.join(directory, f'import-{export_format}.db')
+            dimension_cache.clear()
+            init_schema()
+            imported = _import(client, export_format, path)
+            print(f"{'import ' + export_format:<16} {imported['seconds']:>9} {imported['rows_per_second']:>10} "
+                  f"{'':>8} {'':>7} {imported['peak_heap_mb']:>13}")
+            results[export_format] = {'export': exported, 'import': imported}
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cars': cars,
+        'compression': args.compression,
+        'baseline_heap_mb': baseline_heap,
+        'formats': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}-bulk.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
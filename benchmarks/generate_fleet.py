@@ -0,0 +1,173 @@
+import argparse
+import csv
+import datetime
+import os
+import sqlite3
+import time
+import numpy as np
+from database import connection as db_connection
+from database.connection import create_connection
+
+# Makes and pickup locations of the bundled data set, most frequent first,
+# followed by further real names so large fleets get a realistic long tail
+CAR_MAKES = [
+    'Porsche', 'Bmw', 'Land rover', 'Kia', 'Tesla', 'Volvo', 'Volkswagen', 'Ford',
+    'Chevrolet', 'Hyundai', 'Mitsubishi', 'Renault', 'Smart', 'Jaguar',
+    'Toyota', 'Audi', 'Mercedes-benz', 'Skoda', 'Peugeot', 'Nissan', 'Opel', 'Citroen',
+    'Seat', 'Cupra', 'Mazda', 'Polestar', 'Fiat', 'Dacia', 'Suzuki', 'Mini',
+    'Lexus', 'Subaru', 'Honda', 'Alfa romeo', 'Jeep', 'Mg', 'Byd', 'Nio', 'Lynk & co', 'Ds',
+]
+PICKUP_LOCATIONS = [
+    'Aarhus', 'Copenhagen', 'Kolding', 'Odense', 'Aalborg', 'Esbjerg', 'Randers', 'Vejle',
+    'Horsens', 'Roskilde', 'Herning', 'Silkeborg', 'Naestved', 'Fredericia', 'Viborg',
+    'Holstebro', 'Koege', 'Slagelse', 'Hilleroed', 'Svendborg', 'Soenderborg', 'Hjoerring',
+    'Frederikshavn', 'Helsingoer', 'Holbaek',
+]
+
+# Fuel type ids as seeded by init_db, weighted like the bundled data set
+FUEL_TYPE_IDS = np.array([1, 2, 3, 4])
+FUEL_TYPE_NAMES = ['Benzin', 'Diesel', 'Elektrisk', 'Hybrid']
+FUEL_TYPE_WEIGHTS = np.array([9, 6, 11, 3]) / 29
+
+# Median purchase price per make in the bundled data set; other makes use the overall median
+MEDIAN_PRICES = {
+    'Bmw': 703528, 'Chevrolet': 190000, 'Ford': 647903, 'Hyundai': 711984, 'Jaguar': 780000,
+    'Kia': 445246, 'Land rover': 1400000, 'Mitsubishi': 350000, 'Porsche': 1504761,
+    'Renault': 540000, 'Smart': 680000, 'Tesla': 875167, 'Volkswagen': 325000, 'Volvo': 568500,
+}
+DEFAULT_MEDIAN_PRICE = 640000
+
+# Purchase dates are spread uniformly over this range
+FIRST_PURCHASE_DATE = datetime.date(2015, 1, 1)
+LAST_PURCHASE_DATE = datetime.date(2024, 12, 31)
+
+# Rows generated and written per batch
+CHUNK_SIZE = 100000
+
+
+# Zipf-like weights, so a few makes and locations dominate as in real fleets
+def _zipf_weights(count, exponent=1.1):
+    weights = 1 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+# Yield (purchase_dates, purchase_prices, make_indexes, fuel_type_ids, location_indexes) arrays per chunk
+def generate_chunks(cars, makes, locations, seed=42):
+    rng = np.random.default_rng(seed)
+    make_weights = _zipf_weights(makes)
+    location_weights = _zipf_weights(locations)
+    medians = np.array([MEDIAN_PRICES.get(name, DEFAULT_MEDIAN_PRICE) for name in CAR_MAKES[:makes]], dtype=float)
+    first_day = FIRST_PURCHASE_DATE.toordinal()
+    day_span = LAST_PURCHASE_DATE.toordinal() - first_day + 1
+
+    remaining = cars
+    while remaining > 0:
+        size = min(CHUNK_SIZE, remaining)
+        remaining -= size
+
+        make_indexes = rng.choice(makes, size=size, p=make_weights)
+        location_indexes = rng.choice(locations, size=size, p=location_weights)
+        fuel_type_ids = rng.choice(FUEL_TYPE_IDS, size=size, p=FUEL_TYPE_WEIGHTS)
+        prices = np.round(medians[make_indexes] * rng.lognormal(0, 0.35, size=size), -3)
+        days = first_day + rng.integers(0, day_span, size=size)
+        dates = np.array(
+            [datetime.date.fromordinal(int(day)).isoformat() for day in days]
+        )
+        yield dates, prices, make_indexes, fuel_type_ids, location_indexes
+
+
+# Generate a synthetic fleet straight into the car management database
+def generate_database(cars, makes, locations, seed=42, progress=True):
+    # Imported here so the generator does not pull in the CSV loader when writing CSV only
+    from database.initialize import init_schema
+    init_schema()
+
+    connection = create_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.executemany("INSERT OR IGNORE INTO car_make (car_make_name) VALUES (?)", [(name,) for name in CAR_MAKES[:makes]])
+        cursor.executemany("INSERT OR IGNORE INTO pickup_location (pickup_location_name) VALUES (?)", [(name,) for name in PICKUP_LOCATIONS[:locations]])
+        connection.commit()
+
+        cursor.execute("SELECT car_make_name, car_make_id FROM car_make")
+        make_ids = dict(cursor.fetchall())
+        cursor.execute("SELECT pickup_location_name, pickup_location_id FROM pickup_location")
+        location_ids = dict(cursor.fetchall())
+        make_id_array = np.array([make_ids[name] for name in CAR_MAKES[:makes]])
+        location_id_array = np.array([location_ids[name] for name in PICKUP_LOCATIONS[:locations]])
+
+        written = 0
+        started = time.perf_counter()
+        for dates, prices, make_indexes, fuel_type_ids, location_indexes in generate_chunks(cars, makes, locations, seed):
+            cursor.executemany(
+                """
+                INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                zip(
+                    dates.tolist(),
+                    prices.tolist(),
+                    make_id_array[make_indexes].tolist(),
+                    fuel_type_ids.tolist(),
+                    location_id_array[location_indexes].tolist(),
+                )
+            )
+            connection.commit()
+            written += len(dates)
+            if progress:
+                elapsed = time.perf_counter() - started
+                print(f"{written} cars written ({written / elapsed:,.0f} rows/s)")
+
+        connection.execute("ANALYZE")
+        return written
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+    finally:
+        connection.close()
+
+
+# Generate a synthetic fleet as a CSV file in the Bilabonnement column layout
+def generate_csv(path, cars, makes, locations, seed=42, progress=True):
+    written = 0
+    started = time.perf_counter()
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Dato Indkoeb', 'Bilmaerke', 'Indkoebspris', 'Braendstof', 'Udleveringssted'])
+        for dates, prices, make_indexes, fuel_type_ids, location_indexes in generate_chunks(cars, makes, locations, seed):
+            writer.writerows(zip(
+                dates.tolist(),
+                [CAR_MAKES[index] for index in make_indexes],
+                prices.astype(int).tolist(),
+                [FUEL_TYPE_NAMES[fuel_type_id - 1] for fuel_type_id in fuel_type_ids],
+                [PICKUP_LOCATIONS[index] for index in location_indexes],
+            ))
+            written += len(dates)
+            if progress:
+                elapsed = time.perf_counter() - started
+                print(f"{written} cars written ({written / elapsed:,.0f} rows/s)")
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic car fleet shaped like the Bilabonnement data set.")
+    parser.add_argument('--cars', type=int, default=10000, help="number of cars to generate, e.g. 10000, 1000000 or 10000000 (default: %(default)s)")
+    parser.add_argument('--makes', type=int, default=len(CAR_MAKES), choices=range(1, len(CAR_MAKES) + 1), metavar=f"1..{len(CAR_MAKES)}", help="number of distinct makes (default: %(default)s)")
+    parser.add_argument('--locations', type=int, default=len(PICKUP_LOCATIONS), choices=range(1, len(PICKUP_LOCATIONS) + 1), metavar=f"1..{len(PICKUP_LOCATIONS)}", help="number of distinct pickup locations (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed (default: %(default)s)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--database', help="SQLite database to append cars to (default: SQLITE_DB_PATH)")
+    target.add_argument('--csv', help="write a CSV file for `python -m database.ingest` instead of a database")
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        generate_csv(args.csv, args.cars, args.makes, args.locations, args.seed)
+        return 0
+
+    if args.database:
+        db_connection.SQLITE_DB_PATH = args.database
+    print(f"Generating {args.cars} cars into {os.path.abspath(db_connection.SQLITE_DB_PATH)}")
+    return 0 if generate_database(args.cars, args.makes, args.locations, args.seed) is not None else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
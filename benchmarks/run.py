@@ -0,0 +1,354 @@
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.generate_fleet import FIRST_PURCHASE_DATE, LAST_PURCHASE_DATE
+from database import connection as db_connection
+
+# Directory the JSON results are written to, one file per commit and mode
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Route prefix of the car management blueprint
+API = '/api/v1/car-management'
+
+# Items per request for the batch scenarios
+BATCH_SIZE = 100
+
+
+# Ids and dimension values sampled by the scenarios, read once from the database
+class Fleet:
+    def __init__(self, connection):
+        self.min_id, self.max_id = connection.execute("SELECT MIN(id), MAX(id) FROM car_management").fetchone()
+        if self.max_id is None:
+            raise SystemExit("The benchmark database is empty; run `python -m benchmarks.generate_fleet` first")
+        self.count = connection.execute("SELECT COUNT(*) FROM car_management").fetchone()[0]
+        self.make_ids = [row[0] for row in connection.execute("SELECT car_make_id FROM car_make")]
+        self.fuel_type_ids = [row[0] for row in connection.execute("SELECT fuel_type_id FROM fuel_types")]
+        self.location_ids = [row[0] for row in connection.execute("SELECT pickup_location_id FROM pickup_location")]
+        # The location with the most cars, which every client of a burst asks for at once
+        self.busiest_location_id = connection.execute(
+            "SELECT pickup_location_id FROM car_management GROUP BY pickup_location_id ORDER BY COUNT(*) DESC LIMIT 1"
+        ).fetchone()[0]
+        # Cars created by the add scenarios are numbered from here and removed by the delete scenarios
+        self.next_deleted_id = self.max_id + 1
+        self._lock = threading.Lock()
+
+    def car_id(self):
+        return random.randint(self.min_id, self.max_id)
+
+    # A random window of purchase dates within the span of the generated fleet, as query parameters
+    def purchase_date_range(self, days=30):
+        first = FIRST_PURCHASE_DATE + datetime.timedelta(days=random.randint(0, (LAST_PURCHASE_DATE - FIRST_PURCHASE_DATE).days - days))
+        return f'purchase_date_from={first.isoformat()}&purchase_date_to={(first + datetime.timedelta(days=days)).isoformat()}'
+
+    def new_car(self):
+        return {
+            'purchase_date': '2024-06-01',
+            'purchase_price': 500000.0,
+            'car_make_id': random.choice(self.make_ids),
+            'fuel_type_id': random.choice(self.fuel_type_ids),
+            'pickup_location_id': random.choice(self.location_ids),
+        }
+
+    def location_update(self):
+        return {'pickup_location_id': random.choice(self.location_ids)}
+
+    # Reserve ids of cars created earlier in the run, oldest first
+    def ids_to_delete(self, count):
+        with self._lock:
+            first = self.next_deleted_id
+            self.next_deleted_id += count
+        return list(range(first, first + count))
+
+
+# A benchmarked operation. `run(client, fleet)` performs one request or call and
+# returns an HTTP-like status; `weight` scales the request count for bulk scenarios.
+class Scenario:
+    def __init__(self, name, run, weight=1.0, kind='http'):
+        self.name = name
+        self.run = run
+        self.weight = weight
+        self.kind = kind
+
+
+def _http(method, path, body=None):
+    return lambda client, fleet: client.request(method, path(fleet) if callable(path) else path, body(fleet) if callable(body) else body)
+
+
+def _repository(function):
+    return lambda client, fleet: 200 if function(fleet) is not None else 500
+
+
+def _repository_scenarios():
+    # Imported lazily so the database path is set before any connection is opened
+    from repositories import repository
+
+    return [
+        Scenario('repo.db_retrieve_car_by_id', _repository(lambda fleet: repository.db_retrieve_car_by_id(fleet.car_id())), kind='repository'),
+        Scenario('repo.db_retrieve_cars_page', _repository(lambda fleet: repository.db_retrieve_cars_page(100, fleet.car_id())), kind='repository'),
+        Scenario('repo.db_retrieve_all_cars', _repository(lambda fleet: repository.db_retrieve_all_cars()), weight=0.005, kind='repository'),
+        Scenario('repo.db_iter_all_cars', _repository(lambda fleet: sum(len(cars) for cars in repository.db_iter_all_cars())), weight=0.005, kind='repository'),
+        Scenario('repo.db_retrieve_car_by_make', _repository(lambda fleet: repository.db_retrieve_car_by_make(random.choice(fleet.make_ids))), weight=0.05, kind='repository'),
+        Scenario('repo.db_retrieve_car_by_fuel_type', _repository(lambda fleet: repository.db_retrieve_car_by_fuel_type(random.choice(fleet.fuel_type_ids))), weight=0.01, kind='repository'),
+        Scenario('repo.db_retrieve_car_by_pickup_location', _repository(lambda fleet: repository.db_retrieve_car_by_pickup_location(random.choice(fleet.location_ids))), weight=0.05, kind='repository'),
+        Scenario('repo.db_retrieve_cars_by_filters', _repository(lambda fleet: repository.db_retrieve_cars_by_filters(random.choice(fleet.make_ids), random.choice(fleet.fuel_type_ids), random.choice(fleet.location_ids))), kind='repository'),
+        Scenario('repo.db_retrieve_cars_by_filters top-k', _repository(lambda fleet: repository.db_retrieve_cars_by_filters(pickup_location_id=random.choice(fleet.location_ids), sort='purchase_price', descending=True, limit=50)), kind='repository'),
+        Scenario('repo.db_retrieve_car_stats', _repository(lambda fleet: repository.db_retrieve_car_stats('pickup_location_id')), kind='repository'),
+        Scenario('repo.db_retrieve_table_generation', _repository(lambda fleet: repository.db_retrieve_table_generation('car_management')), kind='repository'),
+        Scenario('repo.db_add_new_car', _repository(lambda fleet: repository.db_add_new_car(fleet.new_car())), kind='repository'),
+        Scenario('repo.db_update_pickup_location', _repository(lambda fleet: repository.db_update_pickup_location(fleet.car_id(), fleet.location_update())), kind='repository'),
+        Scenario('repo.db_remove_car_by_id', _repository(lambda fleet: repository.db_remove_car_by_id(fleet.ids_to_delete(1)[0])), kind='repository'),
+        Scenario('repo.db_add_new_cars', _repository(lambda fleet: repository.db_add_new_cars([fleet.new_car() for _ in range(BATCH_SIZE)])), weight=0.1, kind='repository'),
+        Scenario('repo.db_update_pickup_locations', _repository(lambda fleet: repository.db_update_pickup_locations([{'id': fleet.car_id(), **fleet.location_update()} for _ in range(BATCH_SIZE)])), weight=0.1, kind='repository'),
+        Scenario('repo.db_remove_cars_by_id', _repository(lambda fleet: repository.db_remove_cars_by_id(fleet.ids_to_delete(BATCH_SIZE))), weight=0.1, kind='repository'),
+    ]
+
+
+# Every route of the API, in an order where deletes only remove cars added earlier in the run
+def _http_scenarios():
+    return [
+        Scenario('GET /api/v1/', _http('GET', '/api/v1/')),
+        Scenario('GET /all', _http('GET', f'{API}/all'), weight=0.005),
+        Scenario('GET /all?limit=100', _http('GET', lambda fleet: f'{API}/all?limit=100&after={fleet.car_id()}')),
+        Scenario('GET /all?stream=ndjson', _http('GET', f'{API}/all?stream=ndjson'), weight=0.005),
+        Scenario('GET /car/<id>', _http('GET', lambda fleet: f'{API}/car/{fleet.car_id()}')),
+        Scenario('GET /car/make/<id>', _http('GET', lambda fleet: f'{API}/car/make/{random.choice(fleet.make_ids)}'), weight=0.05),
+        Scenario('GET /car/fuel/<id>', _http('GET', lambda fleet: f'{API}/car/fuel/{random.choice(fleet.fuel_type_ids)}'), weight=0.01),
+        Scenario('GET /car/location/<id>', _http('GET', lambda fleet: f'{API}/car/location/{random.choice(fleet.location_ids)}'), weight=0.05),
+        Scenario('GET /car/location/<busiest>', _http('GET', lambda fleet: f'{API}/car/location/{fleet.busiest_location_id}'), weight=0.05),
+        Scenario('GET /cars', _http('GET', lambda fleet: f'{API}/cars?car_make_id={random.choice(fleet.make_ids)}&fuel_type_id={random.choice(fleet.fuel_type_ids)}&pickup_location_id={random.choice(fleet.location_ids)}')),
+        Scenario('GET /cars top-k at location', _http('GET', lambda fleet: f'{API}/cars?pickup_location_id={random.choice(fleet.location_ids)}&sort=-purchase_price&limit=50')),
+        Scenario('GET /cars date range', _http('GET', lambda fleet: f'{API}/cars?{fleet.purchase_date_range()}&sort=purchase_date&limit=100')),
+        Scenario('GET /cars price range', _http('GET', lambda fleet: f'{API}/cars?min_price={random.randint(100, 1500) * 1000}&sort=purchase_price&limit=100')),
+        Scenario('GET /stats', _http('GET', f'{API}/stats')),
+        Scenario('GET /stats/location', _http('GET', f'{API}/stats/location')),
+        Scenario('POST /car', _http('POST', f'{API}/car', lambda fleet: fleet.new_car())),
+        Scenario('PATCH /car/<id>', _http('PATCH', lambda fleet: f'{API}/car/{fleet.car_id()}', lambda fleet: fleet.location_update())),
+        Scenario('DELETE /car/<id>', _http('DELETE', lambda fleet: f'{API}/car/{fleet.ids_to_delete(1)[0]}')),
+        Scenario('POST /cars/batch', _http('POST', f'{API}/cars/batch', lambda fleet: {'cars': [fleet.new_car() for _ in range(BATCH_SIZE)]}), weight=0.1),
+        Scenario('PATCH /cars/batch', _http('PATCH', f'{API}/cars/batch', lambda fleet: {'cars': [{'id': fleet.car_id(), **fleet.location_update()} for _ in range(BATCH_SIZE)]}), weight=0.1),
+        Scenario('DELETE /cars/batch', _http('DELETE', f'{API}/cars/batch', lambda fleet: {'ids': fleet.ids_to_delete(BATCH_SIZE)}), weight=0.1),
+    ]
+
+
+# Drives the Flask app in-process through its test client (one client per thread)
+class InProcessClient:
+    def __init__(self):
+        from app import app
+        self._app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.open(path, method=method, json=body)
+        response.close()
+        return response.status_code
+
+
+# Drives a running HTTP server, such as a local gunicorn
+class HttpClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+
+# Start gunicorn with the production config (gunicorn.conf.py) against the
+# benchmark database and wait until it answers
+def start_gunicorn(port, workers, database, worker_class='sync', threads=4):
+    environment = dict(os.environ, SQLITE_DB_PATH=database, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_THREADS=str(threads))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'app:app'],
+        cwd=os.path.join(os.path.dirname(__file__), '..'),
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    client = HttpClient('127.0.0.1', port)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if client.request('GET', '/api/v1/') == 200:
+                return process, client
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit("gunicorn did not start within 30 seconds")
+
+
+def _load_fleet(database):
+    connection = sqlite3.connect(database)
+    try:
+        return Fleet(connection)
+    finally:
+        connection.close()
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Run one scenario `requests` times over `concurrency` threads and summarise it
+def run_scenario(scenario, client, fleet, requests, concurrency):
+    requests = max(1, int(requests * scenario.weight))
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(count):
+        nonlocal errors
+        local_latencies = []
+        local_errors = 0
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                status = scenario.run(client, fleet)
+            except Exception:
+                status = 599
+            local_latencies.append(time.perf_counter() - started)
+            if status >= 500:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    threads = max(1, min(concurrency, requests))
+    shares = [requests // threads + (1 if index < requests % threads else 0) for index in range(threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, shares))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    milliseconds = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': milliseconds(_percentile(latencies, 50)),
+        'p95_ms': milliseconds(_percentile(latencies, 95)),
+        'p99_ms': milliseconds(_percentile(latencies, 99)),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(__file__), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _print_results(mode, results):
+    print(f"\n{mode}")
+    print(f"{'scenario':<44} {'reqs':>7} {'err':>5} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, result in results.items():
+        print(f"{name:<44} {result['requests']:>7} {result['errors']:>5} {result['throughput_rps']:>10} "
+              f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every route and repository function of the car management API.")
+    parser.add_argument('--database', help="benchmark database, e.g. from benchmarks.generate_fleet (default: SQLITE_DB_PATH)")
+    parser.add_argument('--mode', choices=['inprocess', 'gunicorn', 'both'], default='inprocess', help="how to drive the API (default: %(default)s)")
+    parser.add_argument('--requests', type=int, default=2000, help="requests per scenario before weighting (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=1, help="client threads (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="gunicorn workers (default: CPU count)")
+    parser.add_argument('--worker-class', choices=['sync', 'gthread'], default='sync', help="gunicorn worker model (default: %(default)s)")
+    parser.add_argument('--threads', type=int, default=4, help="threads per gthread worker (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=8765, help="gunicorn port (default: %(default)s)")
+    parser.add_argument('--only', help="run only scenarios whose name contains this text")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>-<mode>.json)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    if args.database:
+        db_connection.SQLITE_DB_PATH = args.database
+    database = os.path.abspath(db_connection.SQLITE_DB_PATH)
+
+    # Benchmark the current schema, including indexes added since the database was generated
+    from database.initialize import init_schema
+    init_schema()
+
+    commit = _git_commit()
+    modes = ['inprocess', 'gunicorn'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        scenarios = _http_scenarios()
+        process = None
+        if mode == 'inprocess':
+            client = InProcessClient()
+            scenarios += _repository_scenarios()
+        else:
+            process, client = start_gunicorn(args.port, args.workers, database, args.worker_class, args.threads)
+
+        cars = _load_fleet(database).count
+        try:
+            results = {}
+            kind = None
+            for scenario in scenarios:
+                if args.only and args.only not in scenario.name:
+                    continue
+                # Re-read per group of scenarios, because the previous group's
+                # deletes free the ids its adds used and SQLite reuses them
+                if scenario.kind != kind:
+                    fleet = _load_fleet(database)
+                    kind = scenario.kind
+                results[scenario.name] = run_scenario(scenario, client, fleet, args.requests, args.concurrency)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+        _print_results(mode, results)
+        report = {
+            'commit': commit,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'mode': mode,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpu_count': os.cpu_count(),
+            'cars': cars,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'workers': args.workers if mode == 'gunicorn' else None,
+            'worker_class': args.worker_class if mode == 'gunicorn' else None,
+            'threads': args.threads if mode == 'gunicorn' and args.worker_class == 'gthread' else None,
+            'scenarios': results,
+        }
+        output = args.output if args.output and len(modes) == 1 else os.path.join(RESULTS_DIR, f'{commit}-{mode}.json')
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,155 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.run import RESULTS_DIR, _git_commit
+from database import connection as db_connection
+
+# Reads timed after the write phase, as (name, repository function name, keyword arguments)
+READS = (
+    ('car by id', 'db_retrieve_car_by_id', {'id': 1}),
+    ('cars at a location', 'db_retrieve_car_by_pickup_location', {'pickup_location_id': 1}),
+    ('cars of a make', 'db_retrieve_car_by_make', {'car_make_id': 1}),
+    ('top 50 by price', 'db_retrieve_cars_by_filters', {'sort': 'purchase_price', 'descending': True, 'limit': 50}),
+    ('stats by location', 'db_retrieve_filtered_car_stats', {'dimension': 'pickup_location_id'}),
+    ('all cars', 'db_retrieve_all_cars', {}),
+)
+
+
+# Write single cars at one pickup location for a fixed time: each round adds
+# a car and moves it to a second location, which lies in the same shard
+def _writer(location_id, other_location_id, seconds, start, queue):
+    from repositories import repository
+
+    car = {
+        'purchase_date': '2024-06-01', 'purchase_price': 500000.0,
+        'car_make_id': 1, 'fuel_type_id': 1, 'pickup_location_id': location_id,
+    }
+    latencies = []
+    start.wait()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        if repository.db_add_new_car(car) is None:
+            raise SystemExit("Write failed")
+        latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        page = repository.db_retrieve_cars_by_filters(pickup_location_id=location_id, sort='id', descending=True, limit=1)
+        if repository.db_update_pickup_location(page[0]['id'], {'pickup_location_id': other_location_id}) is None:
+            raise SystemExit("Write failed")
+        latencies.append(time.perf_counter() - started)
+    queue.put(latencies)
+
+
+# Measure one storage layout in this process; SHARD_COUNT and SQLITE_DB_PATH come from the environment
+def _measure(writers, seconds, runs):
+    from database.initialize import init_db
+    from database.shards import SHARD_COUNT
+    from repositories import repository
+
+    started = time.perf_counter()
+    init_db()
+    init_seconds = time.perf_counter() - started
+
+    # Writer i works at locations i + 1 and i + 1 + SHARD_COUNT, so with at
+    # least as many shards as writers every writer has a shard to itself
+    spread = SHARD_COUNT or writers
+    context = multiprocessing.get_context('fork')
+    start, queue = context.Event(), context.Queue()
+    processes = [
+        context.Process(target=_writer, args=(index + 1, index + 1 + spread, seconds, start, queue))
+        for index in range(writers)
+    ]
+    for process in processes:
+        process.start()
+    start.set()
+    latencies = sorted(latency for _ in processes for latency in queue.get())
+    for process in processes:
+        process.join()
+
+    reads = {}
+    for name, function, arguments in READS:
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            getattr(repository, function)(**arguments)
+            timings.append(time.perf_counter() - started)
+        reads[name] = round(statistics.median(timings) * 1000, 3)
+
+    return {
+        'shards': SHARD_COUNT,
+        'partition_seconds': round(init_seconds, 2),
+        'writes': len(latencies),
+        'writes_per_second': round(len(latencies) / seconds),
+        'write_p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'write_p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        'read_p50_ms': reads,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare write throughput and read latency of the single-file and partitioned storage layouts.")
+    parser.add_argument('--database', help="benchmark database, e.g. from benchmarks.generate_fleet (default: SQLITE_DB_PATH)")
+    parser.add_argument('--shards', type=int, default=4, help="SHARD_COUNT of the partitioned layout (default: %(default)s)")
+    parser.add_argument('--writers', type=int, default=4, help="concurrent writer processes, one location each (default: %(default)s)")
+    parser.add_argument('--seconds', type=float, default=10, help="length of the write phase (default: %(default)s)")
+    parser.add_argument('--runs', type=int, default=20, help="timed runs per read (default: %(default)s)")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>-shards.json)")
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(_measure(args.writers, args.seconds, args.runs)))
+        return 0
+
+    source = os.path.abspath(args.database or db_connection.SQLITE_DB_PATH)
+    results = {}
+    print(f"{'layout':<14} {'writes/s':>9} {'p50 ms':>8} {'p99 ms':>8}   read p50 ms")
+    with tempfile.TemporaryDirectory() as directory:
+        for shards in (0, args.shards):
+            # Each layout starts from a fresh copy, measured in its own process
+            # because SHARD_COUNT is read when the modules are imported
+            database = os.path.join(directory, f'layout{shards}.db')
+            shutil.copyfile(source, database)
+            environment = dict(os.environ, SQLITE_DB_PATH=database, SHARD_COUNT=str(shards))
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.shards', '--measure', '--writers', str(args.writers),
+                 '--seconds', str(args.seconds), '--runs', str(args.runs)],
+                cwd=os.path.join(os.path.dirname(__file__), '..'), env=environment, capture_output=True, text=True, check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            name = f'{shards} shards' if shards else 'single file'
+            results[name] = result
+            reads = ', '.join(f'{read} {milliseconds}' for read, milliseconds in result['read_p50_ms'].items())
+            print(f"{name:<14} {result['writes_per_second']:>9} {result['write_p50_ms']:>8} {result['write_p99_ms']:>8}   {reads}")
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'writers': args.writers,
+        'seconds': args.seconds,
+        'synchronous': db_connection.SQLITE_SYNCHRONOUS,
+        'layouts': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}-shards.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
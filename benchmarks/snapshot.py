@@ -0,0 +1,114 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from benchmarks.generate_fleet import FIRST_PURCHASE_DATE, LAST_PURCHASE_DATE
+from benchmarks.run import RESULTS_DIR, _git_commit
+from database import connection as db_connection
+
+
+# Analytical query shapes, each a function of the random generator returning
+# (repository function name, keyword arguments)
+def _queries(make_ids, location_ids):
+    def date_window(rng, days):
+        first = FIRST_PURCHASE_DATE + datetime.timedelta(days=rng.randint(0, (LAST_PURCHASE_DATE - FIRST_PURCHASE_DATE).days - days))
+        return {'purchase_date_from': first.isoformat(), 'purchase_date_to': (first + datetime.timedelta(days=days)).isoformat()}
+
+    return {
+        'cars at a make': lambda rng: ('db_retrieve_car_by_make', {'car_make_id': rng.choice(make_ids)}),
+        'top 50 by price at a location': lambda rng: ('db_retrieve_cars_by_filters', {
+            'pickup_location_id': rng.choice(location_ids), 'sort': 'purchase_price', 'descending': True, 'limit': 50}),
+        'top 50 by price, make + year': lambda rng: ('db_retrieve_cars_by_filters', {
+            'car_make_id': rng.choice(make_ids), **date_window(rng, 365), 'sort': 'purchase_price', 'descending': True, 'limit': 50}),
+        'price band, newest 100': lambda rng: ('db_retrieve_cars_by_filters', {
+            'min_price': rng.randint(200, 600) * 1000, 'max_price': rng.randint(700, 1200) * 1000,
+            'sort': 'purchase_date', 'descending': True, 'limit': 100}),
+        'stats by location, one year': lambda rng: ('db_retrieve_filtered_car_stats', {
+            'dimension': 'pickup_location_id', **date_window(rng, 365)}),
+        'stats by make, price band': lambda rng: ('db_retrieve_filtered_car_stats', {
+            'dimension': 'car_make_id', 'min_price': rng.randint(200, 600) * 1000}),
+        'stats by fuel type at a location': lambda rng: ('db_retrieve_filtered_car_stats', {
+            'dimension': 'fuel_type_id', 'pickup_location_id': rng.choice(location_ids)}),
+    }
+
+
+def _time_query(repository, query, runs, seed):
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(runs):
+        name, arguments = query(rng)
+        started = time.perf_counter()
+        result = getattr(repository, name)(**arguments)
+        latencies.append(time.perf_counter() - started)
+        if result is None:
+            raise SystemExit(f"{name}({arguments}) failed")
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the SQL path with the in-memory fleet snapshot on analytical queries.")
+    parser.add_argument('--database', help="benchmark database, e.g. from benchmarks.generate_fleet (default: SQLITE_DB_PATH)")
+    parser.add_argument('--runs', type=int, default=50, help="queries per shape and path (default: %(default)s)")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>-snapshot.json)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.database:
+        db_connection.SQLITE_DB_PATH = args.database
+
+    # Imported after the database path is set
+    from database.initialize import init_schema
+    from repositories import repository
+    from repositories.fleet_snapshot import fleet_snapshot
+    init_schema()
+
+    connection = db_connection.get_connection()
+    cars = connection.execute("SELECT COUNT(*) FROM car_management").fetchone()[0]
+    make_ids = [row[0] for row in connection.execute("SELECT car_make_id FROM car_make")]
+    location_ids = [row[0] for row in connection.execute("SELECT pickup_location_id FROM pickup_location")]
+
+    repository.FLEET_SNAPSHOT = True
+    started = time.perf_counter()
+    repository.db_retrieve_cars_by_filters(car_make_id=make_ids[0], limit=1)
+    build_seconds = time.perf_counter() - started
+    print(f"Snapshot of {len(fleet_snapshot)} cars built in {build_seconds:.2f}s")
+
+    results = {}
+    print(f"\n{'query':<36} {'sql p50':>10} {'snap p50':>10} {'sql p95':>10} {'snap p95':>10} {'speedup':>8}")
+    for name, query in _queries(make_ids, location_ids).items():
+        repository.FLEET_SNAPSHOT = False
+        sql = _time_query(repository, query, args.runs, args.seed)
+        repository.FLEET_SNAPSHOT = True
+        snapshot = _time_query(repository, query, args.runs, args.seed)
+        speedup = round(sql['p50_ms'] / snapshot['p50_ms'], 1) if snapshot['p50_ms'] else None
+        results[name] = {'sql': sql, 'snapshot': snapshot, 'speedup_p50': speedup}
+        print(f"{name:<36} {sql['p50_ms']:>10} {snapshot['p50_ms']:>10} {sql['p95_ms']:>10} {snapshot['p95_ms']:>10} {speedup:>7}x")
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cars': cars,
+        'runs': args.runs,
+        'snapshot_build_seconds': round(build_seconds, 3),
+        'queries': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}-snapshot.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.run import RESULTS_DIR, _git_commit
+from database import connection as db_connection
+
+# Repository root, the working directory of every probe process
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter per sample: the boot sequence of a gunicorn
+# worker, timed phase by phase, printed as JSON
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+from database.initialize import init_db
+init_db()
+initialized = time.perf_counter()
+client = app.app.test_client()
+client.get('/api/v1/')
+first_request = time.perf_counter()
+flasgger_loaded = 'flasgger' in sys.modules
+client.get('/apispec.json')
+docs = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'init_db_ms': (initialized - imported) * 1000,
+    'first_request_ms': (first_request - initialized) * 1000,
+    'boot_ms': (first_request - started) * 1000,
+    'first_docs_ms': (docs - first_request) * 1000,
+    'pandas_loaded': 'pandas' in sys.modules,
+    'flasgger_loaded_before_docs': flasgger_loaded,
+}))
+"""
+
+
+# Boot the app in a new interpreter and return its phase timings, plus the
+# wall time of the whole process including interpreter start-up
+def _sample(database):
+    env = dict(os.environ, SQLITE_DB_PATH=database)
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings['process_ms'] = wall_ms
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long a fresh worker process takes to boot and serve its first request.")
+    parser.add_argument('--database', help="database to boot against (default: SQLITE_DB_PATH)")
+    parser.add_argument('--runs', type=int, default=10, help="fresh processes to sample (default: %(default)s)")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>-startup.json)")
+    args = parser.parse_args(argv)
+
+    database = os.path.abspath(args.database or db_connection.SQLITE_DB_PATH)
+
+    # The first boot may migrate or load the database; every worker after it finds it ready
+    _sample(database)
+    samples = [_sample(database) for _ in range(args.runs)]
+
+    phases = ('process_ms', 'import_ms', 'init_db_ms', 'first_request_ms', 'boot_ms', 'first_docs_ms')
+    results = {}
+    print(f"{'phase':<18} {'median':>9} {'min':>9} {'max':>9}")
+    for phase in phases:
+        values = [sample[phase] for sample in samples]
+        results[phase] = {
+            'median': round(statistics.median(values), 2),
+            'min': round(min(values), 2),
+            'max': round(max(values), 2),
+        }
+        print(f"{phase:<18} {results[phase]['median']:>9} {results[phase]['min']:>9} {results[phase]['max']:>9}")
+    print(f"pandas imported on boot: {samples[-1]['pandas_loaded']}, "
+          f"flasgger imported before the first docs request: {samples[-1]['flasgger_loaded_before_docs']}")
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'runs': args.runs,
+        'pandas_loaded': samples[-1]['pandas_loaded'],
+        'flasgger_loaded_before_docs': samples[-1]['flasgger_loaded_before_docs'],
+        'phases': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}-startup.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,192 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from database import connection as db_connection
+from database.connection import create_connection
+from monitoring.metrics import Counter
+
+# Changes older than this many days are removed from the change log
+CHANGE_RETENTION_DAYS = float(os.getenv('CHANGE_RETENTION_DAYS', '7'))
+
+# Most changes kept; the oldest beyond this are removed
+CHANGE_RETENTION_MAX = int(os.getenv('CHANGE_RETENTION_MAX', '1000000'))
+
+# Seconds between automatic compactions in each process; 0 leaves compaction to the CLI
+CHANGE_COMPACT_INTERVAL_S = float(os.getenv('CHANGE_COMPACT_INTERVAL_S', '300'))
+
+# Change log entries handled per compaction transaction, which bounds how
+# long compaction holds the write lock at a time
+COMPACT_BATCH_SIZE = 10000
+
+changes_compacted = Counter('car_changes_compacted_total', 'Change log entries removed by compaction', ('reason',))
+
+
+# Compact the change log in two steps, each in short transactions:
+# - superseded: an entry followed by a newer entry for the same car is
+#   removed, since the newer one carries the car's later state. Consumers at
+#   any version still reach the same final state, so no one has to resync.
+# - expired: entries older than retention_days, and the oldest entries beyond
+#   max_changes, are removed and the retention horizon advances past them.
+#   Consumers behind the horizon get 410 from GET /changes and resync.
+# Returns the number of entries removed for each reason, or None on error.
+def compact_changes(retention_days=CHANGE_RETENTION_DAYS, max_changes=CHANGE_RETENTION_MAX):
+    connection = create_connection()
+    try:
+        superseded = 0
+        while (removed := _compact_superseded(connection)) is not None:
+            superseded += removed
+
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+        target = _expiry_target(connection, cutoff.strftime('%Y-%m-%dT%H:%M:%fZ'), max_changes)
+        expired = 0
+        while target and (removed := _expire(connection, target)):
+            expired += removed
+
+        changes_compacted.inc(('superseded',), superseded)
+        changes_compacted.inc(('expired',), expired)
+        return {'superseded': superseded, 'expired': expired}
+    except sqlite3.Error as error:
+        print(f"Error compacting change log: {error}")
+    finally:
+        connection.close()
+
+
+# Remove the entries superseded by the next batch of entries not yet
+# compacted. Returns how many were removed, or None when none are left.
+def _compact_superseded(connection):
+    cursor = connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        compacted_through = cursor.execute("SELECT compacted_through FROM car_changes_state").fetchone()[0]
+        upto = cursor.execute(
+            """
+            SELECT MAX(version) FROM (
+                SELECT version FROM car_changes WHERE version > ? ORDER BY version LIMIT ?
+            )
+            """, (compacted_through, COMPACT_BATCH_SIZE)
+        ).fetchone()[0]
+        if upto is None:
+            connection.commit()
+            return None
+
+        cursor.execute(
+            """
+            DELETE FROM car_changes WHERE version IN (
+                SELECT older.version FROM car_changes AS newer
+                JOIN car_changes AS older ON older.car_id = newer.car_id AND older.version < newer.version
+                WHERE newer.version > ? AND newer.version <= ?
+            )
+            """, (compacted_through, upto)
+        )
+        removed = cursor.rowcount
+        cursor.execute("UPDATE car_changes_state SET compacted_through = ?", (upto,))
+        connection.commit()
+        return removed
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+# Newest version that retention removes: every entry before the first one
+# changed at or after the cutoff, and every entry beyond the newest max_changes
+def _expiry_target(connection, cutoff, max_changes):
+    first_retained = connection.execute(
+        "SELECT version FROM car_changes WHERE changed_at >= ? ORDER BY version LIMIT 1", (cutoff,)
+    ).fetchone()
+    if first_retained is None:
+        by_age = connection.execute("SELECT COALESCE(MAX(version), 0) FROM car_changes").fetchone()[0]
+    else:
+        by_age = first_retained[0] - 1
+
+    beyond_max = connection.execute(
+        "SELECT version FROM car_changes ORDER BY version DESC LIMIT 1 OFFSET ?", (max_changes,)
+    ).fetchone()
+    return max(by_age, beyond_max[0] if beyond_max else 0)
+
+
+# Remove the next batch of expired entries and advance the horizon past them
+def _expire(connection, target):
+    cursor = connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        upto = cursor.execute(
+            """
+            SELECT MAX(version) FROM (
+                SELECT version FROM car_changes WHERE version <= ? ORDER BY version LIMIT ?
+            )
+            """, (target, COMPACT_BATCH_SIZE)
+        ).fetchone()[0]
+        if upto is None:
+            connection.commit()
+            return 0
+
+        cursor.execute("DELETE FROM car_changes WHERE version <= ?", (upto,))
+        removed = cursor.rowcount
+        cursor.execute("UPDATE car_changes_state SET horizon = MAX(horizon, ?)", (upto,))
+        connection.commit()
+        return removed
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+# When the last automatic compaction of this process was started
+_last_compaction = time.monotonic()
+_compaction_lock = threading.Lock()
+
+
+# Start a compaction on a background thread if CHANGE_COMPACT_INTERVAL_S has
+# passed since the last one, so writers never wait for it. Called after writes.
+def compact_changes_if_due():
+    global _last_compaction
+    if CHANGE_COMPACT_INTERVAL_S <= 0 or time.monotonic() - _last_compaction < CHANGE_COMPACT_INTERVAL_S:
+        return
+    if not _compaction_lock.acquire(blocking=False):
+        return
+    _last_compaction = time.monotonic()
+    threading.Thread(target=_compact_in_background, name='change-log-compaction', daemon=True).start()
+
+
+def _compact_in_background():
+    try:
+        compact_changes()
+    finally:
+        _compaction_lock.release()
+
+
+# A child forked while the parent compacts must not inherit the held lock
+def _reset_compaction():
+    global _compaction_lock, _last_compaction
+    _compaction_lock = threading.Lock()
+    _last_compaction = time.monotonic()
+
+
+os.register_at_fork(after_in_child=_reset_compaction)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact the car_management change log served by GET /changes.")
+    parser.add_argument('--retention-days', type=float, default=CHANGE_RETENTION_DAYS, help="remove changes older than this (default: %(default)s)")
+    parser.add_argument('--max-changes', type=int, default=CHANGE_RETENTION_MAX, help="most changes kept (default: %(default)s)")
+    parser.add_argument('--database', help="SQLite database path (default: SQLITE_DB_PATH)")
+    args = parser.parse_args(argv)
+
+    if args.database:
+        db_connection.SQLITE_DB_PATH = args.database
+
+    from database.initialize import init_schema
+    init_schema()
+
+    started = time.perf_counter()
+    removed = compact_changes(args.retention_days, args.max_changes)
+    if removed is None:
+        return 1
+    print(f"Removed {removed['superseded']} superseded and {removed['expired']} expired changes in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
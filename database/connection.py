@@ -1,13 +1,95 @@
 import sqlite3
 import os
+import threading
 from dotenv import load_dotenv
+from monitoring.metrics import sqlite_connections_closed, sqlite_connections_opened
 
 load_dotenv(override=True)
 
 SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', 'car_management.db')
 
-# Create or connect to SQLite database
-def create_connection():
-    connection = sqlite3.connect(SQLITE_DB_PATH)
+# Connection tuning, overridable through the environment
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv('SQLITE_CACHE_SIZE_KIB', '65536'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', '268435456'))
+SQLITE_STATEMENT_CACHE_SIZE = int(os.getenv('SQLITE_STATEMENT_CACHE_SIZE', '256'))
+
+# NORMAL survives application crashes; FULL also survives power loss by
+# syncing the WAL on every commit
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    raise ValueError(f"SQLITE_SYNCHRONOUS must be OFF, NORMAL, FULL or EXTRA, not {SQLITE_SYNCHRONOUS!r}")
+
+# One long-lived connection per thread and database file (and per process,
+# see reset_connections)
+_local = threading.local()
+
+
+# sqlite3 connection that counts how often connections are closed
+class InstrumentedConnection(sqlite3.Connection):
+    _closed = False
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            sqlite_connections_closed.inc()
+        super().close()
+
+
+# Create or connect to SQLite database, SQLITE_DB_PATH unless another file is given.
+# check_same_thread=False allows a connection used by one thread at a time to
+# move between threads, such as one read by a streamed response.
+def create_connection(path=None, check_same_thread=True):
+    connection = sqlite3.connect(
+        path or SQLITE_DB_PATH,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=check_same_thread,
+        cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+        factory=InstrumentedConnection
+    )
+    sqlite_connections_opened.inc()
     connection.row_factory = sqlite3.Row  # Rows as dictionaries
+    _apply_pragmas(connection)
+    return connection
+
+
+# Get the calling thread's connection to a database file (SQLITE_DB_PATH by
+# default), opening it on first use
+def get_connection(path=None):
+    path = path or SQLITE_DB_PATH
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    connection = connections.get(path)
+    if connection is None:
+        connection = connections[path] = create_connection(path)
     return connection
+
+
+# Close the calling thread's connections, if it has any
+def close_connection():
+    connections = getattr(_local, 'connections', None) or {}
+    _local.connections = {}
+    for connection in connections.values():
+        connection.close()
+
+
+# Forget every connection inherited from the parent process.
+# SQLite connections must never be shared across fork(), so the child starts
+# with an empty thread-local and lazily opens its own connections.
+def reset_connections():
+    global _local
+    _local = threading.local()
+
+
+# Apply production PRAGMAs to a freshly opened connection
+def _apply_pragmas(connection):
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    connection.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB}")
+    connection.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    connection.execute("PRAGMA temp_store = MEMORY")
+
+
+os.register_at_fork(after_in_child=reset_connections)
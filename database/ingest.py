@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from database import connection as db_connection
+from database.connection import create_connection
+
+# Bundled Bilabonnement data set loaded by init_db
+DEFAULT_CSV_PATH = os.path.join(os.path.dirname(__file__), '../csv/Bilabonnement_2024_Clean.csv')
+
+# Rows parsed, mapped and committed per transaction
+DEFAULT_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '50000'))
+
+# CSV columns used and the car_management / dimension columns they map to
+RELEVANT_COLUMNS = {
+    "Dato Indkoeb": "purchase_date",
+    "Indkoebspris": "purchase_price",
+    "Bilmaerke": "car_make_name",
+    "Braendstof": "fuel_type_name",
+    "Udleveringssted": "pickup_location_name",
+}
+
+
+# Stream a CSV file into car_management in bounded transactions.
+# Progress is recorded per source file in ingest_progress inside the same
+# transaction as each chunk, so an interrupted or repeated run resumes after
+# the last committed row and never loads a row twice. Returns the number of
+# rows inserted by this run, or None if the load stopped on an error.
+def ingest_csv(csv_path=DEFAULT_CSV_PATH, chunk_size=DEFAULT_CHUNK_SIZE, progress=True):
+    if not os.path.exists(csv_path):
+        print(f"File not found: {csv_path}")
+        return None
+
+    # pandas takes a few hundred milliseconds to import, so only runs that load data pay for it
+    import pandas as pd
+
+    source = _source_key(csv_path)
+    connection = create_connection()
+    try:
+        already_loaded = _rows_loaded(connection, source)
+        if already_loaded and progress:
+            print(f"Resuming {os.path.basename(csv_path)} after {already_loaded} rows already loaded")
+
+        chunks = pd.read_csv(
+            csv_path,
+            usecols=RELEVANT_COLUMNS.keys(),
+            chunksize=chunk_size,
+            # Skip rows a previous run committed without materialising their indexes
+            skiprows=lambda line: 0 < line <= already_loaded,
+        )
+
+        inserted = 0
+        started = time.perf_counter()
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            data = _normalize_chunk(chunk.rename(columns=RELEVANT_COLUMNS))
+            if not _load_chunk(connection, source, data):
+                return None
+
+            inserted += len(data)
+            if progress:
+                elapsed = time.perf_counter() - started
+                print(f"{already_loaded + inserted} rows loaded ({inserted / elapsed:,.0f} rows/s)")
+
+        if progress:
+            elapsed = time.perf_counter() - started
+            rate = inserted / elapsed if elapsed else 0
+            print(f"Inserted {inserted} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+        return inserted
+    except sqlite3.Error as error:
+        print(f"Error loading car data: {error}")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+    finally:
+        connection.close()
+
+
+# Normalise one chunk's dates and names
+def _normalize_chunk(data):
+    import pandas as pd
+
+    # Convert purchase_date to string in YYYY-MM-DD format
+    data["purchase_date"] = pd.to_datetime(data["purchase_date"]).dt.strftime("%Y-%m-%d")
+
+    # Normalize strings
+    data["fuel_type_name"] = data["fuel_type_name"].str.strip().str.capitalize()
+    data["car_make_name"] = data["car_make_name"].str.strip().str.capitalize()
+    data["pickup_location_name"] = data["pickup_location_name"].str.strip().str.capitalize()
+    return data
+
+
+# Map names to ids, insert a chunk and advance the source's progress in one transaction
+def _load_chunk(connection, source, data):
+    cursor = connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        # Insert unseen car makes and pickup locations and fetch name-to-id mappings
+        car_make_mapping = _populate_mapping_table(cursor, "car_make", "car_make_id", "car_make_name", data["car_make_name"])
+        pickup_location_mapping = _populate_mapping_table(cursor, "pickup_location", "pickup_location_id", "pickup_location_name", data["pickup_location_name"])
+
+        # Fetch all fuel types into a mapping dictionary
+        cursor.execute("SELECT fuel_type_name, fuel_type_id FROM fuel_types")
+        fuel_type_mapping = {row[0]: row[1] for row in cursor.fetchall()}
+
+        # Map names to IDs
+        data["car_make_id"] = data["car_make_name"].map(car_make_mapping)
+        data["pickup_location_id"] = data["pickup_location_name"].map(pickup_location_mapping)
+        data["fuel_type_id"] = data["fuel_type_name"].map(fuel_type_mapping)
+
+        # Check for unmapped data
+        for column in ["car_make_id", "pickup_location_id", "fuel_type_id"]:
+            if data[column].isnull().any():
+                unmapped = data[data[column].isnull()]
+                print(f"Error: Unmapped values found in {column}: {unmapped}")
+                connection.rollback()
+                return False
+
+        cursor.executemany(
+            """
+            INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            data[["purchase_date", "purchase_price", "car_make_id", "fuel_type_id", "pickup_location_id"]]
+            .astype({"purchase_price": float, "car_make_id": int, "fuel_type_id": int, "pickup_location_id": int})
+            .itertuples(index=False, name=None)
+        )
+        cursor.execute(
+            """
+            INSERT INTO ingest_progress (source, rows_loaded, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (source) DO UPDATE SET
+                rows_loaded = rows_loaded + excluded.rows_loaded,
+                updated_at = excluded.updated_at
+            """, (source, len(data))
+        )
+        connection.commit()
+        return True
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def _populate_mapping_table(cursor, table_name, id_column, name_column, values):
+    """
+    Populates a mapping table with unique values and returns a dictionary of name-to-id mappings.
+    """
+    cursor.executemany(
+        f"INSERT OR IGNORE INTO {table_name} ({name_column}) VALUES (?)",
+        [(value,) for value in values.unique()]
+    )
+
+    # Fetch the mappings
+    cursor.execute(f"SELECT {name_column}, {id_column} FROM {table_name}")
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+# Identify a source file by its path and a hash of its header line. Neither
+# changes when rows are appended, so a grown file resumes the same source,
+# while a file with other columns starts from zero.
+def _source_key(csv_path):
+    with open(csv_path, 'rb') as file:
+        digest = hashlib.sha1(file.readline()).hexdigest()
+    return f"{os.path.realpath(csv_path)}:{digest}"
+
+
+# Number of rows of a source committed by previous runs
+def _rows_loaded(connection, source):
+    row = connection.execute(
+        "SELECT rows_loaded FROM ingest_progress WHERE source = ?", (source,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a Bilabonnement CSV file into the car management database.")
+    parser.add_argument('csv_path', nargs='?', default=DEFAULT_CSV_PATH, help="CSV file to load (default: the bundled data set)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction (default: %(default)s)")
+    parser.add_argument('--database', help="SQLite database path (default: SQLITE_DB_PATH)")
+    args = parser.parse_args(argv)
+
+    if args.database:
+        db_connection.SQLITE_DB_PATH = args.database
+
+    # Imported here because database.initialize loads CSV data through this module
+    from database.initialize import init_schema
+    init_schema()
+
+    inserted = ingest_csv(args.csv_path, args.chunk_size)
+    return 0 if inserted is not None else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,238 +1,138 @@
-import os
 import sqlite3
-import pandas as pd
 from database.connection import create_connection
+from database.ingest import DEFAULT_CSV_PATH, ingest_csv
+from database.migrations import SCHEMA_VERSION, apply_migrations, get_schema_version
+from database.shards import SHARD_COUNT, partition_cars, prepare_shard, shard_car_counts, shard_path
+
+# Base tables, created in dependency order
+SCHEMA_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS fuel_types (
+        fuel_type_id INTEGER PRIMARY KEY,
+        fuel_type_name TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS car_make (
+        car_make_id INTEGER PRIMARY KEY,
+        car_make_name TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pickup_location (
+        pickup_location_id INTEGER PRIMARY KEY,
+        pickup_location_name TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS car_management (
+        id INTEGER PRIMARY KEY,
+        purchase_date DATE NOT NULL,
+        purchase_price FLOAT NOT NULL,
+        car_make_id INTEGER NOT NULL,
+        fuel_type_id INTEGER NOT NULL,
+        pickup_location_id INTEGER NOT NULL,
+        FOREIGN KEY (car_make_id) REFERENCES car_make(car_make_id),
+        FOREIGN KEY (fuel_type_id) REFERENCES fuel_types(fuel_type_id),
+        FOREIGN KEY (pickup_location_id) REFERENCES pickup_location(pickup_location_id)
+    )
+    """,
+)
+
+# Predefined fuel types, inserted when fuel_types is empty
+FUEL_TYPES = [
+    (1, "Benzin"),
+    (2, "Diesel"),
+    (3, "Elektrisk"),
+    (4, "Hybrid"),
+]
 
 
 # Initialize database
 def init_db():
-    # Create tables if they do not exist
-    _create_fuel_types_table()
-    _create_car_make_table()
-    _create_pickup_location_table()
-    _create_car_management_table()
-    
-    if not _check_table_data_exists():
+    connection = create_connection()
+    try:
+        # A database at the current schema version with data in it needs no
+        # work, so booting workers only read user_version and one row
+        if not SHARD_COUNT and get_schema_version(connection) == SCHEMA_VERSION and _check_table_data_exists(connection):
+            print("Car data already loaded")
+            return
+
+        init_schema(connection)
+        if SHARD_COUNT:
+            _init_shards()
+        data_exists = _check_table_data_exists(connection) or (SHARD_COUNT and any(shard_car_counts()))
+    finally:
+        connection.close()
+
+    if not data_exists:
         _load_car_data()
+        if SHARD_COUNT:
+            partition_cars()
         print("Car data loaded successfully")
     else:
         print("Car data already loaded")
 
 
-# Create car_management table
-def _create_car_management_table():
-    try:
+# Bring every shard file of the partitioned layout to the current schema and
+# move cars still stored in SQLITE_DB_PATH into them (see database/shards.py)
+def _init_shards():
+    for index in range(SHARD_COUNT):
+        connection = create_connection(shard_path(index))
+        try:
+            init_schema(connection)
+            prepare_shard(connection, index)
+        finally:
+            connection.close()
+    moved = partition_cars()
+    if moved:
+        print(f"Moved {moved} cars into {SHARD_COUNT} shards")
+
+
+# Create tables and apply schema migrations without loading any data.
+# Everything runs in one transaction on one connection.
+def init_schema(connection=None):
+    owns_connection = connection is None
+    if owns_connection:
         connection = create_connection()
-        cursor = connection.cursor()
-
-        # Define the car_management table schema
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS car_management (
-                id INTEGER PRIMARY KEY,
-                purchase_date DATE NOT NULL,
-                purchase_price FLOAT NOT NULL,
-                car_make_id INTEGER NOT NULL,
-                fuel_type_id INTEGER NOT NULL,
-                pickup_location_id INTEGER NOT NULL,
-                FOREIGN KEY (car_make_id) REFERENCES car_make(car_make_id),
-                FOREIGN KEY (fuel_type_id) REFERENCES fuel_types(fuel_type_id),
-                FOREIGN KEY (pickup_location_id) REFERENCES pickup_location(pickup_location_id)
-            )
-            """
-        )
-    except sqlite3.Error as error:
-        print(f"Error creating car_management table: {error}")
-    finally:
-        connection.commit()
-        connection.close()
-
 
-# Create car_make table
-def _create_car_make_table():
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
-
-        # Define the car_make table schema
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS car_make (
-                car_make_id INTEGER PRIMARY KEY,
-                car_make_name TEXT NOT NULL UNIQUE
-            )
-            """
-        )
-    except sqlite3.Error as error:
-        print(f"Error creating car_make table: {error}")
-    finally:
+        # Take the write lock first and re-check, so concurrent workers
+        # booting at the same time do the work once
+        connection.execute("BEGIN IMMEDIATE")
+        if get_schema_version(connection) < SCHEMA_VERSION:
+            for statement in SCHEMA_TABLES:
+                connection.execute(statement)
+            _populate_fuel_types(connection)
+
+            # Bring indexes and other schema objects up to the current version
+            apply_migrations(connection)
         connection.commit()
-        connection.close()
-
-
-# Create pickup_location table
-def _create_pickup_location_table():
-    try:
-        connection = create_connection()
-        cursor = connection.cursor()
-
-        # Define the pickup_location table schema
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS pickup_location (
-                pickup_location_id INTEGER PRIMARY KEY,
-                pickup_location_name TEXT NOT NULL UNIQUE
-            )
-            """
-        )
     except sqlite3.Error as error:
-        print(f"Error creating pickup_location table: {error}")
+        connection.rollback()
+        print(f"Error initializing database schema: {error}")
+        raise
     finally:
-        connection.commit()
-        connection.close()
-
-
-# Create fuel_types table
-def _create_fuel_types_table():
-    try:
-        connection = create_connection()
-        cursor = connection.cursor()
-
-        # Define the fuel_types table schema
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS fuel_types (
-                fuel_type_id INTEGER PRIMARY KEY,
-                fuel_type_name TEXT NOT NULL UNIQUE
-            )
-            """
-        )
-
-        # Insert predefined fuel types if the table is empty
-        cursor.execute("SELECT COUNT(*) FROM fuel_types")
-        if cursor.fetchone()[0] == 0:
-            fuel_types = [
-                (1, "Benzin"),
-                (2, "Diesel"),
-                (3, "Elektrisk"),
-                (4, "Hybrid"),
-            ]
-            cursor.executemany(
-                "INSERT INTO fuel_types (fuel_type_id, fuel_type_name) VALUES (?, ?)", fuel_types
-            )
+        if owns_connection:
+            connection.close()
 
-    except sqlite3.Error as error:
-        print(f"Error creating or populating fuel_types table: {error}")
 
-    finally:
-        connection.commit()
-        connection.close()
+# Insert predefined fuel types if the table is empty
+def _populate_fuel_types(connection):
+    if connection.execute("SELECT EXISTS (SELECT 1 FROM fuel_types)").fetchone()[0]:
+        return
+    connection.executemany("INSERT INTO fuel_types (fuel_type_id, fuel_type_name) VALUES (?, ?)", FUEL_TYPES)
 
 
 # Check if car_management has data
-def _check_table_data_exists():
+def _check_table_data_exists(connection):
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
-
-        cursor.execute("SELECT COUNT(*) AS count FROM car_management")
-        result = cursor.fetchone()[0] > 0
+        return bool(connection.execute("SELECT EXISTS (SELECT 1 FROM car_management)").fetchone()[0])
     except sqlite3.Error as error:
         print(f"Error checking if table has data: {error}")
-        result = False
-    finally:
-        connection.close()
-        return result
+        return False
 
 
-# Load car data from CSV
+# Load car data from the bundled CSV
 def _load_car_data():
-    # Define the CSV file path
-    car_data_path = os.path.join(os.path.dirname(__file__), '../csv/Bilabonnement_2024_Clean.csv')
-
-    try:
-        # Check if the file exists
-        if not os.path.exists(car_data_path):
-            print(f"File not found: {car_data_path}")
-            return
-
-        # Read relevant columns from CSV
-        relevant_columns = {
-            "Dato Indkoeb": "purchase_date",
-            "Indkoebspris": "purchase_price",
-            "Bilmaerke": "car_make_name",
-            "Braendstof": "fuel_type_name",
-            "Udleveringssted": "pickup_location_name",
-        }
-        data = pd.read_csv(car_data_path, usecols=relevant_columns.keys()).rename(columns=relevant_columns)
-        
-        # Convert purchase_date to string in YYYY-MM-DD format
-        data["purchase_date"] = pd.to_datetime(data["purchase_date"]).dt.strftime("%Y-%m-%d")
-
-        # Normalize strings
-        data["fuel_type_name"] = data["fuel_type_name"].str.strip().str.capitalize()
-        data["car_make_name"] = data["car_make_name"].str.strip().str.capitalize()
-        data["pickup_location_name"] = data["pickup_location_name"].str.strip().str.capitalize()
-
-        # Establish database connection
-        connection = create_connection()
-        cursor = connection.cursor()
-
-        # Insert unique car makes into car_make table and create a mapping
-        car_make_mapping = _populate_mapping_table(cursor, "car_make", "car_make_id", "car_make_name", data["car_make_name"])
-
-        # Insert unique pickup locations into pickup_location table and create a mapping
-        pickup_location_mapping = _populate_mapping_table(cursor, "pickup_location", "pickup_location_id", "pickup_location_name", data["pickup_location_name"])
-
-        # Fetch all fuel types into a mapping dictionary
-        cursor.execute("SELECT fuel_type_name, fuel_type_id FROM fuel_types")
-        fuel_type_mapping = {row[0]: row[1] for row in cursor.fetchall()}
-
-        # Map names to IDs
-        data["car_make_id"] = data["car_make_name"].map(car_make_mapping)
-        data["pickup_location_id"] = data["pickup_location_name"].map(pickup_location_mapping)
-        data["fuel_type_id"] = data["fuel_type_name"].map(fuel_type_mapping)
-
-        # Check for unmapped data
-        for column in ["car_make_id", "pickup_location_id", "fuel_type_id"]:
-            if data[column].isnull().any():
-                unmapped = data[data[column].isnull()]
-                print(f"Error: Unmapped values found in {column}: {unmapped}")
-                return
-
-        # Prepare data for insertion
-        car_data = data[["purchase_date", "purchase_price", "car_make_id", "fuel_type_id", "pickup_location_id"]].values.tolist()
-
-        # Debug: Print number of rows to be inserted
-        print(f"Inserting {len(car_data)} rows into car_management...")
-
-        # Insert data into car_management
-        cursor.executemany(
-            """
-            INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            car_data
-        )
-
-    except sqlite3.Error as error:
-        print(f"Error loading car data: {error}")
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-    finally:
-        connection.commit()
-        connection.close()
-
-
-def _populate_mapping_table(cursor, table_name, id_column, name_column, values):
-    """
-    Populates a mapping table with unique values and returns a dictionary of name-to-id mappings.
-    """
-    cursor.executemany(
-        f"INSERT OR IGNORE INTO {table_name} ({name_column}) VALUES (?)",
-        [(value,) for value in values.unique()]
-    )
-
-    # Fetch the mappings
-    cursor.execute(f"SELECT {name_column}, {id_column} FROM {table_name}")
-    return {row[0]: row[1] for row in cursor.fetchall()}
+    ingest_csv(DEFAULT_CSV_PATH)
@@ -0,0 +1,306 @@
+
+# car_management columns that fleet statistics are grouped by
+STATS_DIMENSIONS = ('car_make_id', 'fuel_type_id', 'pickup_location_id')
+
+# Lookup tables holding the names behind those columns
+DIMENSION_TABLES = ('car_make', 'fuel_types', 'pickup_location')
+
+
+# Trigger body statements adding the row in `ref` (NEW) to its stats group of each dimension
+def _stats_add_row(ref, dimensions=STATS_DIMENSIONS):
+    return "".join(
+        f"""
+                INSERT INTO car_stats (dimension, group_id, car_count, price_sum, price_min, price_max, date_min, date_max)
+                VALUES ('{dimension}', {ref}.{dimension}, 1, {ref}.purchase_price, {ref}.purchase_price, {ref}.purchase_price, {ref}.purchase_date, {ref}.purchase_date)
+                ON CONFLICT (dimension, group_id) DO UPDATE SET
+                    car_count = car_count + 1,
+                    price_sum = price_sum + excluded.price_sum,
+                    price_min = MIN(price_min, excluded.price_min),
+                    price_max = MAX(price_max, excluded.price_max),
+                    date_min = MIN(date_min, excluded.date_min),
+                    date_max = MAX(date_max, excluded.date_max);"""
+        for dimension in dimensions
+    )
+
+
+# Trigger body statements removing the row in `ref` (OLD) from its stats group of each dimension.
+# Counts and sums are adjusted in O(1); min/max are recomputed from the group's
+# index only when the removed row held one of the group's extremes.
+def _stats_remove_row(ref, dimensions=STATS_DIMENSIONS):
+    return "".join(
+        f"""
+                UPDATE car_stats SET car_count = car_count - 1, price_sum = price_sum - {ref}.purchase_price
+                WHERE dimension = '{dimension}' AND group_id = {ref}.{dimension};
+                DELETE FROM car_stats
+                WHERE dimension = '{dimension}' AND group_id = {ref}.{dimension} AND car_count <= 0;
+                UPDATE car_stats SET
+                    price_min = (SELECT MIN(purchase_price) FROM car_management WHERE {dimension} = {ref}.{dimension}),
+                    price_max = (SELECT MAX(purchase_price) FROM car_management WHERE {dimension} = {ref}.{dimension}),
+                    date_min = (SELECT MIN(purchase_date) FROM car_management WHERE {dimension} = {ref}.{dimension}),
+                    date_max = (SELECT MAX(purchase_date) FROM car_management WHERE {dimension} = {ref}.{dimension})
+                WHERE dimension = '{dimension}' AND group_id = {ref}.{dimension}
+                    AND (price_min = {ref}.purchase_price OR price_max = {ref}.purchase_price
+                         OR date_min = {ref}.purchase_date OR date_max = {ref}.purchase_date);"""
+        for dimension in dimensions
+    )
+
+
+# Ordered schema migrations as (version, statements).
+# The applied version is stored in the database's PRAGMA user_version, so each
+# migration runs exactly once per database file. Append new entries; never edit
+# one that has shipped.
+SCHEMA_MIGRATIONS = [
+    # 1: Secondary indexes for the make / fuel type / pickup location filters.
+    # Each filter column leads one composite index, so single-column lookups use
+    # the index prefix and every combination of the three filters is covered
+    # without a separate single-column index per column.
+    (1, [
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_make_fuel
+        ON car_management (car_make_id, fuel_type_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_fuel_location
+        ON car_management (fuel_type_id, pickup_location_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_location_make_fuel
+        ON car_management (pickup_location_id, car_make_id, fuel_type_id)
+        """,
+        "ANALYZE car_management",
+    ]),
+
+    # 2: Per-table generation counters, bumped by triggers on every write, so
+    # readers can tell whether anything they cached is stale with one lookup
+    (2, [
+        """
+        CREATE TABLE IF NOT EXISTS table_generation (
+            table_name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "INSERT OR IGNORE INTO table_generation (table_name, generation) VALUES ('car_management', 0)",
+        *[
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_car_management_generation_{event.lower()}
+            AFTER {event} ON car_management
+            BEGIN
+                UPDATE table_generation SET generation = generation + 1
+                WHERE table_name = 'car_management';
+            END
+            """
+            for event in ('INSERT', 'UPDATE', 'DELETE')
+        ],
+    ]),
+
+    # 3: Rows committed per CSV source, so ingestion can resume without duplicates
+    (3, [
+        """
+        CREATE TABLE IF NOT EXISTS ingest_progress (
+            source TEXT PRIMARY KEY,
+            rows_loaded INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+    ]),
+
+    # 4: Fleet statistics per make, fuel type and pickup location, kept current
+    # by triggers so reads cost O(groups) and never scan car_management
+    (4, [
+        """
+        CREATE TABLE IF NOT EXISTS car_stats (
+            dimension TEXT NOT NULL,
+            group_id INTEGER NOT NULL,
+            car_count INTEGER NOT NULL,
+            price_sum REAL NOT NULL,
+            price_min REAL NOT NULL,
+            price_max REAL NOT NULL,
+            date_min TEXT NOT NULL,
+            date_max TEXT NOT NULL,
+            PRIMARY KEY (dimension, group_id)
+        ) WITHOUT ROWID
+        """,
+        *[
+            f"""
+            INSERT INTO car_stats (dimension, group_id, car_count, price_sum, price_min, price_max, date_min, date_max)
+            SELECT '{dimension}', {dimension}, COUNT(*), SUM(purchase_price), MIN(purchase_price), MAX(purchase_price),
+                   MIN(purchase_date), MAX(purchase_date)
+            FROM car_management GROUP BY {dimension}
+            """
+            for dimension in STATS_DIMENSIONS
+        ],
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_car_management_stats_insert
+        AFTER INSERT ON car_management
+        BEGIN{_stats_add_row('NEW')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_car_management_stats_delete
+        AFTER DELETE ON car_management
+        BEGIN{_stats_remove_row('OLD')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_car_management_stats_update
+        AFTER UPDATE OF purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id ON car_management
+        BEGIN{_stats_remove_row('OLD')}{_stats_add_row('NEW')}
+        END
+        """,
+    ]),
+
+    # 5: Generation counters for the dimension tables, so per-worker copies of
+    # makes, fuel types and pickup locations know when to reload
+    (5, [
+        *[
+            f"INSERT OR IGNORE INTO table_generation (table_name, generation) VALUES ('{table}', 0)"
+            for table in DIMENSION_TABLES
+        ],
+        *[
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_generation_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_generation SET generation = generation + 1
+                WHERE table_name = '{table}';
+            END
+            """
+            for table in DIMENSION_TABLES
+            for event in ('INSERT', 'UPDATE', 'DELETE')
+        ],
+    ]),
+
+    # 6: Range and top-k queries on purchase_date and purchase_price. The
+    # single-column indexes answer fleet-wide ranges and "top k by price/date";
+    # the composite ones answer the same per pickup location or make by
+    # seeking to the id and reading k index entries in order, with no sort.
+    (6, [
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_date
+        ON car_management (purchase_date)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_price
+        ON car_management (purchase_price)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_location_date
+        ON car_management (pickup_location_id, purchase_date)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_location_price
+        ON car_management (pickup_location_id, purchase_price)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_make_price
+        ON car_management (car_make_id, purchase_price)
+        """,
+        "ANALYZE car_management",
+    ]),
+
+    # 7: Change log of car_management for GET /changes. Triggers append one
+    # entry per changed row, carrying the row as it is after the change (only
+    # the id for deletes), so the log also covers bulk loads and writes from
+    # other processes. AUTOINCREMENT keeps versions increasing even after
+    # compaction empties the log. car_changes_state holds the retention
+    # horizon (the newest version removed by retention) and how far
+    # superseded entries have been compacted.
+    (7, [
+        """
+        CREATE TABLE IF NOT EXISTS car_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            operation TEXT NOT NULL,
+            car_id INTEGER NOT NULL,
+            purchase_date TEXT,
+            purchase_price REAL,
+            car_make_id INTEGER,
+            fuel_type_id INTEGER,
+            pickup_location_id INTEGER,
+            changed_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_changes_car
+        ON car_changes (car_id, version)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS car_changes_state (
+            horizon INTEGER NOT NULL,
+            compacted_through INTEGER NOT NULL
+        )
+        """,
+        "INSERT INTO car_changes_state (horizon, compacted_through) SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM car_changes_state)",
+        *[
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_car_management_changes_{event.lower()}
+            AFTER {event} ON car_management
+            BEGIN
+                INSERT INTO car_changes (operation, car_id, purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id, changed_at)
+                VALUES ({values}, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'));
+            END
+            """
+            for event, values in (
+                ('INSERT', "'insert', NEW.id, NEW.purchase_date, NEW.purchase_price, NEW.car_make_id, NEW.fuel_type_id, NEW.pickup_location_id"),
+                ('UPDATE', "'update', NEW.id, NEW.purchase_date, NEW.purchase_price, NEW.car_make_id, NEW.fuel_type_id, NEW.pickup_location_id"),
+                ('DELETE', "'delete', OLD.id, NULL, NULL, NULL, NULL, NULL"),
+            )
+        ],
+    ]),
+
+    # 8: One stats update trigger per dimension, firing only when the row's
+    # group in that dimension, its price or its date changes, so e.g. a
+    # relocation leaves the make and fuel type statistics alone. Every group's
+    # min/max recompute seeks an index leading with the dimension and ending
+    # with the price or date, instead of scanning the group.
+    (8, [
+        "DROP TRIGGER IF EXISTS trg_car_management_stats_update",
+        *[
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_car_management_stats_update_{dimension}
+            AFTER UPDATE OF purchase_date, purchase_price, {dimension} ON car_management
+            WHEN OLD.{dimension} IS NOT NEW.{dimension}
+                OR OLD.purchase_price IS NOT NEW.purchase_price
+                OR OLD.purchase_date IS NOT NEW.purchase_date
+            BEGIN{_stats_remove_row('OLD', (dimension,))}{_stats_add_row('NEW', (dimension,))}
+            END
+            """
+            for dimension in STATS_DIMENSIONS
+        ],
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_make_date
+        ON car_management (car_make_id, purchase_date)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_fuel_price
+        ON car_management (fuel_type_id, purchase_price)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_car_management_fuel_date
+        ON car_management (fuel_type_id, purchase_date)
+        """,
+        "ANALYZE car_management",
+    ]),
+]
+
+# Schema version of a fully migrated database
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+# Read the schema version stored in the database
+def get_schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Apply every migration newer than the stored schema version. Runs inside the
+# caller's transaction, which must hold the write lock (BEGIN IMMEDIATE) so
+# concurrent workers booting at the same time cannot apply a migration twice.
+def apply_migrations(connection):
+    current_version = get_schema_version(connection)
+    for version, statements in SCHEMA_MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        for statement in statements:
+            connection.execute(statement)
+        connection.execute(f"PRAGMA user_version = {version}")
+        print(f"Applied schema migration {version}")
@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from database import connection as db_connection
+from database.connection import create_connection, get_connection
+
+# Store car_management in this many SQLite files, each holding the cars of
+# the pickup locations whose id modulo SHARD_COUNT is the file's index, so
+# writes at different locations take different write locks. 0 (the default)
+# keeps every car in SQLITE_DB_PATH, which holds the dimension tables either way.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+
+# Cars copied per transaction when moving cars from SQLITE_DB_PATH into the shards
+PARTITION_BATCH_SIZE = 10000
+
+# Change log triggers are dropped from the shards: the change feed needs one
+# version order across every car, which separate files do not have
+SHARD_DROPPED_TRIGGERS = tuple(f'trg_car_management_changes_{event}' for event in ('insert', 'update', 'delete'))
+
+
+# Path of a shard file, next to SQLITE_DB_PATH: car_management.db -> car_management.shard0.db
+def shard_path(index):
+    root, extension = os.path.splitext(db_connection.SQLITE_DB_PATH)
+    return f"{root}.shard{index}{extension or '.db'}"
+
+
+# Index of the shard holding the cars at a pickup location
+def shard_for_location(pickup_location_id):
+    return int(pickup_location_id) % SHARD_COUNT
+
+
+# The calling thread's connection to a shard
+def get_shard_connection(index):
+    return get_connection(shard_path(index))
+
+
+# Thread pool running one read per shard, created on first use in each process
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Call function(index) for the given shards (default: all), in parallel when
+# there is more than one, and return the results in the order of the indexes.
+# SQLite releases the GIL while it steps a query, so the shards' reads
+# overlap. Work smaller than a thread handoff, such as one primary key seek
+# per shard, is better run with parallel=False on the calling thread.
+def map_shards(function, indexes=None, parallel=True):
+    global _executor
+    indexes = list(range(SHARD_COUNT) if indexes is None else indexes)
+    if len(indexes) == 1 or not parallel:
+        return [function(index) for index in indexes]
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SHARD_COUNT, thread_name_prefix='shard-read')
+    return list(_executor.map(function, indexes))
+
+
+# Executor threads do not survive fork(), so a child creates its own pool
+def _reset_executor():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_executor)
+
+
+# Find which shard holds each of the given car ids, as {id: shard index}.
+# Ids are primary keys, so every shard answers with index seeks, and a
+# single id is looked up on the calling thread.
+def locate_cars(ids):
+    def find(index):
+        cursor = get_shard_connection(index).execute(
+            "SELECT id FROM car_management WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(list(ids)),)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    return {id: index for index, found in enumerate(map_shards(find, parallel=len(ids) > 1)) for id in found}
+
+
+# Ids for count new cars, allocated inside a write transaction on a shard.
+# Shard i hands out ids congruent to i modulo SHARD_COUNT from its own
+# counter, so shards never hand out the same id without coordinating. Cars
+# keep their id when they move to another shard, and the counter never
+# decreases, so an id is not handed out again after its car moved away.
+def allocate_ids(connection, count):
+    last_id, shard_count = connection.execute(
+        "UPDATE shard_state SET last_id = last_id + shard_count * ? RETURNING last_id, shard_count", (count,)
+    ).fetchone()
+    return list(range(last_id - shard_count * (count - 1), last_id + 1, shard_count))
+
+
+# Raise a shard's id counter to at least the largest of the given ids in its
+# class, e.g. after cars were imported with their ids, inside a write transaction
+def reserve_ids(connection, index, ids):
+    largest = max((id for id in ids if id % SHARD_COUNT == index), default=None)
+    if largest is not None:
+        connection.execute("UPDATE shard_state SET last_id = MAX(last_id, ?)", (largest,))
+
+
+# Prepare a shard file whose schema init_schema has just created: record
+# its place in the layout, refusing files from a layout of another size,
+# and drop the change log triggers. Runs in its own transaction.
+def prepare_shard(connection, index):
+    with connection:
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS shard_state (
+                shard INTEGER NOT NULL,
+                shard_count INTEGER NOT NULL,
+                last_id INTEGER NOT NULL
+            )
+            """
+        )
+        state = connection.execute("SELECT shard, shard_count FROM shard_state").fetchone()
+        if state is None:
+            connection.execute(
+                "INSERT INTO shard_state (shard, shard_count, last_id) VALUES (?, ?, ?)", (index, SHARD_COUNT, index)
+            )
+        elif tuple(state) != (index, SHARD_COUNT):
+            raise RuntimeError(
+                f"{shard_path(index)} is shard {state[0]} of {state[1]}, but SHARD_COUNT is {SHARD_COUNT}; "
+                "export the cars and import them into a fresh layout to change the shard count"
+            )
+        for trigger in SHARD_DROPPED_TRIGGERS:
+            connection.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    # A file beyond the layout means SHARD_COUNT was lowered, which would hide its cars
+    if index == SHARD_COUNT - 1 and os.path.exists(shard_path(SHARD_COUNT)):
+        raise RuntimeError(f"{shard_path(SHARD_COUNT)} exists, but SHARD_COUNT is {SHARD_COUNT}")
+
+
+# Move the cars stored in SQLITE_DB_PATH into the shards, as when loading the
+# bundled CSV or partitioning an existing database, and return how many moved.
+# The write lock on SQLITE_DB_PATH is held throughout, so concurrently booting
+# workers move the cars once; cars already copied by an interrupted run are
+# skipped, and the originals are deleted only after every copy committed.
+def partition_cars(batch_size=PARTITION_BATCH_SIZE):
+    connection = create_connection()
+    shard_connections = [create_connection(shard_path(index)) for index in range(SHARD_COUNT)]
+    try:
+        connection.row_factory = None
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            moved = last_id = 0
+            while rows := connection.execute(
+                """
+                SELECT id, purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id
+                FROM car_management WHERE id > ? ORDER BY id LIMIT ?
+                """, (last_id, batch_size)
+            ).fetchall():
+                groups = defaultdict(list)
+                for row in rows:
+                    groups[shard_for_location(row[5])].append(row)
+                for index, group in groups.items():
+                    with shard_connections[index]:
+                        shard_connections[index].executemany(
+                            """
+                            INSERT INTO car_management (id, purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id)
+                            VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING
+                            """, group
+                        )
+                last_id = rows[-1][0]
+                moved += len(rows)
+
+            # Ids the shards hand out from now on stay above every moved car
+            for index, shard_connection in enumerate(shard_connections):
+                with shard_connection:
+                    reserve_ids(shard_connection, index, [last_id - (last_id - index) % SHARD_COUNT])
+            if moved:
+                connection.execute("DELETE FROM car_management")
+            connection.commit()
+            return moved
+        except BaseException:
+            connection.rollback()
+            raise
+    finally:
+        for shard_connection in shard_connections:
+            shard_connection.close()
+        connection.close()
+
+
+# Number of cars in each shard. init_db calls this in the gunicorn master, so
+# it opens and closes its own connections, one shard after another: a thread
+# pool or thread-local connection left open there would be inherited by every
+# forked worker.
+def shard_car_counts():
+    counts = []
+    for index in range(SHARD_COUNT):
+        connection = create_connection(shard_path(index))
+        try:
+            counts.append(connection.execute("SELECT COUNT(*) FROM car_management").fetchone()[0])
+        finally:
+            connection.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the shard files of the partitioned storage layout and move cars into them.")
+    parser.add_argument('--database', help="SQLite database path (default: SQLITE_DB_PATH)")
+    args = parser.parse_args(argv)
+
+    if args.database:
+        db_connection.SQLITE_DB_PATH = args.database
+    if SHARD_COUNT <= 0:
+        parser.error("set SHARD_COUNT to the number of shard files")
+
+    # Imported here because database.initialize partitions through this module
+    from database.initialize import init_db
+    try:
+        init_db()
+    except (sqlite3.Error, RuntimeError) as error:
+        print(f"Error partitioning database: {error}")
+        return 1
+
+    for index, cars in enumerate(shard_car_counts()):
+        print(f"{shard_path(index)}: {cars} cars")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
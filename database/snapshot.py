@@ -0,0 +1,280 @@
+import argparse
+import datetime
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+from database import connection as db_connection
+from database.connection import InstrumentedConnection, create_connection
+from database.migrations import SCHEMA_VERSION
+from database.shards import SHARD_COUNT, shard_path
+from monitoring.metrics import CallbackMetric, Counter, sqlite_connections_opened
+
+# Where snapshots are written; by default next to SQLITE_DB_PATH:
+# car_management.db -> car_management.snapshot.db
+DB_SNAPSHOT_PATH = os.getenv('DB_SNAPSHOT_PATH')
+
+# Serve the heavy reads (/all, /export and /stats) from the latest snapshot
+# instead of SQLITE_DB_PATH, falling back to it while there is no snapshot
+DB_SNAPSHOT_READS = os.getenv('DB_SNAPSHOT_READS', 'false').lower() in ('1', 'true', 'yes')
+
+# Seconds after which the serving workers take a new snapshot in the
+# background; 0 leaves snapshots to the CLI and POST /admin/snapshot
+DB_SNAPSHOT_INTERVAL_S = float(os.getenv('DB_SNAPSHOT_INTERVAL_S', '0'))
+
+# Database pages copied per backup step, and the pause between steps that
+# leaves the disk and the GIL to the request threads
+DB_SNAPSHOT_PAGES_PER_STEP = int(os.getenv('DB_SNAPSHOT_PAGES_PER_STEP', '1024'))
+DB_SNAPSHOT_STEP_SLEEP_MS = float(os.getenv('DB_SNAPSHOT_STEP_SLEEP_MS', '1'))
+
+snapshots_taken = Counter('db_snapshots_total', 'Database snapshots attempted by this process', ('result',))
+
+
+# Path of the snapshot of SQLITE_DB_PATH
+def snapshot_path():
+    if DB_SNAPSHOT_PATH:
+        return DB_SNAPSHOT_PATH
+    root, extension = os.path.splitext(db_connection.SQLITE_DB_PATH)
+    return f"{root}.snapshot{extension or '.db'}"
+
+
+# Copy SQLITE_DB_PATH, and with partitioned storage every shard, into
+# snapshot files with SQLite's online backup API, and return
+# {'path', 'pages', 'seconds'}, or None if a snapshot is already being taken.
+#
+# Each source connection holds a read transaction for the whole copy, so the
+# copy is the database as of the moment it started: under WAL the read
+# transaction does not block writers, and without it every commit from another
+# connection would restart the backup from the first page. The pages are
+# copied pages_per_step at a time with a pause in between, into a temporary
+# file that replaces the previous snapshot once complete. Readers that still
+# have the previous snapshot open keep reading it until they reopen.
+# The WAL cannot be checkpointed past the read transaction while it lasts.
+def create_snapshot(path=None, pages_per_step=DB_SNAPSHOT_PAGES_PER_STEP, step_sleep_ms=DB_SNAPSHOT_STEP_SLEEP_MS):
+    path = path or snapshot_path()
+    # Shard snapshots are named after the snapshot as the shards are after the database
+    root, extension = os.path.splitext(path)
+    files = [(db_connection.SQLITE_DB_PATH, path)]
+    files += [(shard_path(index), f"{root}.shard{index}{extension or '.db'}") for index in range(SHARD_COUNT)]
+
+    # One snapshot at a time across every process writing to the same path
+    with open(f'{path}.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        started = time.perf_counter()
+        sources = [create_connection(source) for source, _ in files]
+        try:
+            # Start every read transaction before copying, so the shards are
+            # copied as of (nearly) the same moment
+            for source in sources:
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+            pages = 0
+            for source, (_, target) in zip(sources, files):
+                pages += _copy(source, f'{target}.tmp', pages_per_step, step_sleep_ms)
+            for _, target in files:
+                os.replace(f'{target}.tmp', target)
+        except BaseException:
+            snapshots_taken.inc(('error',))
+            for _, target in files:
+                if os.path.exists(f'{target}.tmp'):
+                    os.remove(f'{target}.tmp')
+            raise
+        finally:
+            for source in sources:
+                source.close()
+
+        snapshots_taken.inc(('ok',))
+        return {'path': path, 'pages': pages, 'seconds': round(time.perf_counter() - started, 3)}
+
+
+# Back up one source connection into a fresh file and return the pages copied
+def _copy(source, target_path, pages_per_step, step_sleep_ms):
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    copied = 0
+
+    def progress(status, remaining, total):
+        nonlocal copied
+        copied = total
+        if remaining and step_sleep_ms > 0:
+            time.sleep(step_sleep_ms / 1000)
+
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages_per_step, progress=progress)
+        # The copy is read-only from now on, so it becomes a single
+        # self-contained file instead of inheriting the source's WAL mode
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+    return copied
+
+
+# Details of the current snapshot of SQLITE_DB_PATH, or None if there is none
+def snapshot_info(path=None):
+    path = path or snapshot_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {
+        'path': path,
+        'bytes': stat.st_size,
+        'created_at': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc).isoformat(timespec='seconds'),
+        'age_seconds': round(time.time() - stat.st_mtime, 1),
+    }
+
+
+# Each thread's read-only connection to the current snapshot, with the
+# version of the file it was opened on
+_local = threading.local()
+
+
+# The calling thread's connection to the current snapshot, reopened when a
+# newer snapshot has replaced the file, or None if there is no usable one
+def get_snapshot_connection():
+    version = snapshot_version()
+    if version is None:
+        return None
+
+    current = getattr(_local, 'snapshot', None)
+    if current is not None:
+        if current[0] == version:
+            return current[1]
+        if current[1] is not None:
+            current[1].close()
+    connection = create_snapshot_connection()
+    _local.snapshot = (version, connection)
+    return connection
+
+
+# Open a new connection to the current snapshot, or None if there is no
+# usable one (none taken yet, or taken before the last schema migration).
+# Snapshots are never modified in place, so they are opened immutable and
+# SQLite reads them without any locking. A connection keeps reading the
+# snapshot it was opened on after a newer one replaced the file.
+def create_snapshot_connection(check_same_thread=True):
+    try:
+        connection = sqlite3.connect(
+            f"file:{quote(os.path.abspath(snapshot_path()))}?mode=ro&immutable=1",
+            uri=True,
+            check_same_thread=check_same_thread,
+            cached_statements=db_connection.SQLITE_STATEMENT_CACHE_SIZE,
+            factory=InstrumentedConnection
+        )
+    except sqlite3.OperationalError:
+        return None
+    sqlite_connections_opened.inc()
+    connection.row_factory = sqlite3.Row
+    connection.execute(f"PRAGMA cache_size = -{db_connection.SQLITE_CACHE_SIZE_KIB}")
+    connection.execute(f"PRAGMA mmap_size = {db_connection.SQLITE_MMAP_SIZE}")
+    connection.execute("PRAGMA temp_store = MEMORY")
+    if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        connection.close()
+        return None
+    return connection
+
+
+# Version of the current snapshot, (inode, modification time), which changes
+# whenever a new one replaces it; None if there is none
+def snapshot_version():
+    try:
+        stat = os.stat(snapshot_path())
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+_snapshot_lock = threading.Lock()
+
+
+# Start a snapshot on a background thread if DB_SNAPSHOT_INTERVAL_S has passed
+# since the current one was taken, so requests never wait for it. The file's
+# age is shared by every worker, and the file lock lets only one take it.
+def snapshot_if_due():
+    if DB_SNAPSHOT_INTERVAL_S <= 0:
+        return
+    info = snapshot_info()
+    if info is not None and info['age_seconds'] < DB_SNAPSHOT_INTERVAL_S:
+        return
+    start_snapshot()
+
+
+# Start a snapshot on a background thread; False if this process is already taking one
+def start_snapshot():
+    if not _snapshot_lock.acquire(blocking=False):
+        return False
+    threading.Thread(target=_snapshot_in_background, name='db-snapshot', daemon=True).start()
+    return True
+
+
+def _snapshot_in_background():
+    try:
+        create_snapshot()
+    except (sqlite3.Error, OSError) as error:
+        print(f"Error taking database snapshot: {error}")
+    finally:
+        _snapshot_lock.release()
+
+
+# Whether any process is taking a snapshot to the default path right now
+def snapshot_in_progress():
+    if _snapshot_lock.locked():
+        return True
+    try:
+        with open(f'{snapshot_path()}.lock') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except BlockingIOError:
+        return True
+    return False
+
+
+# Connections and the snapshot thread do not survive fork()
+def _reset_snapshots():
+    global _local, _snapshot_lock
+    _local = threading.local()
+    _snapshot_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_snapshots)
+
+CallbackMetric(
+    'db_snapshot_age_seconds', 'Seconds since the current database snapshot was taken', 'gauge',
+    lambda: (snapshot_info() or {}).get('age_seconds', float('nan'))
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take a consistent snapshot of the database while it is being written to.")
+    parser.add_argument('--database', help="SQLite database path (default: SQLITE_DB_PATH)")
+    parser.add_argument('--output', help="snapshot path (default: DB_SNAPSHOT_PATH, or <database>.snapshot.db)")
+    parser.add_argument('--pages-per-step', type=int, default=DB_SNAPSHOT_PAGES_PER_STEP, help="pages copied per step (default: %(default)s)")
+    parser.add_argument('--step-sleep-ms', type=float, default=DB_SNAPSHOT_STEP_SLEEP_MS, help="pause between steps (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.database:
+        db_connection.SQLITE_DB_PATH = args.database
+
+    try:
+        snapshot = create_snapshot(args.output, args.pages_per_step, args.step_sleep_ms)
+    except (sqlite3.Error, OSError) as error:
+        print(f"Error taking database snapshot: {error}")
+        return 1
+    if snapshot is None:
+        print("Another snapshot is being taken")
+        return 1
+    print(f"Copied {snapshot['pages']} pages to {snapshot['path']} in {snapshot['seconds']:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
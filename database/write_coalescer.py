@@ -0,0 +1,143 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from database import connection as db_connection
+from database.connection import create_connection, get_connection
+from monitoring.metrics import db_write_batch_size
+
+# Queue single-row writes for one writer thread per process and database
+# file, which commits them in shared transactions (group commit). Off by default.
+WRITE_COALESCING = os.getenv('WRITE_COALESCING', 'false').lower() in ('1', 'true', 'yes')
+
+# Most writes committed in one transaction
+WRITE_BATCH_MAX = int(os.getenv('WRITE_BATCH_MAX', '64'))
+
+# How long the writer waits for more writes after the first one arrives
+WRITE_BATCH_WINDOW_MS = float(os.getenv('WRITE_BATCH_WINDOW_MS', '0'))
+
+
+# Writer thread that drains a queue of write operations in batches. Each
+# operation runs inside its own savepoint, so one failing write is rolled
+# back on its own and reported to its caller while the rest of the batch
+# commits. Callers are answered only after the batch's COMMIT, so a
+# coalesced write is exactly as durable as a directly committed one.
+class WriteCoalescer:
+    def __init__(self, path=None, max_batch=WRITE_BATCH_MAX, window_ms=WRITE_BATCH_WINDOW_MS):
+        self.path = path
+        self.max_batch = max(1, max_batch)
+        self.window = window_ms / 1000
+        self._queue = queue.SimpleQueue()
+        self._connection = None
+        self._thread = threading.Thread(target=self._run, name='write-coalescer', daemon=True)
+        self._thread.start()
+
+    # Queue operation(connection, *args) and return a Future for its result
+    def submit(self, operation, args=()):
+        future = Future()
+        self._queue.put((operation, args, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._commit(batch)
+            except Exception as error:
+                # The thread must outlive any failure, or every caller would
+                # wait on its future forever
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    # Block for the first write, then gather more until the window closes or the batch is full
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        results = []
+        try:
+            if self._connection is None:
+                self._connection = create_connection(self.path)
+            connection = self._connection
+
+            connection.execute("BEGIN IMMEDIATE")
+            for operation, args, future in batch:
+                connection.execute("SAVEPOINT write")
+                try:
+                    result = operation(connection, *args)
+                except Exception as error:
+                    connection.execute("ROLLBACK TO write")
+                    connection.execute("RELEASE write")
+                    results.append((future, None, error))
+                    continue
+                connection.execute("RELEASE write")
+                results.append((future, result, None))
+            connection.commit()
+        except Exception as error:
+            if self._connection is not None and self._connection.in_transaction:
+                try:
+                    self._connection.rollback()
+                except sqlite3.Error:
+                    # Start over on a fresh connection with the next batch
+                    self._connection.close()
+                    self._connection = None
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+
+        # The batch is committed: answer its callers before anything else can
+        # fail, or a caller would retry a write that is already stored
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+        try:
+            db_write_batch_size.observe(len(batch))
+        except Exception as error:
+            print(f"Error recording write batch size: {error}")
+
+
+# This process's coalescers, one per database file. A forked child gets new
+# ones, because writer threads do not survive fork() and their connections
+# must not be shared.
+_coalescers = {}
+_coalescers_pid = None
+_coalescers_lock = threading.Lock()
+
+
+def _get_coalescer(path):
+    global _coalescers, _coalescers_pid
+    with _coalescers_lock:
+        if _coalescers_pid != os.getpid():
+            _coalescers = {}
+            _coalescers_pid = os.getpid()
+        if path not in _coalescers:
+            _coalescers[path] = WriteCoalescer(path)
+        return _coalescers[path]
+
+
+# Run operation(connection, *args) in a write transaction on a database file
+# (SQLITE_DB_PATH by default) and return its result. With WRITE_COALESCING on,
+# the operation is committed together with other pending writes to the same
+# file by its writer thread; errors it raises are re-raised here.
+def run_write(operation, *args, database=None):
+    if not WRITE_COALESCING:
+        connection = get_connection(database)
+        # The connection context manager commits, or rolls back on error,
+        # so the shared connection is never left inside a transaction
+        with connection:
+            return operation(connection, *args)
+    return _get_coalescer(database or db_connection.SQLITE_DB_PATH).submit(operation, args).result()
@@ -0,0 +1,51 @@
+import os
+from database.connection import reset_connections
+from database.initialize import init_db
+
+# Worker models this service supports. gthread (the default) lets slow
+# clients, /changes long-polls and long streaming exports share a process
+# instead of each occupying a whole worker. sync serves one request per
+# process and is slightly faster for short requests, which are CPU-bound on
+# row serialization, but a long-poll blocks the worker for its whole wait.
+WORKER_CLASSES = ('sync', 'gthread')
+
+# Address to listen on
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:80')
+
+# sync or gthread
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"GUNICORN_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not {worker_class!r}")
+
+# One process per core for the CPU-bound row serialization. Reads run in
+# parallel under WAL; writes are serialized by SQLite's single write lock,
+# so more processes than cores only add lock contention.
+workers = int(os.getenv('GUNICORN_WORKERS', str(os.cpu_count() or 1)))
+
+# Request threads per gthread worker, each with its own SQLite connection
+threads = int(os.getenv('GUNICORN_THREADS', '4')) if worker_class == 'gthread' else 1
+
+# Seconds a worker may go without reporting to the master before it is
+# restarted. A gthread worker reports from its own loop while its threads
+# serve requests, so a long export is never cut off; a sync worker reports
+# only between requests, so with sync any export or /all stream running
+# longer than this is killed mid-body.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+# Keep the worker heartbeat file in memory rather than on the container's overlay filesystem
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+# Create the schema, apply migrations and load the seed data once, in the
+# master, before any worker exists. Workers never race to seed the database.
+def on_starting(server):
+    init_db()
+
+
+# Give each worker its own SQLite connections; nothing opened in the master is reused
+def post_fork(server, worker):
+    reset_connections()
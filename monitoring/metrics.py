@@ -0,0 +1,180 @@
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Repository calls slower than this many milliseconds are logged; 0 disables the log
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))
+
+# Every metric, in registration order, rendered by render_metrics()
+_registry = []
+
+
+# Monotonically increasing count, optionally split by label values
+class Counter:
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, tuple(zip(self.labelnames, labels)), value) for labels, value in self._values.items()]
+
+
+# Distribution of observed values over fixed buckets, optionally split by label values
+class Histogram:
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+
+        samples = []
+        for labels, counts, total in values:
+            pairs = tuple(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', (*pairs, ('le', bound)), cumulative))
+            samples.append((f'{self.name}_sum', pairs, total))
+            samples.append((f'{self.name}_count', pairs, cumulative))
+        return samples
+
+
+# Metric whose value is read from a function at scrape time, such as a cache's
+# hit count. With labelnames the function returns {label values: value}.
+class CallbackMetric:
+    def __init__(self, name, documentation, metric_type, function, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.labelnames = labelnames
+        self._function = function
+        _registry.append(self)
+
+    def samples(self):
+        if not self.labelnames:
+            return [(self.name, (), self._function())]
+        return [(self.name, tuple(zip(self.labelnames, labels)), value) for labels, value in self._function().items()]
+
+
+# Render every registered metric in the Prometheus text exposition format
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+        for sample_name, labels, value in metric.samples():
+            lines.append(f'{sample_name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Format (name, value) label pairs as {name="value",...}
+def _format_labels(labels):
+    pairs = ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in labels)
+    return '{' + pairs + '}' if pairs else ''
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by method, route and status',
+    ('method', 'route', 'status')
+)
+db_query_duration = Histogram(
+    'db_query_duration_seconds', 'Repository function latency, including SQL and row conversion',
+    ('function',)
+)
+db_query_rows = Counter('db_query_rows_total', 'Rows returned or affected by repository functions', ('function',))
+db_slow_queries = Counter('db_slow_queries_total', 'Repository calls slower than SLOW_QUERY_MS', ('function',))
+db_write_batch_size = Histogram(
+    'db_write_batch_size', 'Writes committed per transaction by the write coalescer',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+sqlite_connections_opened = Counter('sqlite_connections_opened_total', 'SQLite connections opened')
+sqlite_connections_closed = Counter('sqlite_connections_closed_total', 'SQLite connections closed')
+
+
+# Count the rows in a repository result: list length, column length for
+# columnar results, 1 for a single record, 0 for none
+def _row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and result and all(isinstance(value, list) for value in result.values()):
+        return len(next(iter(result.values())))
+    return 1
+
+
+def _record_query(name, args, kwargs, elapsed, rows):
+    db_query_duration.observe(elapsed, (name,))
+    if rows:
+        db_query_rows.inc((name,), rows)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        db_slow_queries.inc((name,))
+        arguments = ', '.join([*map(repr, args), *(f'{key}={value!r}' for key, value in kwargs.items())])
+        print(f"Slow query: {name}({arguments[:200]}) took {elapsed * 1000:.1f} ms and returned {rows} rows")
+
+
+# Time a repository function and count its rows. Generator functions are timed
+# over their whole iteration and count the rows of every batch they yield.
+def instrumented_query(function):
+    name = function.__name__
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            rows = 0
+            try:
+                for batch in function(*args, **kwargs):
+                    rows += _row_count(batch)
+                    yield batch
+            finally:
+                _record_query(name, args, kwargs, time.perf_counter() - started, rows)
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        _record_query(name, args, kwargs, time.perf_counter() - started, _row_count(result))
+        return result
+    return wrapper
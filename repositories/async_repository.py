@@ -0,0 +1,78 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from repositories import repository
+
+# Threads running the SQLite work of the ASGI app (asgi.py) in each worker
+# process, each with its own connections. The event loop never blocks on
+# SQLite; requests beyond this many wait for a thread without holding one.
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', '8'))
+
+# Thread pool created on first use in each process
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# The process's pool of database threads
+def db_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix='async-db')
+    return _executor
+
+
+# Run a blocking function on the database threads and return its result
+async def run_db(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor(), functools.partial(function, *args, **kwargs))
+
+
+# Executor threads do not survive fork(), so a child creates its own pool
+def _reset_executor():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_executor)
+
+
+# Coroutine version of a repository function, with the same arguments and results
+def _on_db_threads(function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await run_db(function, *args, **kwargs)
+    return wrapper
+
+
+# Coroutine versions of the repository functions. The ASGI app awaits the
+# change feed ones on the event loop; its other routes run their Flask views,
+# and so the synchronous functions, on the same threads. db_iter_all_cars has
+# none: its generator runs a query each time it is advanced, which would block
+# the event loop.
+db_retrieve_all_cars = _on_db_threads(repository.db_retrieve_all_cars)
+db_retrieve_cars_page = _on_db_threads(repository.db_retrieve_cars_page)
+db_retrieve_snapshot_version = _on_db_threads(repository.db_retrieve_snapshot_version)
+db_retrieve_table_generation = _on_db_threads(repository.db_retrieve_table_generation)
+db_retrieve_table_generations = _on_db_threads(repository.db_retrieve_table_generations)
+db_retrieve_changes = _on_db_threads(repository.db_retrieve_changes)
+db_retrieve_change_versions = _on_db_threads(repository.db_retrieve_change_versions)
+db_retrieve_dimension = _on_db_threads(repository.db_retrieve_dimension)
+db_retrieve_car_by_id = _on_db_threads(repository.db_retrieve_car_by_id)
+db_retrieve_cars_by_ids = _on_db_threads(repository.db_retrieve_cars_by_ids)
+db_retrieve_car_by_make = _on_db_threads(repository.db_retrieve_car_by_make)
+db_retrieve_car_by_fuel_type = _on_db_threads(repository.db_retrieve_car_by_fuel_type)
+db_retrieve_car_by_pickup_location = _on_db_threads(repository.db_retrieve_car_by_pickup_location)
+db_retrieve_cars_by_filters = _on_db_threads(repository.db_retrieve_cars_by_filters)
+db_retrieve_car_stats = _on_db_threads(repository.db_retrieve_car_stats)
+db_retrieve_filtered_car_stats = _on_db_threads(repository.db_retrieve_filtered_car_stats)
+db_add_new_car = _on_db_threads(repository.db_add_new_car)
+db_remove_car_by_id = _on_db_threads(repository.db_remove_car_by_id)
+db_update_pickup_location = _on_db_threads(repository.db_update_pickup_location)
+db_add_new_cars = _on_db_threads(repository.db_add_new_cars)
+db_update_pickup_locations = _on_db_threads(repository.db_update_pickup_locations)
+db_remove_cars_by_id = _on_db_threads(repository.db_remove_cars_by_id)
+db_import_cars = _on_db_threads(repository.db_import_cars)
@@ -0,0 +1,158 @@
+import bisect
+import threading
+import unicodedata
+from repositories.repository import (
+    DIMENSION_COLUMNS,
+    db_retrieve_dimension,
+    db_retrieve_table_generations
+    )
+
+
+# Danish letters spelled out as the bundled data spells them (Koege, Aarhus)
+TRANSLITERATION = str.maketrans({'æ': 'ae', 'ø': 'oe', 'å': 'aa'})
+
+
+# Lower-case text, spell out Danish letters, drop accents and collapse
+# whitespace, so that "KØGE" and "koege" compare equal
+def normalize_name(text):
+    text = ' '.join(text.casefold().translate(TRANSLITERATION).split())
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+
+
+# Prefix index over the names of one dimension table. Every name is indexed
+# under its normalized form and under each of its words' suffixes
+# ("land rover" also under "rover"), in one sorted list, so the names with a
+# prefix are a bisect away. Matches are ranked:
+#   0 the whole name, 1 a prefix of the name, 2 a prefix of a later word,
+#   3 anywhere else in the name (a scan, only when the prefixes are too few)
+class NameIndex:
+    def __init__(self, rows, id_column, name_column):
+        self._entries = [(row[id_column], row[name_column], normalize_name(row[name_column] or '')) for row in rows]
+        keys = []
+        for position, (_, _, normalized) in enumerate(self._entries):
+            keys.append((normalized, 1, position))
+            keys.extend(
+                (normalized[start:], 2, position) for start in range(1, len(normalized))
+                if not normalized[start - 1].isalnum() and normalized[start].isalnum()
+            )
+        keys.sort()
+        self._keys = keys
+
+    # [(rank, id, name)] of the best matches of a normalized query, best first
+    def search(self, query, limit):
+        if not query:
+            return []
+        ranks = {}
+        index = bisect.bisect_left(self._keys, (query,))
+        while index < len(self._keys) and self._keys[index][0].startswith(query):
+            key, rank, position = self._keys[index]
+            if rank == 1 and key == query:
+                rank = 0
+            ranks[position] = min(rank, ranks.get(position, rank))
+            index += 1
+        if len(ranks) < limit:
+            for position, (_, _, normalized) in enumerate(self._entries):
+                if position not in ranks and query in normalized:
+                    ranks[position] = 3
+
+        matches = [(rank, *self._entries[position][:2]) for position, rank in ranks.items()]
+        matches.sort(key=_match_order)
+        return matches[:limit]
+
+
+# Best rank first, then shorter names, which the query covers more of
+def _match_order(match):
+    return match[0], len(match[2]), match[2]
+
+
+# Per-worker copy of the small car_make, fuel_types and pickup_location tables.
+# Every lookup checks the tables' write generations with one indexed query and
+# reloads only the tables that changed, so names are never stale and JOINs are
+# never needed to resolve them. The name search index is rebuilt with its table,
+# so makes and locations added by any process are found on the next search.
+class DimensionCache:
+    def __init__(self):
+        # table_name -> (generation, rows ordered by id, {id: name}, NameIndex)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    # Rows of a dimension table, as [{<id column>: ..., <name column>: ...}]
+    def rows(self, table_name):
+        return self._current([table_name])[table_name][1]
+
+    # {table_name: {id: name}} for the requested dimension tables
+    def names(self, table_names=tuple(DIMENSION_COLUMNS)):
+        tables = self._current(table_names)
+        return {table_name: tables[table_name][2] for table_name in table_names}
+
+    # Best name matches of a query across the requested dimension tables, as
+    # [(table_name, rank, id, name)] ordered by rank (see NameIndex)
+    def search(self, query, table_names=tuple(DIMENSION_COLUMNS), limit=10):
+        query = normalize_name(query)
+        tables = self._current(table_names)
+        matches = [
+            (table_name, *match)
+            for table_name in table_names
+            for match in tables[table_name][3].search(query, limit)
+        ]
+        matches.sort(key=lambda match: _match_order(match[1:]))
+        return matches[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+    def _current(self, table_names):
+        generations = db_retrieve_table_generations(table_names) or {}
+        tables = self._tables
+        stale = [
+            table_name for table_name in table_names
+            if table_name not in tables or generations.get(table_name) is None
+            or tables[table_name][0] != generations[table_name]
+        ]
+        if not stale:
+            return tables
+
+        with self._lock:
+            tables = dict(self._tables)
+            for table_name in stale:
+                id_column, name_column = DIMENSION_COLUMNS[table_name]
+                rows = db_retrieve_dimension(table_name) or []
+                tables[table_name] = (
+                    generations.get(table_name),
+                    rows,
+                    {row[id_column]: row[name_column] for row in rows},
+                    NameIndex(rows, id_column, name_column),
+                )
+            # Swap in a new mapping so concurrent readers never see a partial reload
+            self._tables = tables
+        return tables
+
+
+dimension_cache = DimensionCache()
+
+
+# car_management id columns and the name field each one expands to
+EXPANSIONS = (
+    ('car_make_id', 'car_make', 'car_make_name'),
+    ('fuel_type_id', 'fuel_types', 'fuel_type_name'),
+    ('pickup_location_id', 'pickup_location', 'pickup_location_name'),
+)
+
+
+# Add make, fuel type and pickup location names to a single car, a list of
+# cars or a columnar result, in place, and return it
+def expand_names(cars):
+    if not cars:
+        return cars
+
+    names = dimension_cache.names()
+    if isinstance(cars, dict) and isinstance(cars.get('id'), list):
+        for id_column, table_name, name_field in EXPANSIONS:
+            lookup = names[table_name].get
+            cars[name_field] = [lookup(value) for value in cars[id_column]]
+    else:
+        for car in ([cars] if isinstance(cars, dict) else cars):
+            for id_column, table_name, name_field in EXPANSIONS:
+                car[name_field] = names[table_name].get(car[id_column])
+    return cars
@@ -0,0 +1,319 @@
+import threading
+import numpy as np
+from database.connection import create_connection, get_connection
+from monitoring.metrics import CallbackMetric, Counter
+
+# Rows fetched per round trip while building the snapshot
+SNAPSHOT_LOAD_BATCH_SIZE = 100000
+
+# car_management columns, in table order, and the NumPy type each is held as.
+# purchase_date is held as days since 1970-01-01.
+COLUMNS = (
+    ('id', np.int64),
+    ('purchase_date', np.int32),
+    ('purchase_price', np.float64),
+    ('car_make_id', np.int64),
+    ('fuel_type_id', np.int64),
+    ('pickup_location_id', np.int64),
+)
+
+snapshot_rebuilds = Counter('fleet_snapshot_rebuilds_total', 'Full rebuilds of the in-memory fleet snapshot')
+
+
+# Convert YYYY-MM-DD strings to days since the epoch; raises ValueError on anything else
+def _to_days(dates):
+    return np.array(dates, dtype='datetime64[D]').astype(np.int32)
+
+
+def _to_dates(days):
+    return np.datetime_as_string(days.astype('datetime64[D]')).tolist()
+
+
+# Columnar copy of car_management ordered by id. Deleted rows are masked out
+# and compacted away once they make up a quarter of the arrays; inserted rows
+# with ids above every stored one are appended. car_management hands out
+# max(id) + 1, so deleting the car with the highest id lets the next insert
+# reuse its id: that car takes over the dead row of the same id, and any other
+# insert below the highest stored id rebuilds the snapshot.
+#
+# The snapshot is tied to the car_management write generation. Writes made
+# through this process's repository are recorded as deltas, keyed by the
+# generation before and after them, and applied in order on the next read.
+# If the chain of deltas does not reach the database's generation, another
+# process wrote, and the snapshot is rebuilt from the table.
+class FleetSnapshot:
+    def __init__(self):
+        self.generation = None
+        self._columns = {}
+        self._alive = None
+        self._size = 0
+        self._dead = 0
+        # generation before -> (generation after, kind, rows)
+        self._pending = {}
+        # Generation at which the table could not be loaded (e.g. a malformed date)
+        self._failed_generation = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size - self._dead
+
+    # Record a committed write of this process: kind is 'insert' with full
+    # rows, 'update' with (id, pickup_location_id) pairs or 'delete' with ids
+    def record(self, before, after, kind, rows):
+        if before == after:
+            return
+        with self._lock:
+            if self.generation is not None and before >= self.generation:
+                self._pending[before] = (after, kind, rows)
+
+    # Cars matching the filters, as a list of dicts or, when columnar, a dict
+    # of lists; None if the snapshot is unavailable and SQL must answer
+    def cars(self, filters, sort=None, descending=False, limit=None, columnar=False):
+        with self._lock:
+            if not self._refresh():
+                return None
+            indexes = self._select(filters)
+            if sort is not None:
+                indexes = self._order(indexes, sort, descending, limit)
+            elif limit is not None:
+                indexes = indexes[:limit]
+
+            values = {
+                name: _to_dates(self._columns[name][indexes]) if name == 'purchase_date' else self._columns[name][indexes].tolist()
+                for name, _ in COLUMNS
+            }
+        if columnar:
+            return values
+        return [dict(zip(values, row)) for row in zip(*values.values())]
+
+    # Count, price and date statistics of the matching cars grouped by one id
+    # column, in the format of db_retrieve_car_stats; None if unavailable
+    def stats(self, dimension, filters):
+        with self._lock:
+            if not self._refresh():
+                return None
+            indexes = self._select(filters)
+            groups = self._columns[dimension][indexes]
+            prices = self._columns['purchase_price'][indexes]
+            days = self._columns['purchase_date'][indexes]
+
+        if not len(indexes):
+            return []
+        # Ids are not checked against the dimension tables and can be any
+        # integer, so each distinct id gets a bincount slot of its own
+        group_ids, groups = np.unique(groups, return_inverse=True)
+        counts = np.bincount(groups)
+        sums = np.bincount(groups, weights=prices)
+        price_min = np.full(len(counts), np.inf)
+        price_max = np.full(len(counts), -np.inf)
+        date_min = np.full(len(counts), np.iinfo(np.int32).max, dtype=np.int32)
+        date_max = np.full(len(counts), np.iinfo(np.int32).min, dtype=np.int32)
+        np.minimum.at(price_min, groups, prices)
+        np.maximum.at(price_max, groups, prices)
+        np.minimum.at(date_min, groups, days)
+        np.maximum.at(date_max, groups, days)
+
+        date_min, date_max = _to_dates(date_min), _to_dates(date_max)
+        return [
+            {
+                dimension: group_id,
+                'count': count,
+                'purchase_price': {'sum': total, 'avg': total / count, 'min': low, 'max': high},
+                'purchase_date': {'min': first, 'max': last},
+            }
+            for group_id, count, total, low, high, first, last in zip(
+                group_ids.tolist(), counts.tolist(), sums.tolist(), price_min.tolist(), price_max.tolist(), date_min, date_max
+            )
+        ]
+
+    def clear(self):
+        with self._lock:
+            self.generation = None
+            self._columns = {}
+            self._alive = None
+            self._size = self._dead = 0
+            self._pending.clear()
+
+    # Bring the snapshot to the database's current generation, applying
+    # recorded deltas or rebuilding; False if it cannot be loaded
+    def _refresh(self):
+        generation = _current_generation()
+        if generation is None or generation == self._failed_generation:
+            return False
+
+        while self.generation != generation and self.generation in self._pending:
+            after, kind, rows = self._pending.pop(self.generation)
+            try:
+                self._apply(kind, rows)
+            except ValueError:
+                self.generation = None
+                break
+            self.generation = after
+        self._pending = {before: delta for before, delta in self._pending.items() if before >= (self.generation or 0)}
+
+        if self.generation != generation:
+            try:
+                self._load(generation)
+            except ValueError as error:
+                print(f"Fleet snapshot unavailable, serving from SQL: {error}")
+                self.clear()
+                self._failed_generation = generation
+                return False
+        elif self._dead * 4 > self._size:
+            self._compact()
+        return True
+
+    # Read the whole table, in id order, into fresh arrays
+    def _load(self, generation):
+        connection = create_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.row_factory = None
+            # The read transaction pins the table to the generation read with it
+            cursor.execute("BEGIN")
+            loaded_generation = _current_generation(cursor)
+            cursor.execute("SELECT COUNT(*) FROM car_management")
+            capacity = cursor.fetchone()[0]
+            columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in COLUMNS}
+
+            cursor.execute(f"SELECT {', '.join(name for name, _ in COLUMNS)} FROM car_management ORDER BY id")
+            size = 0
+            while rows := cursor.fetchmany(SNAPSHOT_LOAD_BATCH_SIZE):
+                for (name, _), values in zip(COLUMNS, zip(*rows)):
+                    columns[name][size:size + len(rows)] = _to_days(values) if name == 'purchase_date' else values
+                size += len(rows)
+            connection.rollback()
+        finally:
+            connection.close()
+
+        self._columns = columns
+        self._alive = np.ones(size, dtype=bool)
+        self._size = size
+        self._dead = 0
+        self.generation = loaded_generation if loaded_generation is not None else generation
+        self._failed_generation = None
+        snapshot_rebuilds.inc()
+
+    def _apply(self, kind, rows):
+        if kind == 'insert':
+            self._append(rows)
+            return
+
+        ids = np.array([row if kind == 'delete' else row[0] for row in rows], dtype=np.int64)
+        positions = np.searchsorted(self._columns['id'][:self._size], ids)
+        found = (positions < self._size)
+        found[found] = self._columns['id'][positions[found]] == ids[found]
+        found[found] = self._alive[positions[found]]
+        positions = positions[found]
+        if kind == 'delete':
+            self._alive[positions] = False
+            self._dead += len(positions)
+        else:
+            locations = np.array([row[1] for row in rows], dtype=np.int64)[found]
+            self._columns['pickup_location_id'][positions] = locations
+
+    def _append(self, rows):
+        if self._size:
+            last_id = self._columns['id'][self._size - 1]
+            self._revive([row for row in rows if row[0] <= last_id])
+            rows = [row for row in rows if row[0] > last_id]
+        if any(row[0] >= following[0] for row, following in zip(rows, rows[1:])):
+            raise ValueError("Inserted car ids are not in ascending order")
+
+        count = len(rows)
+        if self._size + count > len(self._alive):
+            capacity = max(2 * len(self._alive), self._size + count, 1024)
+            for name, dtype in COLUMNS:
+                grown = np.empty(capacity, dtype=dtype)
+                grown[:self._size] = self._columns[name][:self._size]
+                self._columns[name] = grown
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self._size] = self._alive[:self._size]
+            self._alive = alive
+
+        end = self._size + count
+        for (name, _), values in zip(COLUMNS, zip(*rows)):
+            self._columns[name][self._size:end] = _to_days(values) if name == 'purchase_date' else values
+        self._alive[self._size:end] = True
+        self._size = end
+
+    # Store inserted rows in the dead rows of the same ids, which SQLite
+    # handed out again; raises ValueError if a row has no dead row to take
+    def _revive(self, rows):
+        if not rows:
+            return
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        positions = np.searchsorted(self._columns['id'][:self._size], ids)
+        if (positions >= self._size).any():
+            raise ValueError("Inserted car id has no row in the snapshot")
+        if (self._columns['id'][positions] != ids).any() or self._alive[positions].any():
+            raise ValueError("Inserted car id has no dead row in the snapshot")
+        for (name, _), values in zip(COLUMNS, zip(*rows)):
+            self._columns[name][positions] = _to_days(values) if name == 'purchase_date' else values
+        self._alive[positions] = True
+        self._dead -= len(positions)
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        self._columns = {name: self._columns[name][keep] for name, _ in COLUMNS}
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._size = len(keep)
+        self._dead = 0
+
+    # Positions of the live cars matching every filter, in id order
+    def _select(self, filters):
+        mask = self._alive[:self._size].copy()
+        for name, operator, value in (
+            ('car_make_id', '=', filters.get('car_make_id')),
+            ('fuel_type_id', '=', filters.get('fuel_type_id')),
+            ('pickup_location_id', '=', filters.get('pickup_location_id')),
+            ('purchase_date', '>=', filters.get('purchase_date_from')),
+            ('purchase_date', '<=', filters.get('purchase_date_to')),
+            ('purchase_price', '>=', filters.get('min_price')),
+            ('purchase_price', '<=', filters.get('max_price')),
+        ):
+            if value is None:
+                continue
+            if name == 'purchase_date':
+                value = _to_days([value])[0]
+            column = self._columns[name][:self._size]
+            if operator == '=':
+                mask &= column == value
+            elif operator == '>=':
+                mask &= column >= value
+            else:
+                mask &= column <= value
+        return np.flatnonzero(mask)
+
+    # Order positions by a column with ties broken by id, as the SQL path does.
+    # With a limit only the k smallest (or largest) keys, plus ties at the
+    # boundary, are fully sorted.
+    def _order(self, indexes, sort, descending, limit):
+        keys = self._columns[sort][indexes]
+        if limit is not None and limit < len(indexes):
+            if descending:
+                boundary = np.partition(keys, len(keys) - limit)[len(keys) - limit]
+                candidates = keys >= boundary
+            else:
+                boundary = np.partition(keys, limit - 1)[limit - 1]
+                candidates = keys <= boundary
+            indexes, keys = indexes[candidates], keys[candidates]
+
+        # Positions are in id order, so a stable sort on the key keeps ids ascending within ties
+        order = np.argsort(keys, kind='stable')
+        if descending:
+            order = order[::-1]
+        indexes = indexes[order]
+        return indexes[:limit] if limit is not None else indexes
+
+
+def _current_generation(cursor=None):
+    cursor = cursor or get_connection().cursor()
+    cursor.execute("SELECT generation FROM table_generation WHERE table_name = 'car_management'")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+fleet_snapshot = FleetSnapshot()
+
+CallbackMetric('fleet_snapshot_rows', 'Live cars held in the in-memory fleet snapshot', 'gauge', lambda: len(fleet_snapshot))
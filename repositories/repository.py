@@ -1,157 +1,1134 @@
+import heapq
+import itertools
+import json
+import os
 import sqlite3
-from database.connection import create_connection
+from collections import defaultdict
+from operator import itemgetter
+from database.change_log import compact_changes_if_due
+from database.connection import create_connection, get_connection
+from database.shards import (
+    SHARD_COUNT,
+    allocate_ids,
+    get_shard_connection,
+    locate_cars,
+    map_shards,
+    reserve_ids,
+    shard_for_location,
+    shard_path,
+)
+from database.snapshot import (
+    DB_SNAPSHOT_READS,
+    create_snapshot_connection,
+    get_snapshot_connection,
+    snapshot_if_due,
+    snapshot_version,
+)
+from database.write_coalescer import run_write
+from database.migrations import STATS_DIMENSIONS
+from monitoring.metrics import instrumented_query
+
+# Serve car filters, top-k and filtered statistics from an in-memory columnar
+# copy of car_management in every worker (repositories/fleet_snapshot.py).
+# Off by default: it costs about 32 bytes per car per worker, and a write from
+# another process makes the next read rebuild the whole copy. The copy is
+# loaded from SQLITE_DB_PATH, so it stays off with partitioned storage.
+FLEET_SNAPSHOT = os.getenv('FLEET_SNAPSHOT', 'false').lower() in ('1', 'true', 'yes') and not SHARD_COUNT
+
+# Serve the heavy reads (all cars, the export stream and fleet statistics)
+# from the latest database snapshot (database/snapshot.py), so they do not
+# compete with the requests reading and writing SQLITE_DB_PATH. Snapshots of
+# partitioned storage are backups only: their shards are not read from.
+SNAPSHOT_READS = DB_SNAPSHOT_READS and not SHARD_COUNT
+
+# Columns cars can be ordered by
+SORT_COLUMNS = ('id', 'purchase_date', 'purchase_price')
+
+# Columns supplied when creating a car
+CAR_FIELDS = ('purchase_date', 'purchase_price', 'car_make_id', 'fuel_type_id', 'pickup_location_id')
+
+# Id and name columns of each dimension table
+DIMENSION_COLUMNS = {
+    'car_make': ('car_make_id', 'car_make_name'),
+    'fuel_types': ('fuel_type_id', 'fuel_type_name'),
+    'pickup_location': ('pickup_location_id', 'pickup_location_name'),
+}
 
 
 # Retrieve all cars
-def db_retrieve_all_cars():
+@instrumented_query
+def db_retrieve_all_cars(columnar=False):
+    try:
+        # Retrieve all cars
+        columns, rows = _read_rows(
+            """
+            SELECT * FROM car_management ORDER BY id
+            """, order='id', snapshot=True
+        )
+        return _records(columns, rows, columnar)
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# Retrieve one page of cars ordered by id, starting after the given id
+@instrumented_query
+def db_retrieve_cars_page(limit, after=0):
     try:
-        connection = create_connection()
+        # Keyset pagination: seeks straight to the primary key, so the cost
+        # of a page does not grow with how deep into the table it is
+        columns, rows = _read_rows(
+            """
+            SELECT * FROM car_management WHERE id > ? ORDER BY id LIMIT ?
+            """, (after, limit), order='id', snapshot=True
+        )
+        return _records(columns, rows[:limit])
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# Stream all cars ordered by id, yielding lists of at most batch_size cars
+@instrumented_query
+def db_iter_all_cars(batch_size=1000):
+    # Dedicated connections, because the generator outlives the request
+    # handler and must not hold a cursor open on the thread's shared connection.
+    # The ASGI app advances it from whichever pool thread is free.
+    paths = [shard_path(index) for index in range(SHARD_COUNT)] if SHARD_COUNT else [None]
+    snapshot = _create_snapshot_connection(check_same_thread=False)
+    connections = [snapshot] if snapshot is not None else [create_connection(path, check_same_thread=False) for path in paths]
+    try:
+        cursors = []
+        for connection in connections:
+            cursor = _tuple_cursor(connection)
+            cursor.execute(
+                """
+                SELECT * FROM car_management ORDER BY id
+                """
+            )
+            cursors.append(cursor)
+        columns = [description[0] for description in cursors[0].description]
+
+        # Each shard streams in id order, so merging them keeps the export in id order
+        if len(cursors) > 1:
+            rows = heapq.merge(*(_fetch_batches(cursor, batch_size) for cursor in cursors), key=itemgetter(0))
+        else:
+            rows = _fetch_batches(cursors[0], batch_size)
+        while batch := list(itertools.islice(rows, batch_size)):
+            yield _records(columns, batch)
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+# Version of the snapshot the heavy reads are served from, which changes when
+# a newer snapshot replaces it, or None while they read SQLITE_DB_PATH
+def db_retrieve_snapshot_version():
+    if _snapshot_connection() is None:
+        return None
+    return snapshot_version()
+
+
+# Retrieve the write generation of a table, which changes on every write to it
+@instrumented_query
+def db_retrieve_table_generation(table_name):
+    try:
+        connection = get_connection()
         cursor = connection.cursor()
 
-        # Retrieve all cars
         cursor.execute(
             """
-            SELECT * FROM car_management
+            SELECT generation FROM table_generation WHERE table_name = ?
+            """, (table_name,)
+        )
+        row = cursor.fetchone()
+        if row and SHARD_COUNT and table_name == 'car_management':
+            return row[0] + _shard_generation()
+        return row[0] if row else None
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# Retrieve the write generations of several tables as {table_name: generation}
+@instrumented_query
+def db_retrieve_table_generations(table_names):
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        cursor.execute(
             """
+            SELECT table_name, generation FROM table_generation
+            WHERE table_name IN (SELECT value FROM json_each(?))
+            """, (json.dumps(list(table_names)),)
         )
-        cars = cursor.fetchall()
-        return [dict(row) for row in cars]
+        generations = {row[0]: row[1] for row in cursor.fetchall()}
+        if SHARD_COUNT and 'car_management' in generations:
+            generations['car_management'] += _shard_generation()
+        return generations
     except sqlite3.Error as error:
         print(f"Database error: {error}")
-    finally:
-        connection.close()
 
 
-# Retrieve a car by id
-def db_retrieve_car_by_id(id):
+# Retrieve up to limit changes to car_management newer than a version, in
+# version order, together with the log's retention horizon and latest version.
+# All three are read in one transaction, so they describe the same moment.
+@instrumented_query
+def db_retrieve_changes(since, limit):
+    try:
+        connection = get_connection()
+        cursor = _tuple_cursor(connection)
+
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(
+                """
+                SELECT version, operation, car_id, changed_at,
+                       purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id
+                FROM car_changes WHERE version > ? ORDER BY version LIMIT ?
+                """, (since, limit)
+            )
+            rows = cursor.fetchall()
+            horizon, latest = _change_versions(cursor)
+        finally:
+            connection.rollback()
+
+        changes = [
+            {
+                'version': version,
+                'operation': operation,
+                'id': car_id,
+                'changed_at': changed_at,
+                'car': None if operation == 'delete' else {
+                    'id': car_id,
+                    'purchase_date': purchase_date,
+                    'purchase_price': purchase_price,
+                    'car_make_id': car_make_id,
+                    'fuel_type_id': fuel_type_id,
+                    'pickup_location_id': pickup_location_id,
+                },
+            }
+            for version, operation, car_id, changed_at, purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id in rows
+        ]
+        return {'changes': changes, 'horizon': horizon, 'latest_version': latest}
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# Retrieve the change log's (retention horizon, latest version), from the
+# snapshot the heavy reads are served from when snapshot is set
+@instrumented_query
+def db_retrieve_change_versions(snapshot=False):
     try:
-        connection = create_connection()
+        connection = _snapshot_connection() if snapshot else None
+        return _change_versions((connection or get_connection()).cursor())
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# The latest version comes from the AUTOINCREMENT counter, so it is known
+# even when compaction has emptied the log
+def _change_versions(cursor):
+    cursor.execute(
+        """
+        SELECT horizon, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'car_changes'), 0)
+        FROM car_changes_state
+        """
+    )
+    return tuple(cursor.fetchone())
+
+
+# Retrieve every row of a dimension table (car_make, fuel_types or pickup_location)
+@instrumented_query
+def db_retrieve_dimension(table_name):
+    id_column, name_column = DIMENSION_COLUMNS[table_name]
+    try:
+        connection = get_connection()
         cursor = connection.cursor()
 
         cursor.execute(
+            f"""
+            SELECT {id_column}, {name_column} FROM {table_name} ORDER BY {id_column}
+            """
+        )
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# Retrieve a car by id
+@instrumented_query
+def db_retrieve_car_by_id(id):
+    try:
+        columns, rows = _read_rows(
             """
             SELECT * FROM car_management WHERE id = ?
-            """, (id,)
+            """, (id,), parallel=False
         )
-        car = cursor.fetchone()
-        return dict(car)
+        return dict(zip(columns, rows[0])) if rows else None
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+# Retrieve the existing cars among many ids in one query, in id order.
+# Each id is a primary key seek, so the cost grows with the number of ids
+# asked for, not with the size of the table.
+@instrumented_query
+def db_retrieve_cars_by_ids(ids):
+    try:
+        columns, rows = _read_rows(
+            """
+            SELECT * FROM car_management WHERE id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(list(ids)),)
+        )
+        return _records(columns, rows)
     except sqlite3.Error as error:
         print(f"Database error: {error}")
-    finally:
-        connection.close()
 
 # Retrieve car by make
-def db_retrieve_car_by_make(car_make_id):
+@instrumented_query
+def db_retrieve_car_by_make(car_make_id, columnar=False):
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
+        if FLEET_SNAPSHOT:
+            cars = _fleet_snapshot().cars({'car_make_id': car_make_id}, columnar=columnar)
+            if cars is not None:
+                return cars
 
-        cursor.execute(
+        columns, rows = _read_rows(
             """
             SELECT * FROM car_management WHERE car_make_id = ?
             """, (car_make_id,)
         )
-        car = cursor.fetchall()
-        return [dict(row) for row in car]
+        return _records(columns, rows, columnar)
     except sqlite3.Error as error:
         print(f"Database error: {error}")
-    finally:
-        connection.close()
 
 # Retrieve car by fuel type
-def db_retrieve_car_by_fuel_type(fuel_type_id):
+@instrumented_query
+def db_retrieve_car_by_fuel_type(fuel_type_id, columnar=False):
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
+        if FLEET_SNAPSHOT:
+            cars = _fleet_snapshot().cars({'fuel_type_id': fuel_type_id}, columnar=columnar)
+            if cars is not None:
+                return cars
 
-        cursor.execute(
+        columns, rows = _read_rows(
             """
             SELECT * FROM car_management WHERE fuel_type_id = ?
             """, (fuel_type_id,)
         )
-        car = cursor.fetchall()
-        return [dict(row) for row in car]
+        return _records(columns, rows, columnar)
     except sqlite3.Error as error:
         print(f"Database error: {error}")
-    finally:
-        connection.close()
 
 # Retrieve car by pickup location
-def db_retrieve_car_by_pickup_location(pickup_location_id):
+@instrumented_query
+def db_retrieve_car_by_pickup_location(pickup_location_id, columnar=False):
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
+        if FLEET_SNAPSHOT:
+            cars = _fleet_snapshot().cars({'pickup_location_id': pickup_location_id}, columnar=columnar)
+            if cars is not None:
+                return cars
 
-        cursor.execute(
+        columns, rows = _read_rows(
             """
             SELECT * FROM car_management WHERE pickup_location_id = ?
-            """, (pickup_location_id,)
+            """, (pickup_location_id,), shard=_location_shard(pickup_location_id)
         )
-        car = cursor.fetchall()
-        return [dict(row) for row in car]
+        return _records(columns, rows, columnar)
     except sqlite3.Error as error:
         print(f"Database error: {error}")
-    finally:
-        connection.close()
 
-# Add a new car
-def db_add_new_car(data):
+# Retrieve cars matching any combination of make, fuel type and pickup location
+@instrumented_query
+def db_retrieve_cars_by_filters(car_make_id=None, fuel_type_id=None, pickup_location_id=None,
+                                purchase_date_from=None, purchase_date_to=None, min_price=None, max_price=None,
+                                sort=None, descending=False, limit=None):
+    filters = {
+        'car_make_id': car_make_id,
+        'fuel_type_id': fuel_type_id,
+        'pickup_location_id': pickup_location_id,
+        'purchase_date_from': purchase_date_from,
+        'purchase_date_to': purchase_date_to,
+        'min_price': min_price,
+        'max_price': max_price,
+    }
+    if sort is not None and sort not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort}")
+
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
+        if FLEET_SNAPSHOT and not _index_ordered(filters, sort, limit):
+            cars = _fleet_snapshot().cars(filters, sort, descending, limit)
+            if cars is not None:
+                return cars
 
-        cursor.execute(
+        where, parameters = _filter_clause(filters)
+
+        # Ties are broken by id, which every index carries as its last column,
+        # so an ordered index scan needs no separate sort step
+        order = ""
+        if sort is not None:
+            direction = "DESC" if descending else "ASC"
+            order = f"ORDER BY {sort} {direction}" + (f", id {direction}" if sort != 'id' else "")
+
+        if limit is not None:
+            order += " LIMIT ?"
+            parameters.append(limit)
+
+        # Each shard returns its own top-k, which are merged into the overall top-k
+        columns, rows = _read_rows(
+            f"""
+            SELECT * FROM car_management {where} {order}
+            """, parameters, shard=_location_shard(pickup_location_id), order=sort, descending=descending
+        )
+        return _records(columns, rows[:limit] if limit is not None else rows)
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+# Retrieve trigger-maintained fleet statistics grouped by one car_management column
+@instrumented_query
+def db_retrieve_car_stats(dimension):
+    try:
+        _, rows = _read_rows(
             """
-            INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) Values (?, ?, ?, ?, ?)
-            """, (
-                data['purchase_date'], 
-                data['purchase_price'], 
-                data['car_make_id'], 
-                data['fuel_type_id'], 
-                data['pickup_location_id']
-                )
+            SELECT group_id, car_count, price_sum, price_min, price_max, date_min, date_max
+            FROM car_stats WHERE dimension = ? ORDER BY group_id
+            """, (dimension,), snapshot=True
         )
-        connection.commit()
+        return _stats_records(dimension, rows)
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+# Compute fleet statistics of the cars matching the filters of
+# db_retrieve_cars_by_filters, grouped by one car_management id column
+@instrumented_query
+def db_retrieve_filtered_car_stats(dimension, **filters):
+    if dimension not in STATS_DIMENSIONS:
+        raise ValueError(f"Cannot group by {dimension}")
+
+    try:
+        if FLEET_SNAPSHOT:
+            groups = _fleet_snapshot().stats(dimension, filters)
+            if groups is not None:
+                return groups
+
+        where, parameters = _filter_clause(filters)
+        _, rows = _read_rows(
+            f"""
+            SELECT {dimension} AS group_id, COUNT(*) AS car_count, SUM(purchase_price) AS price_sum,
+                   MIN(purchase_price) AS price_min, MAX(purchase_price) AS price_max,
+                   MIN(purchase_date) AS date_min, MAX(purchase_date) AS date_max
+            FROM car_management {where} GROUP BY {dimension} ORDER BY {dimension}
+            """, parameters, shard=_location_shard(filters.get('pickup_location_id')), snapshot=True
+        )
+        return _stats_records(dimension, rows)
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+# Add a new car
+@instrumented_query
+def db_add_new_car(data):
+    try:
+        _after_write(run_write(_insert_car, data, database=_location_database(data['pickup_location_id'])))
         return "Car added successfully"
     except sqlite3.Error as error:
         print(f"Database error: {error}")
-    finally:
-        connection.close()
 
 
 # Remove a car
+@instrumented_query
 def db_remove_car_by_id(id):
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
-
-        cursor.execute(
-            """
-            DELETE FROM car_management WHERE id = ?
-            """, (id,)
-        )
-        connection.commit()
+        if SHARD_COUNT:
+            _remove_sharded_car(id)
+            _after_write(None)
+        else:
+            _after_write(run_write(_delete_car, id))
         return "Car removed successfully"
     except sqlite3.Error as error:
         print(f"Database error: {error}")
-    finally:
-        connection.close()
 
 # Update pickup location id using JSON body and id
+@instrumented_query
 def db_update_pickup_location(id, data):
     try:
-        connection = create_connection()
+        if SHARD_COUNT:
+            _relocate_sharded_car(id, data['pickup_location_id'])
+            _after_write(None)
+        else:
+            _after_write(run_write(_update_pickup_location, id, data['pickup_location_id']))
+        return "Pickup location updated successfully"
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# Single-row writes, run by run_write inside a transaction it commits.
+# Each returns the change for the fleet snapshot (see _snapshot_delta).
+def _insert_car(connection, data):
+    row = tuple(data[field] for field in CAR_FIELDS)
+    if SHARD_COUNT:
+        # A shard takes the id from its own counter (see allocate_ids)
+        _insert_cars_with_ids(connection, [(*allocate_ids(connection, 1), *row)])
+        return None
+    cursor = connection.execute(
+        """
+        INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) Values (?, ?, ?, ?, ?)
+        """, row
+    )
+    return _snapshot_delta(connection, cursor.rowcount, 'insert', [(cursor.lastrowid, *row)])
+
+
+def _delete_car(connection, id):
+    cursor = connection.execute(
+        """
+        DELETE FROM car_management WHERE id = ?
+        """, (id,)
+    )
+    return _snapshot_delta(connection, cursor.rowcount, 'delete', [id])
+
+
+def _update_pickup_location(connection, id, pickup_location_id):
+    cursor = connection.execute(
+        """
+        UPDATE car_management SET pickup_location_id = ? WHERE id = ?
+        """, (pickup_location_id, id)
+    )
+    return _snapshot_delta(connection, cursor.rowcount, 'update', [(id, pickup_location_id)])
+
+
+# Add many cars in one transaction, returning one result per input item
+@instrumented_query
+def db_add_new_cars(cars):
+    results, valid = _validate_batch(cars, CAR_FIELDS)
+    if not valid:
+        return results
+    if SHARD_COUNT:
+        _add_sharded_cars(results, valid)
+        _after_write(None)
+        return results
+
+    rows = [tuple(car[field] for field in CAR_FIELDS) for _, car in valid]
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        # The write lock is held from the MAX(id) read through the commit, and
+        # rows without an explicit id get MAX(id) + 1, so the batch receives a
+        # contiguous block of ids in input order
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM car_management")
+            first_id = cursor.fetchone()[0] + 1
+            cursor.executemany(
+                """
+                INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) Values (?, ?, ?, ?, ?)
+                """, rows
+            )
+            delta = _snapshot_delta(connection, cursor.rowcount, 'insert', [(first_id + offset, *row) for offset, row in enumerate(rows)])
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        _after_write(delta)
+
+        for offset, (index, _) in enumerate(valid):
+            results[index] = {'index': index, 'status': 'created', 'id': first_id + offset}
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+        _fail_batch(results, valid, error)
+    return results
+
+
+# Update the pickup location of many cars in one transaction
+@instrumented_query
+def db_update_pickup_locations(updates):
+    results, valid = _validate_batch(updates, ('id', 'pickup_location_id'))
+    if not valid:
+        return results
+    if SHARD_COUNT:
+        _update_sharded_locations(results, valid)
+        _after_write(None)
+        return results
+
+    try:
+        connection = get_connection()
         cursor = connection.cursor()
 
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            existing = _existing_car_ids(cursor, [update['id'] for _, update in valid])
+            changes = [(update['id'], update['pickup_location_id']) for _, update in valid if update['id'] in existing]
+            cursor.executemany(
+                """
+                UPDATE car_management SET pickup_location_id = ? WHERE id = ?
+                """, [(pickup_location_id, id) for id, pickup_location_id in changes]
+            )
+            delta = _snapshot_delta(connection, cursor.rowcount, 'update', changes)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        _after_write(delta)
+
+        for index, update in valid:
+            status = 'updated' if update['id'] in existing else 'not_found'
+            results[index] = {'index': index, 'status': status, 'id': update['id']}
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+        _fail_batch(results, valid, error)
+    return results
+
+
+# Remove many cars by id in one transaction
+@instrumented_query
+def db_remove_cars_by_id(ids):
+    results, valid = _validate_batch([{'id': id} for id in ids], ('id',))
+    if not valid:
+        return results
+    if SHARD_COUNT:
+        _remove_sharded_cars(results, valid)
+        _after_write(None)
+        return results
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            existing = _existing_car_ids(cursor, [item['id'] for _, item in valid])
+            cursor.executemany(
+                """
+                DELETE FROM car_management WHERE id = ?
+                """, [(id,) for id in existing]
+            )
+            delta = _snapshot_delta(connection, cursor.rowcount, 'delete', list(existing))
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        _after_write(delta)
+
+        for index, item in valid:
+            status = 'deleted' if item['id'] in existing else 'not_found'
+            results[index] = {'index': index, 'status': status, 'id': item['id']}
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+        _fail_batch(results, valid, error)
+    return results
+
+
+# Insert one chunk of imported cars in a single transaction and return how
+# many were written. Make, fuel type and location names are mapped to this
+# database's ids, adding unseen makes and locations; an unknown fuel type
+# raises ValueError and nothing in the chunk is written. With keep_ids, cars
+# carrying an id are upserted by it, so re-running an import is idempotent;
+# unchanged cars are skipped and fire no triggers or change log entries.
+# With partitioned storage the names are committed first and each shard
+# then writes its part of the chunk in its own transaction.
+@instrumented_query
+def db_import_cars(cars, keep_ids=True):
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Makes and locations missing here are added; fuel types are a fixed list
+            mappings = {
+                table_name: _name_mapping(cursor, table_name, cars, add_missing=table_name != 'fuel_types')
+                for table_name in DIMENSION_COLUMNS
+            }
+            upserts, inserts = [], []
+            for car in cars:
+                row = [car['purchase_date'], car['purchase_price']]
+                for table_name, (id_column, name_column) in DIMENSION_COLUMNS.items():
+                    if name_column not in car:
+                        row.append(car[id_column])
+                    elif car[name_column] in mappings[table_name]:
+                        row.append(mappings[table_name][car[name_column]])
+                    else:
+                        raise ValueError(f"Unknown {name_column} {car[name_column]!r}")
+                if keep_ids and car.get('id') is not None:
+                    upserts.append((car['id'], *row))
+                else:
+                    inserts.append(tuple(row))
+
+            if not SHARD_COUNT:
+                _upsert_cars(cursor, upserts)
+                cursor.executemany(
+                    """
+                    INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) Values (?, ?, ?, ?, ?)
+                    """, inserts
+                )
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        if SHARD_COUNT:
+            _import_sharded_cars(upserts, inserts)
+        # Upserted ids may fall anywhere in the table, so the fleet snapshot
+        # is left to rebuild instead of receiving a delta
+        _after_write(None)
+        return len(cars)
+    except sqlite3.Error as error:
+        print(f"Database error: {error}")
+
+
+# {name: id} of a dimension table for the names used by a chunk of imported
+# cars, first adding the names it lacks when add_missing is set
+def _name_mapping(cursor, table_name, cars, add_missing):
+    id_column, name_column = DIMENSION_COLUMNS[table_name]
+    names = list({car[name_column] for car in cars if name_column in car})
+    if not names:
+        return {}
+    if add_missing:
+        cursor.executemany(f"INSERT OR IGNORE INTO {table_name} ({name_column}) VALUES (?)", [(name,) for name in names])
+    cursor.execute(
+        f"""
+        SELECT {name_column}, {id_column} FROM {table_name} WHERE {name_column} IN (SELECT value FROM json_each(?))
+        """, (json.dumps(names),)
+    )
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+# Upsert (id, *CAR_FIELDS) rows by id, leaving unchanged cars untouched
+def _upsert_cars(cursor, rows):
+    cursor.executemany(
+        """
+        INSERT INTO car_management (id, purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            purchase_date = excluded.purchase_date,
+            purchase_price = excluded.purchase_price,
+            car_make_id = excluded.car_make_id,
+            fuel_type_id = excluded.fuel_type_id,
+            pickup_location_id = excluded.pickup_location_id
+        WHERE (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id)
+            IS NOT (excluded.purchase_date, excluded.purchase_price, excluded.car_make_id, excluded.fuel_type_id, excluded.pickup_location_id)
+        """, rows
+    )
+
+
+# Insert (id, *CAR_FIELDS) rows whose ids were allocated by a shard
+def _insert_cars_with_ids(cursor, rows):
+    cursor.executemany(
+        """
+        INSERT INTO car_management (id, purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) VALUES (?, ?, ?, ?, ?, ?)
+        """, rows
+    )
+
+
+# Split batch items into per-item error results and (index, item) pairs that carry every required field
+def _validate_batch(items, required_fields):
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {'index': index, 'status': 'error', 'error': 'Item must be an object'}
+            continue
+        missing = [field for field in required_fields if item.get(field) is None]
+        if missing:
+            results[index] = {'index': index, 'status': 'error', 'error': f"Missing field(s): {', '.join(missing)}"}
+            continue
+        # JSON true and false are ints to Python, and would address cars 1 and 0
+        if 'id' in required_fields and (not isinstance(item['id'], int) or isinstance(item['id'], bool)):
+            results[index] = {'index': index, 'status': 'error', 'error': 'id must be an integer'}
+            continue
+        valid.append((index, item))
+    return results, valid
+
+
+# Mark every valid item of a rolled-back batch as failed
+def _fail_batch(results, valid, error):
+    for index, _ in valid:
+        results[index] = {'index': index, 'status': 'error', 'error': f'Transaction rolled back: {error}'}
+
+
+# Return which of the given car ids exist, in a single indexed query
+def _existing_car_ids(cursor, ids):
+    cursor.execute(
+        """
+        SELECT id FROM car_management WHERE id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(ids),)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+# Partitioned storage (SHARD_COUNT > 0, see database/shards.py): every
+# write goes to the shard of the pickup location it sets, and cars are found
+# by id with locate_cars. A car moved to another shard between being found
+# and being written is looked up again.
+
+# Remove a car from whichever shard holds it
+def _remove_sharded_car(id):
+    while (shard := locate_cars([id]).get(id)) is not None:
+        if run_write(_delete_shard_row, id, database=shard_path(shard)):
+            return
+
+
+# Set a car's pickup location, moving it to another shard when the new location belongs to one
+def _relocate_sharded_car(id, pickup_location_id):
+    target = shard_for_location(pickup_location_id)
+    while (shard := locate_cars([id]).get(id)) is not None:
+        if shard == target:
+            updated = run_write(_update_shard_row, id, pickup_location_id, database=shard_path(shard))
+        else:
+            updated = _move_cars(shard, target, [(id, pickup_location_id)])
+        if updated:
+            return
+
+
+# Single-row writes on a shard, run by run_write; each returns the number of rows changed
+def _delete_shard_row(connection, id):
+    return connection.execute("DELETE FROM car_management WHERE id = ?", (id,)).rowcount
+
+
+def _update_shard_row(connection, id, pickup_location_id):
+    return connection.execute(
+        "UPDATE car_management SET pickup_location_id = ? WHERE id = ?", (pickup_location_id, id)
+    ).rowcount
+
+
+# Move cars from one shard to another, setting their new pickup locations
+# from (id, pickup_location_id) pairs, and return the ids moved. Both write
+# locks are taken in shard order, so opposite moves cannot deadlock. The
+# target commits first: a crash between the two commits leaves a car in both
+# shards rather than in neither, and moving it again repairs it.
+def _move_cars(source, target, changes):
+    locations = dict(changes)
+    connections = {index: get_shard_connection(index) for index in sorted((source, target))}
+    try:
+        for connection in connections.values():
+            connection.execute("BEGIN IMMEDIATE")
+        cursor = _tuple_cursor(connections[source])
         cursor.execute(
+            """
+            SELECT id, purchase_date, purchase_price, car_make_id, fuel_type_id
+            FROM car_management WHERE id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(list(locations)),)
+        )
+        cars = cursor.fetchall()
+        _upsert_cars(connections[target], [(*car, locations[car[0]]) for car in cars])
+        connections[source].executemany("DELETE FROM car_management WHERE id = ?", [(car[0],) for car in cars])
+        connections[target].commit()
+        connections[source].commit()
+        return {car[0] for car in cars}
+    except BaseException:
+        for connection in connections.values():
+            if connection.in_transaction:
+                connection.rollback()
+        raise
+
+
+# Group valid batch items by the shard of their pickup location, as
+# {shard: [(index, item)]}; items whose location is not an integer fail
+def _group_by_shard(results, valid):
+    groups = defaultdict(list)
+    for index, item in valid:
+        try:
+            groups[shard_for_location(item['pickup_location_id'])].append((index, item))
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'status': 'error', 'error': 'pickup_location_id must be an integer'}
+    return groups
+
+
+# Run write(connection, items) in one transaction per shard, the shards in
+# parallel. A shard whose transaction fails marks its own items as failed.
+def _write_shards(groups, write, results):
+    def run(index):
+        connection = get_shard_connection(index)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                write(connection, groups[index])
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+        except sqlite3.Error as error:
+            print(f"Database error: {error}")
+            _fail_batch(results, groups[index], error)
+
+    map_shards(run, list(groups))
+
+
+# Batch insert with partitioned storage: each shard's cars get ids from its counter
+def _add_sharded_cars(results, valid):
+    def insert(connection, items):
+        ids = allocate_ids(connection, len(items))
+        _insert_cars_with_ids(connection, [(id, *(car[field] for field in CAR_FIELDS)) for id, (_, car) in zip(ids, items)])
+        for id, (index, _) in zip(ids, items):
+            results[index] = {'index': index, 'status': 'created', 'id': id}
+
+    _write_shards(_group_by_shard(results, valid), insert, results)
+
+
+# Batch relocation with partitioned storage: cars staying in their shard are
+# updated in place, the others are moved shard pair by shard pair
+def _update_sharded_locations(results, valid):
+    located = locate_cars([update['id'] for _, update in valid])
+    in_place, moves = defaultdict(list), defaultdict(list)
+    for target, items in _group_by_shard(results, valid).items():
+        for index, update in items:
+            source = located.get(update['id'])
+            if source is None:
+                results[index] = {'index': index, 'status': 'not_found', 'id': update['id']}
+            elif source == target:
+                in_place[source].append((index, update))
+            else:
+                moves[source, target].append((index, update))
+
+    def update(connection, items):
+        existing = _existing_car_ids(connection.cursor(), [update['id'] for _, update in items])
+        connection.executemany(
             """
             UPDATE car_management SET pickup_location_id = ? WHERE id = ?
-            """, (data['pickup_location_id'], id)
+            """, [(update['pickup_location_id'], update['id']) for _, update in items if update['id'] in existing]
         )
-        connection.commit()
-        return "Pickup location updated successfully"
-    except sqlite3.Error as error:
-        print(f"Database error: {error}")
-    finally:
-        connection.close()
-        
\ No newline at end of file
+        for index, update in items:
+            status = 'updated' if update['id'] in existing else 'not_found'
+            results[index] = {'index': index, 'status': status, 'id': update['id']}
+
+    _write_shards(in_place, update, results)
+    for (source, target), items in moves.items():
+        try:
+            moved = _move_cars(source, target, [(update['id'], update['pickup_location_id']) for _, update in items])
+        except sqlite3.Error as error:
+            print(f"Database error: {error}")
+            _fail_batch(results, items, error)
+            continue
+        for index, update in items:
+            status = 'updated' if update['id'] in moved else 'not_found'
+            results[index] = {'index': index, 'status': status, 'id': update['id']}
+
+
+# Batch removal with partitioned storage, one transaction per shard holding any of the cars
+def _remove_sharded_cars(results, valid):
+    located = locate_cars([item['id'] for _, item in valid])
+    groups = defaultdict(list)
+    for index, item in valid:
+        if item['id'] in located:
+            groups[located[item['id']]].append((index, item))
+        else:
+            results[index] = {'index': index, 'status': 'not_found', 'id': item['id']}
+
+    def delete(connection, items):
+        existing = _existing_car_ids(connection.cursor(), [item['id'] for _, item in items])
+        connection.executemany("DELETE FROM car_management WHERE id = ?", [(id,) for id in existing])
+        for index, item in items:
+            status = 'deleted' if item['id'] in existing else 'not_found'
+            results[index] = {'index': index, 'status': status, 'id': item['id']}
+
+    _write_shards(groups, delete, results)
+
+
+# Write one chunk of imported cars, already mapped to dimension ids, to the
+# shards of their locations. Imported ids raise the counter of the shard that
+# hands out ids of their class, and cars whose location now belongs to
+# another shard are removed from their old one after the new copy committed.
+def _import_sharded_cars(upserts, inserts):
+    located = locate_cars([row[0] for row in upserts]) if upserts else {}
+    groups = defaultdict(lambda: ([], []))
+    moved = defaultdict(list)
+    for row in upserts:
+        target = shard_for_location(row[5])
+        groups[target][0].append(row)
+        if located.get(row[0], target) != target:
+            moved[located[row[0]]].append((row[0],))
+    for row in inserts:
+        groups[shard_for_location(row[4])][1].append(row)
+    imported_ids = [row[0] for row in upserts]
+
+    def write(index):
+        shard_upserts, shard_inserts = groups.get(index, ([], []))
+        connection = get_shard_connection(index)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            reserve_ids(connection, index, imported_ids)
+            _upsert_cars(connection, shard_upserts)
+            ids = allocate_ids(connection, len(shard_inserts)) if shard_inserts else []
+            _insert_cars_with_ids(connection, [(id, *row) for id, row in zip(ids, shard_inserts)])
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    def remove(index):
+        with get_shard_connection(index) as connection:
+            connection.executemany("DELETE FROM car_management WHERE id = ?", moved[index])
+
+    map_shards(write, sorted(set(groups) | {id % SHARD_COUNT for id in imported_ids}))
+    map_shards(remove, list(moved))
+
+
+# WHERE clause and parameters for the filters of db_retrieve_cars_by_filters:
+# equality terms on the id columns and inclusive ranges on date and price,
+# each backed by a composite index (see schema migrations 1 and 6)
+def _filter_clause(filters):
+    conditions = []
+    parameters = []
+    for column, operator, name in (
+        ('car_make_id', '=', 'car_make_id'),
+        ('fuel_type_id', '=', 'fuel_type_id'),
+        ('pickup_location_id', '=', 'pickup_location_id'),
+        ('purchase_date', '>=', 'purchase_date_from'),
+        ('purchase_date', '<=', 'purchase_date_to'),
+        ('purchase_price', '>=', 'min_price'),
+        ('purchase_price', '<=', 'max_price'),
+    ):
+        if filters.get(name) is not None:
+            conditions.append(f"{column} {operator} ?")
+            parameters.append(filters[name])
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), parameters
+
+
+# Whether SQL answers a top-k query by reading k index entries in order: it
+# has a sort column and a limit, and ranges on no other column. Such queries
+# stay on SQL even with the fleet snapshot, which has to scan every car.
+def _index_ordered(filters, sort, limit):
+    if sort is None or limit is None:
+        return False
+    ranged_columns = {
+        column for column, names in (
+            ('purchase_date', ('purchase_date_from', 'purchase_date_to')),
+            ('purchase_price', ('min_price', 'max_price')),
+        )
+        if any(filters.get(name) is not None for name in names)
+    }
+    return ranged_columns <= {sort}
+
+
+# Describe a write made in the open transaction for the fleet snapshot, as
+# (generation before, generation after, kind, rows). Triggers bump the
+# car_management generation once per changed row, so the generation before
+# the write is derived from the one after it while the write lock is held.
+def _snapshot_delta(connection, changed_rows, kind, rows):
+    if not FLEET_SNAPSHOT:
+        return None
+    after = connection.execute("SELECT generation FROM table_generation WHERE table_name = 'car_management'").fetchone()[0]
+    return after - changed_rows, after, kind, rows
+
+
+# NumPy takes tens of milliseconds to import, so only workers with the
+# snapshot enabled load it
+def _fleet_snapshot():
+    from repositories.fleet_snapshot import fleet_snapshot
+    return fleet_snapshot
+
+
+# Hand a committed write to the fleet snapshot and start a change log
+# compaction or a database snapshot if one is due
+def _after_write(delta):
+    if delta is not None:
+        _fleet_snapshot().record(*delta)
+    compact_changes_if_due()
+    snapshot_if_due()
+
+
+# Run a read and return (column names, rows as tuples). With snapshot set it
+# reads the database snapshot when the heavy reads are served from one. With
+# partitioned storage it runs on the given shard, or on every shard (see
+# map_shards); the shards' rows are concatenated or, when each shard returns
+# them ordered by the column order and then id, merged into that order.
+def _read_rows(sql, parameters=(), shard=None, order=None, descending=False, parallel=True, snapshot=False):
+    def read(connection):
+        cursor = _tuple_cursor(connection)
+        cursor.execute(sql, parameters)
+        return [description[0] for description in cursor.description], cursor.fetchall()
+
+    connection = _snapshot_connection() if snapshot else None
+    if connection is not None:
+        return read(connection)
+    if not SHARD_COUNT:
+        return read(get_connection())
+    results = map_shards(lambda index: read(get_shard_connection(index)), None if shard is None else [shard], parallel)
+    columns = results[0][0]
+    rows = [row for _, shard_rows in results for row in shard_rows]
+    if order is not None and len(results) > 1:
+        # Timsort finds the shards' ordered runs and merges them
+        rows.sort(key=itemgetter(columns.index(order), columns.index('id')), reverse=descending)
+    return columns, rows
+
+
+# The calling thread's connection to the snapshot the heavy reads are served
+# from, or None while they read SQLITE_DB_PATH (off, or no snapshot yet)
+def _snapshot_connection():
+    if not SNAPSHOT_READS:
+        return None
+    snapshot_if_due()
+    return get_snapshot_connection()
+
+
+# A dedicated connection to that snapshot, for reads that outlive the request
+def _create_snapshot_connection(check_same_thread=True):
+    if not SNAPSHOT_READS:
+        return None
+    snapshot_if_due()
+    return create_snapshot_connection(check_same_thread)
+
+
+# Shard holding the cars at a pickup location, or None to read every shard
+def _location_shard(pickup_location_id):
+    if SHARD_COUNT and pickup_location_id is not None:
+        return shard_for_location(pickup_location_id)
+    return None
+
+
+# Database file that writes setting a pickup location go to (None: SQLITE_DB_PATH)
+def _location_database(pickup_location_id):
+    return shard_path(shard_for_location(pickup_location_id)) if SHARD_COUNT else None
+
+
+# Sum of the shards' car_management generations, which grows with every write to any shard
+def _shard_generation():
+    return sum(
+        get_shard_connection(index).execute(
+            "SELECT generation FROM table_generation WHERE table_name = 'car_management'"
+        ).fetchone()[0]
+        for index in range(SHARD_COUNT)
+    )
+
+
+# Yield a cursor's rows, fetching batch_size at a time
+def _fetch_batches(cursor, batch_size):
+    while rows := cursor.fetchmany(batch_size):
+        yield from rows
+
+
+# Statistics records from (group_id, count, price sum, min and max, first and
+# last purchase date) rows in group order. With partitioned storage each
+# shard reports its part of a group, and the parts are combined first.
+def _stats_records(dimension, rows):
+    if SHARD_COUNT:
+        groups = {}
+        for group_id, *values in rows:
+            if group_id in groups:
+                count, total, price_min, price_max, date_min, date_max = groups[group_id]
+                values = [
+                    count + values[0], total + values[1], min(price_min, values[2]), max(price_max, values[3]),
+                    min(date_min, values[4]), max(date_max, values[5]),
+                ]
+            groups[group_id] = values
+        rows = [(group_id, *groups[group_id]) for group_id in sorted(groups)]
+    return [
+        {
+            dimension: group_id,
+            'count': count,
+            'purchase_price': {'sum': total, 'avg': total / count, 'min': price_min, 'max': price_max},
+            'purchase_date': {'min': date_min, 'max': date_max},
+        }
+        for group_id, count, total, price_min, price_max, date_min, date_max in rows
+    ]
+
+
+# Cursor returning plain tuples, skipping the per-row sqlite3.Row allocation
+def _tuple_cursor(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+# Convert rows to one dict per row, or to one list per column when columnar
+def _records(columns, rows, columnar=False):
+    if columnar:
+        return {column: list(values) for column, values in zip(columns, zip(*rows))} if rows else {column: [] for column in columns}
+    return [dict(zip(columns, row)) for row in rows]
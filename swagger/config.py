@@ -1,7 +1,10 @@
-from flasgger import Swagger
+import importlib.util
+import os
+import threading
+from flask import Blueprint, current_app
+from flask.helpers import get_root_path
 
-def init_swagger(app):
-    swagger_config = {
+SWAGGER_CONFIG = {
     "headers": [],
     "specs": [{
         "endpoint": 'apispec',
@@ -12,22 +15,84 @@ def init_swagger(app):
     "static_url_path": "/flasgger_static",
     "swagger_ui": True,
     "specs_route": "/api/v1/docs"
-    }
-    
-    template = {
-        "swagger": "2.0",
-        "info": {
-            "title": "CarManagementService API",
-            "description": "API for managing rental cars",
-            "version": "1.0.0"
-        },
-        "securityDefinitions": {
-            "JWT": {
-                "type": "apiKey",
-                "name": "Authorization",
-                "in": "header"
-            }
+}
+
+SWAGGER_TEMPLATE = {
+    "swagger": "2.0",
+    "info": {
+        "title": "CarManagementService API",
+        "description": "API for managing rental cars",
+        "version": "1.0.0"
+    },
+    "securityDefinitions": {
+        "JWT": {
+            "type": "apiKey",
+            "name": "Authorization",
+            "in": "header"
         }
     }
-    
-    return Swagger(app, config=swagger_config, template=template)
+}
+
+# Flasgger instance, created by the first docs request in each worker
+_swagger = None
+_swagger_lock = threading.Lock()
+
+
+# Attach a YAML spec file to a route, as flasgger's swag_from does, without
+# importing flasgger. The file is only read when the API spec is first built.
+def swag_from(specs):
+    def decorator(function):
+        function.root_path = get_root_path(function.__module__)
+        function.swag_path = os.path.join(function.root_path, specs)
+        function.swag_type = specs.rsplit('.', 1)[-1]
+        return function
+    return decorator
+
+
+# Register the Swagger UI and spec routes. Importing flasgger (and jsonschema,
+# yaml and mistune with it) costs every worker about 100 ms on boot, so it is
+# deferred to the first request for /api/v1/docs or /apispec.json. The spec
+# is compiled once on that request and cached by flasgger outside debug mode.
+def init_swagger(app):
+    ui_path = os.path.join(os.path.dirname(importlib.util.find_spec('flasgger').origin), 'ui3')
+    blueprint = Blueprint(
+        'flasgger', __name__,
+        template_folder=os.path.join(ui_path, 'templates'),
+        static_folder=os.path.join(ui_path, 'static'),
+        static_url_path=SWAGGER_CONFIG['static_url_path']
+    )
+    blueprint.add_url_rule(SWAGGER_CONFIG['specs_route'], 'apidocs', _api_docs)
+    blueprint.add_url_rule('/oauth2-redirect.html', 'oauth_redirect', _oauth_redirect)
+    for spec in SWAGGER_CONFIG['specs']:
+        blueprint.add_url_rule(spec['route'], spec['endpoint'], _api_spec, defaults={'endpoint': spec['endpoint']})
+    app.register_blueprint(blueprint)
+    return blueprint
+
+
+# Create the flasgger instance for this worker on first use
+def _get_swagger():
+    global _swagger
+    with _swagger_lock:
+        if _swagger is None:
+            from flasgger import Swagger
+            swagger = Swagger(config=dict(SWAGGER_CONFIG), template=SWAGGER_TEMPLATE)
+            swagger.app = current_app._get_current_object()
+            swagger.load_config(swagger.app)
+            _swagger = swagger
+    return _swagger
+
+
+def _api_docs():
+    from flasgger.base import APIDocsView
+    return APIDocsView(view_args={'config': _get_swagger().config}).get()
+
+
+def _oauth_redirect():
+    from flasgger.base import OAuthRedirect
+    return OAuthRedirect().get()
+
+
+def _api_spec(endpoint):
+    from flasgger.base import APISpecsView
+    swagger = _get_swagger()
+    return APISpecsView(loader=lambda: swagger.get_apispecs(endpoint)).get()
@@ -0,0 +1,34 @@
+import pytest
+from database import connection as db_connection
+
+
+# SQLITE_DB_PATH pointed at an empty database file for the test
+@pytest.fixture
+def database(tmp_path):
+    path = db_connection.SQLITE_DB_PATH
+    db_connection.close_connection()
+    db_connection.SQLITE_DB_PATH = str(tmp_path / 'cars.db')
+    yield db_connection.SQLITE_DB_PATH
+
+    db_connection.close_connection()
+    db_connection.SQLITE_DB_PATH = path
+
+
+# The database initialized and seeded from the bundled CSV, as at boot
+@pytest.fixture
+def seeded(database):
+    # Imported after the database path is set
+    from database.initialize import init_db
+    init_db()
+    return database
+
+
+# Flask test client of the app over the seeded database. Cached responses
+# are keyed by write generation, which every new test database restarts, so
+# the cache starts empty.
+@pytest.fixture
+def client(seeded):
+    from api.cache import response_cache
+    from app import app
+    response_cache.clear()
+    return app.test_client()
@@ -0,0 +1,116 @@
+import threading
+import time
+import pytest
+from flask import Flask, jsonify
+from api import admission
+from api.admission import AdmissionController, RouteClass
+
+# Small limits and timeouts, so requests are shed within the test
+CLASSES = {
+    'point': RouteClass(0, 0, 200),
+    'bulk': RouteClass(3, 1, 50),
+}
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = AdmissionController(2, 1, CLASSES)
+    monkeypatch.setattr(admission, 'ADMISSION_CONTROL', True)
+    monkeypatch.setattr(admission, 'ROUTE_CLASSES', CLASSES)
+    monkeypatch.setattr(admission, 'admission_controller', controller)
+    return controller
+
+
+# An app with a point route and a bulk route that blocks until release is set
+@pytest.fixture
+def app(controller):
+    app = Flask(__name__)
+    app.release = threading.Event()
+    app.entered = threading.Event()
+
+    @app.route('/point')
+    @admission.admission('point')
+    def point():
+        return jsonify({'ok': True})
+
+    @app.route('/bulk')
+    @admission.admission('bulk')
+    def bulk():
+        app.entered.set()
+        app.release.wait(5)
+        return jsonify({'ok': True})
+
+    return app
+
+
+# Start a bulk request that holds its slot until app.release is set
+def _hold_bulk(app):
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(app.test_client().get('/bulk')))
+    thread.start()
+    assert app.entered.wait(5)
+    return thread, responses
+
+
+def test_over_limit_is_shed_with_retry_after(app, controller):
+    thread, responses = _hold_bulk(app)
+    try:
+        response = app.test_client().get('/bulk')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(admission.ADMISSION_RETRY_AFTER_S)
+        assert response.get_json() == {'error': 'The server is overloaded, retry later'}
+
+        # The bulk limit leaves the other worker slot to point reads
+        assert app.test_client().get('/point').status_code == 200
+    finally:
+        app.release.set()
+        thread.join(5)
+    assert responses[0].status_code == 200
+    assert controller.in_flight == {'point': 0, 'bulk': 0}
+
+
+# A request that already waited longer than its timeout upstream is shed without running
+def test_expired_upstream_wait_is_shed(app):
+    started = f't={time.time() - 1:.3f}'
+
+    assert app.test_client().get('/point', headers={'X-Request-Start': started}).status_code == 503
+    assert app.test_client().get('/point').status_code == 200
+
+
+def test_queue_full_is_shed_at_once(controller):
+    for _ in range(2):
+        assert controller.acquire('point', 1) is None
+    waiter = threading.Thread(target=controller.acquire, args=('point', 1))
+    waiter.start()
+    while not controller.waiting['point']:
+        time.sleep(0.001)
+
+    assert controller.acquire('point', 1) == 'queue_full'
+    controller.release('point')
+    waiter.join(5)
+    assert controller.in_flight['point'] == 2
+
+
+# A released slot goes to the waiting request of the highest priority, not the oldest
+def test_point_reads_go_first():
+    controller = AdmissionController(1, 4, {**CLASSES, 'bulk': RouteClass(3, 0, 1000)})
+    assert controller.acquire('point', 1) is None
+
+    order = []
+
+    def wait(name):
+        if controller.acquire(name, 5) is None:
+            order.append(name)
+            controller.release(name)
+
+    threads = []
+    for name in ('bulk', 'point'):
+        threads.append(threading.Thread(target=wait, args=(name,)))
+        threads[-1].start()
+        while not controller.waiting[name]:
+            time.sleep(0.001)
+
+    controller.release('point')
+    for thread in threads:
+        thread.join(5)
+    assert order == ['point', 'bulk']
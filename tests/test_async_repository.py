@@ -0,0 +1,38 @@
+import asyncio
+import inspect
+import threading
+from repositories import async_repository, repository
+
+
+# Every repository function but the db_iter_all_cars generator has a coroutine version
+def test_every_repository_function_is_wrapped():
+    functions = {name for name, value in vars(repository).items() if name.startswith('db_') and inspect.isfunction(value)}
+
+    for name in functions - {'db_iter_all_cars'}:
+        assert inspect.iscoroutinefunction(getattr(async_repository, name)), name
+    assert not hasattr(async_repository, 'db_iter_all_cars')
+
+
+def test_wrappers_return_the_repository_results_off_the_event_loop(seeded, monkeypatch):
+    threads = []
+    retrieve = repository.db_retrieve_car_by_id
+
+    def record_thread(id):
+        threads.append(threading.current_thread())
+        return retrieve(id)
+
+    monkeypatch.setattr(repository, 'db_retrieve_car_by_id', record_thread)
+    monkeypatch.setattr(async_repository, 'db_retrieve_car_by_id', async_repository._on_db_threads(repository.db_retrieve_car_by_id))
+
+    async def read():
+        return await asyncio.gather(
+            async_repository.db_retrieve_car_by_id(1),
+            async_repository.db_retrieve_cars_by_filters(car_make_id=1),
+            async_repository.db_retrieve_car_stats('car_make_id'),
+        )
+
+    car, cars, stats = asyncio.run(read())
+    assert car == retrieve(1)
+    assert cars == repository.db_retrieve_cars_by_filters(car_make_id=1)
+    assert stats and stats == repository.db_retrieve_car_stats('car_make_id')
+    assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,17 @@
+BASE = '/api/v1/car-management'
+
+
+# JSON booleans are ints to Python; true must not delete car 1
+def test_delete_batch_rejects_boolean_ids(client):
+    response = client.delete(f'{BASE}/cars/batch', json={'ids': [True, False]})
+
+    assert response.status_code == 207
+    assert [result['status'] for result in response.get_json()['results']] == ['error', 'error']
+    assert client.get(f'{BASE}/car/1').status_code == 200
+
+
+def test_update_batch_rejects_boolean_ids(client):
+    response = client.patch(f'{BASE}/cars/batch', json={'cars': [{'id': True, 'pickup_location_id': 2}]})
+
+    assert response.status_code == 207
+    assert response.get_json()['results'][0]['error'] == 'id must be an integer'
@@ -0,0 +1,67 @@
+import gzip
+import json
+import pytest
+from database.connection import create_connection
+
+BASE = '/api/v1/car-management'
+
+
+def _delete_all_cars():
+    connection = create_connection()
+    try:
+        with connection:
+            connection.execute("DELETE FROM car_management")
+    finally:
+        connection.close()
+
+
+def _import(client, body, import_format='ndjson', ids='keep'):
+    return client.post(f'{BASE}/import?format={import_format}&ids={ids}', data=body)
+
+
+# Exporting the fleet and importing the file into an emptied table restores every car as it was
+@pytest.mark.parametrize('export_format', ['csv', 'ndjson'])
+def test_export_import_round_trip(client, export_format):
+    cars = client.get(f'{BASE}/all').get_json()
+    export = client.get(f'{BASE}/export?format={export_format}')
+    assert export.status_code == 200
+    assert gzip.decompress(export.data)
+
+    _delete_all_cars()
+    assert client.get(f'{BASE}/all').get_json() == []
+
+    response = _import(client, export.data, export_format)
+    assert response.status_code == 201
+    assert response.get_json() == {'imported': len(cars)}
+    assert client.get(f'{BASE}/all').get_json() == cars
+
+
+# Re-sending the same file with ids=keep overwrites the cars instead of adding copies
+def test_import_keep_ids_is_idempotent(client):
+    cars = client.get(f'{BASE}/all').get_json()
+    export = client.get(f'{BASE}/export?format=ndjson&compression=none').data
+
+    assert _import(client, export).status_code == 201
+    assert client.get(f'{BASE}/all').get_json() == cars
+
+
+# JSON booleans and fractions are not integers, however Python's int() treats them
+@pytest.mark.parametrize('field, value', [('id', True), ('id', 1.5), ('car_make_id', 2.7), ('car_make_id', False)])
+def test_import_rejects_non_integer_ids(client, field, value):
+    before = client.get(f'{BASE}/car/1').get_json()
+    car = {'id': 1, 'purchase_date': '2024-01-01', 'purchase_price': 1.0, 'car_make_id': 2, 'fuel_type_id': 1, 'pickup_location_id': 1}
+    valid = {**car, 'id': None}
+    lines = [json.dumps(valid), json.dumps({**car, field: value})]
+
+    response = _import(client, '\n'.join(lines).encode())
+
+    assert response.status_code == 400
+    assert response.get_json()['line'] == 2
+    assert response.get_json()['error'] == f"Line 2: {field} must be an integer"
+    assert client.get(f'{BASE}/car/1').get_json() == before
+
+
+def test_import_accepts_integer_text(client):
+    body = "purchase_date,purchase_price,car_make_id,fuel_type_id,pickup_location_id\n2024-01-01,1.0, 2 ,1,1\n"
+
+    assert _import(client, body.encode(), 'csv').status_code == 201
@@ -0,0 +1,58 @@
+import threading
+import time
+
+BASE = '/api/v1/car-management'
+
+CAR = {'purchase_date': '2024-01-01', 'purchase_price': 1.0, 'car_make_id': 1, 'fuel_type_id': 1, 'pickup_location_id': 1}
+
+
+def _latest(client):
+    return client.get(f'{BASE}/changes').get_json()['next_since']
+
+
+def test_feed_replays_writes_in_order(client):
+    since = _latest(client)
+    client.post(f'{BASE}/car', json=CAR)
+    client.patch(f'{BASE}/car/1', json={'pickup_location_id': 2})
+    client.delete(f'{BASE}/car/2')
+
+    page = client.get(f'{BASE}/changes?since={since}').get_json()
+
+    assert [(change['operation'], change['id']) for change in page['changes']] == [('insert', 30), ('update', 1), ('delete', 2)]
+    assert page['changes'][1]['car']['pickup_location_id'] == 2
+    assert page['changes'][2]['car'] is None
+    assert page['next_since'] == page['latest_version'] == since + 3
+    assert client.get(f'{BASE}/changes?since={page["next_since"]}').get_json()['changes'] == []
+
+
+def test_feed_pages_with_limit(client):
+    since = _latest(client)
+    for location in (2, 3, 1):
+        client.patch(f'{BASE}/car/1', json={'pickup_location_id': location})
+
+    first = client.get(f'{BASE}/changes?since={since}&limit=2').get_json()
+    second = client.get(f'{BASE}/changes?since={first["next_since"]}&limit=2').get_json()
+
+    assert len(first['changes']) == 2
+    assert [change['car']['pickup_location_id'] for change in first['changes'] + second['changes']] == [2, 3, 1]
+
+
+# A long-poll returns as soon as a write commits, well before its wait ends
+def test_long_poll_wakes_on_write(client):
+    since = _latest(client)
+    writer = threading.Timer(0.3, lambda: client.application.test_client().patch(f'{BASE}/car/1', json={'pickup_location_id': 2}))
+    writer.start()
+
+    started = time.monotonic()
+    page = client.get(f'{BASE}/changes?since={since}&wait=10').get_json()
+    writer.join()
+
+    assert [change['id'] for change in page['changes']] == [1]
+    assert time.monotonic() - started < 5
+
+
+def test_future_version_is_gone(client):
+    response = client.get(f'{BASE}/changes?since={_latest(client) + 100}')
+
+    assert response.status_code == 410
+    assert response.get_json()['next_since'] == _latest(client)
@@ -0,0 +1,83 @@
+import pytest
+from repositories import fleet_snapshot, repository
+
+CAR = {'purchase_date': '2024-01-01', 'purchase_price': 1.0, 'car_make_id': 1, 'fuel_type_id': 1, 'pickup_location_id': 1}
+
+
+# Repository reads served from a fresh in-memory snapshot of the seeded database
+@pytest.fixture
+def snapshot(seeded, monkeypatch):
+    snapshot = fleet_snapshot.FleetSnapshot()
+    monkeypatch.setattr(fleet_snapshot, 'fleet_snapshot', snapshot)
+    monkeypatch.setattr(repository, 'FLEET_SNAPSHOT', True)
+    return snapshot
+
+
+# Assert that a read returns the same from the snapshot as from SQL. Reads
+# without a sort have no defined order, so pass ordered=False to compare their
+# cars by id.
+def _same_as_sql(monkeypatch, read, ordered=True):
+    from_snapshot = read()
+    monkeypatch.setattr(repository, 'FLEET_SNAPSHOT', False)
+    from_sql = read()
+    monkeypatch.setattr(repository, 'FLEET_SNAPSHOT', True)
+    if ordered:
+        assert from_snapshot == from_sql
+    else:
+        assert _by_id(from_snapshot) == _by_id(from_sql)
+    return from_snapshot
+
+
+# Cars as a list of dicts sorted by id, from either a list or a columnar result
+def _by_id(cars):
+    if isinstance(cars, dict):
+        cars = [dict(zip(cars, row)) for row in zip(*cars.values())]
+    return sorted(cars, key=lambda car: car['id'])
+
+
+def test_reads_match_sql(snapshot, monkeypatch):
+    unordered = [
+        lambda: repository.db_retrieve_car_by_make(1),
+        lambda: repository.db_retrieve_car_by_pickup_location(2, columnar=True),
+        lambda: repository.db_retrieve_cars_by_filters(fuel_type_id=3, min_price=300000),
+    ]
+    ordered = [
+        lambda: repository.db_retrieve_cars_by_filters(purchase_date_from='2021-01-01', sort='purchase_price', descending=True, limit=5),
+        lambda: repository.db_retrieve_filtered_car_stats('car_make_id', min_price=1),
+        lambda: repository.db_retrieve_filtered_car_stats('pickup_location_id', purchase_date_to='2022-12-31'),
+    ]
+    for read in unordered:
+        assert _same_as_sql(monkeypatch, read, ordered=False)
+    for read in ordered:
+        assert _same_as_sql(monkeypatch, read)
+    assert len(snapshot) == 29
+
+
+# Writes through the repository reach the snapshot as deltas
+def test_writes_are_applied(snapshot, monkeypatch):
+    repository.db_retrieve_car_by_make(1)
+    generation = snapshot.generation
+
+    repository.db_add_new_car(CAR)
+    repository.db_update_pickup_location(2, {'pickup_location_id': 3})
+    repository.db_remove_car_by_id(3)
+
+    _same_as_sql(monkeypatch, lambda: repository.db_retrieve_car_by_make(1), ordered=False)
+    _same_as_sql(monkeypatch, lambda: repository.db_retrieve_car_by_pickup_location(3), ordered=False)
+    assert snapshot.generation > generation
+    assert len(snapshot) == 29
+
+
+# Deleting the car with the highest id lets the next insert reuse its id
+def test_reused_id_takes_over_the_dead_row(snapshot, monkeypatch):
+    last_id = max(car['id'] for car in repository.db_retrieve_all_cars())
+    repository.db_retrieve_car_by_make(1)
+
+    repository.db_remove_car_by_id(last_id)
+    repository.db_add_new_car(CAR)
+    assert repository.db_retrieve_car_by_id(last_id) is not None
+    repository.db_update_pickup_location(last_id, {'pickup_location_id': 2})
+
+    cars = _same_as_sql(monkeypatch, lambda: repository.db_retrieve_car_by_pickup_location(2), ordered=False)
+    assert last_id in [car['id'] for car in cars]
+    assert last_id not in [car['id'] for car in repository.db_retrieve_car_by_pickup_location(1)]
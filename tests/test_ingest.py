@@ -0,0 +1,58 @@
+import shutil
+import pytest
+from database import connection as db_connection
+from database.ingest import DEFAULT_CSV_PATH, ingest_csv
+from database.initialize import init_schema
+
+# A row in the bundled CSV's format, appended to a copy of it
+ROW = "3. March 2024,1. April 2024,1. April 2025,Kia,250000,Hybrid,1000,0,18000,12,4000,Aarhus,1.00"
+
+
+@pytest.fixture(autouse=True)
+def schema(database):
+    init_schema()
+
+
+def _car_count():
+    connection = db_connection.create_connection()
+    try:
+        return connection.execute("SELECT COUNT(*) FROM car_management").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def _append(csv_path, count):
+    with open(csv_path) as file:
+        ends_with_newline = file.read().endswith('\n')
+    with open(csv_path, 'a') as file:
+        file.write(('' if ends_with_newline else '\n') + '\n'.join([ROW] * count) + '\n')
+
+
+def test_rerun_loads_nothing(tmp_path):
+    csv_path = shutil.copy(DEFAULT_CSV_PATH, tmp_path / 'cars.csv')
+    loaded = ingest_csv(csv_path, progress=False)
+
+    assert loaded > 0
+    assert ingest_csv(csv_path, progress=False) == 0
+    assert _car_count() == loaded
+
+
+# The bundled CSV is smaller than any prefix a content hash could cover, so
+# appended rows must not make it look like a different source
+def test_appended_rows_resume(tmp_path):
+    csv_path = shutil.copy(DEFAULT_CSV_PATH, tmp_path / 'cars.csv')
+    loaded = ingest_csv(csv_path, chunk_size=10, progress=False)
+
+    _append(csv_path, 1)
+    assert ingest_csv(csv_path, chunk_size=10, progress=False) == 1
+    _append(csv_path, 3)
+    assert ingest_csv(csv_path, chunk_size=10, progress=False) == 3
+    assert _car_count() == loaded + 4
+
+
+def test_other_file_starts_from_zero(tmp_path):
+    first = shutil.copy(DEFAULT_CSV_PATH, tmp_path / 'first.csv')
+    second = shutil.copy(DEFAULT_CSV_PATH, tmp_path / 'second.csv')
+    loaded = ingest_csv(first, progress=False)
+
+    assert ingest_csv(second, progress=False) == loaded
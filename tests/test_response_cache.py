@@ -0,0 +1,60 @@
+from api.cache import response_cache
+
+BASE = '/api/v1/car-management'
+
+
+def test_etag_and_not_modified(client):
+    response = client.get(f'{BASE}/car/1')
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    repeat = client.get(f'{BASE}/car/1', headers={'If-None-Match': etag})
+    assert repeat.status_code == 304
+    assert repeat.data == b''
+    assert client.get(f'{BASE}/car/1', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_repeated_gets_are_served_from_cache(client):
+    client.get(f'{BASE}/car/1')
+    hits = response_cache.hits
+
+    assert client.get(f'{BASE}/car/1').status_code == 200
+    assert response_cache.hits == hits + 1
+
+
+# A write changes the car_management generation, so no stale response or ETag survives it
+def test_write_invalidates(client):
+    before = client.get(f'{BASE}/car/1')
+    old_location = before.get_json()['pickup_location_id']
+    location = old_location % 3 + 1
+    assert 1 in [car['id'] for car in client.get(f'{BASE}/car/location/{old_location}').get_json()]
+
+    assert client.patch(f'{BASE}/car/1', json={'pickup_location_id': location}).status_code == 200
+
+    after = client.get(f'{BASE}/car/1', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    assert after.get_json()['pickup_location_id'] == location
+    assert after.headers['ETag'] != before.headers['ETag']
+    assert 1 not in [car['id'] for car in client.get(f'{BASE}/car/location/{old_location}').get_json()]
+    assert 1 in [car['id'] for car in client.get(f'{BASE}/car/location/{location}').get_json()]
+
+
+def test_delete_and_insert_invalidate(client):
+    assert client.get(f'{BASE}/car/1').status_code == 200
+    count = len(client.get(f'{BASE}/all').get_json())
+
+    assert client.delete(f'{BASE}/car/1').status_code == 200
+    assert client.get(f'{BASE}/car/1').status_code == 404
+
+    car = {'purchase_date': '2024-01-01', 'purchase_price': 1.0, 'car_make_id': 1, 'fuel_type_id': 1, 'pickup_location_id': 1}
+    assert client.post(f'{BASE}/car', json=car).status_code == 201
+    assert len(client.get(f'{BASE}/all').get_json()) == count
+
+
+# Errors are neither cached nor given an ETag
+def test_errors_are_not_cached(client):
+    response = client.get(f'{BASE}/car/999999')
+
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
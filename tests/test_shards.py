@@ -0,0 +1,97 @@
+import pytest
+from api import routes
+from database import connection as db_connection
+from database import initialize, shards, snapshot
+from database.connection import create_connection
+from repositories import repository
+
+BASE = '/api/v1/car-management'
+
+SHARDS = 3
+
+
+# Partitioned storage with SHARDS shard files next to the test database
+@pytest.fixture
+def sharded(database, monkeypatch):
+    for module in (shards, initialize, snapshot, repository, routes):
+        monkeypatch.setattr(module, 'SHARD_COUNT', SHARDS)
+    monkeypatch.setattr(shards, '_executor', None)
+    initialize.init_db()
+    return database
+
+
+@pytest.fixture
+def client(sharded):
+    from app import app
+    return app.test_client()
+
+
+# {shard index: [(id, pickup_location_id), ...]} read from the shard files
+def _stored_cars():
+    cars = {}
+    for index in range(SHARDS):
+        connection = create_connection(shards.shard_path(index))
+        try:
+            cars[index] = [tuple(row) for row in connection.execute("SELECT id, pickup_location_id FROM car_management ORDER BY id")]
+        finally:
+            connection.close()
+    return cars
+
+
+# init_db runs in the gunicorn master, which must fork without open SQLite handles or threads
+def test_init_db_leaves_nothing_open(sharded):
+    assert shards._executor is None
+    assert not getattr(db_connection._local, 'connections', None)
+
+
+def test_cars_are_stored_by_location(sharded):
+    stored = _stored_cars()
+
+    assert sum(map(len, stored.values())) == 29
+    assert shards.shard_car_counts() == [len(stored[index]) for index in range(SHARDS)]
+    for index, cars in stored.items():
+        assert all(location % SHARDS == index for _, location in cars)
+    main = create_connection()
+    try:
+        assert main.execute("SELECT COUNT(*) FROM car_management").fetchone()[0] == 0
+    finally:
+        main.close()
+
+
+# Reads over every shard merge into one id order, in full and page by page
+def test_all_cars_merge_in_id_order(client):
+    ids = sorted(id for cars in _stored_cars().values() for id, _ in cars)
+    assert [car['id'] for car in client.get(f'{BASE}/all').get_json()] == ids
+
+    paged, after = [], 0
+    while after is not None:
+        page = client.get(f'{BASE}/all?limit=5&after={after}').get_json()
+        paged += [car['id'] for car in page['cars']]
+        after = page['next_after']
+    assert paged == ids
+
+
+def test_new_cars_get_distinct_ids_on_their_shard(client):
+    car = {'purchase_date': '2024-01-01', 'purchase_price': 1.0, 'car_make_id': 1, 'fuel_type_id': 1}
+    response = client.post(f'{BASE}/cars/batch', json={'cars': [{**car, 'pickup_location_id': location} for location in (1, 2, 3, 4)]})
+    assert response.status_code == 201
+    ids = [result['id'] for result in response.get_json()['results']]
+
+    assert len(set(ids)) == 4
+    stored = _stored_cars()
+    for id, location in zip(ids, (1, 2, 3, 4)):
+        assert (id, location) in stored[location % SHARDS]
+        assert client.get(f'{BASE}/car/{id}').get_json()['pickup_location_id'] == location
+
+
+# A new pickup location in another shard moves the car there, keeping its id
+def test_relocation_moves_car_between_shards(client):
+    id, location = _stored_cars()[1][0]
+    target = location + 1
+
+    assert client.patch(f'{BASE}/car/{id}', json={'pickup_location_id': target}).status_code == 200
+
+    stored = _stored_cars()
+    assert (id, target) in stored[target % SHARDS]
+    assert id not in [car for car, _ in stored[location % SHARDS]]
+    assert client.get(f'{BASE}/car/{id}').get_json()['pickup_location_id'] == target
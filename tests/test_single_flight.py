@@ -0,0 +1,60 @@
+import threading
+import time
+import pytest
+from api.cache import SingleFlight
+
+
+# Run flight.do('key', function) on callers threads while the leader's call is
+# blocked, returning what each thread got back
+def _concurrent(flight, function, callers, release):
+    results = []
+
+    def call():
+        try:
+            results.append(flight.do('key', function))
+        except Exception as error:
+            results.append(error)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    threads[0].start()
+    while not len(flight):
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    while flight.coalesced < callers - 1:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_identical_calls_share_one_computation():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return 'body'
+
+    results = _concurrent(flight, compute, 5, release)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('body', False)] + [('body', True)] * 4
+    assert len(flight) == 0
+    # The next call after the flight landed computes again
+    assert flight.do('key', compute) == ('body', False)
+
+
+def test_leader_error_reaches_every_caller():
+    flight, release = SingleFlight(), threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError('database is locked')
+
+    results = _concurrent(flight, fail, 3, release)
+
+    assert [str(result) for result in results] == ['database is locked'] * 3
+    with pytest.raises(RuntimeError):
+        flight.do('key', fail)
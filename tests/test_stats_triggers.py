@@ -0,0 +1,95 @@
+import pytest
+from database.connection import create_connection
+from database.migrations import STATS_DIMENSIONS
+
+
+@pytest.fixture
+def connection(seeded):
+    connection = create_connection()
+    yield connection
+    connection.close()
+
+
+# car_stats recomputed from car_management, by dimension and group
+def _expected(connection):
+    return {
+        (dimension, *row)
+        for dimension in STATS_DIMENSIONS
+        for row in connection.execute(
+            f"""
+            SELECT {dimension}, COUNT(*), SUM(purchase_price), MIN(purchase_price), MAX(purchase_price),
+                   MIN(purchase_date), MAX(purchase_date)
+            FROM car_management GROUP BY {dimension}
+            """
+        )
+    }
+
+
+def _stats(connection):
+    return {
+        tuple(row) for row in connection.execute(
+            "SELECT dimension, group_id, car_count, price_sum, price_min, price_max, date_min, date_max FROM car_stats"
+        )
+    }
+
+
+def _write(connection, sql, args=()):
+    with connection:
+        connection.execute(sql, args)
+    assert _stats(connection) == _expected(connection)
+
+
+# The cars holding the highest price and latest date of a fuel type
+def _extremes(connection, fuel_type_id):
+    return [
+        connection.execute(
+            f"SELECT id FROM car_management WHERE fuel_type_id = ? ORDER BY {column} DESC LIMIT 1", (fuel_type_id,)
+        ).fetchone()[0]
+        for column in ('purchase_price', 'purchase_date')
+    ]
+
+
+def test_seeded_stats_match(connection):
+    assert _stats(connection) == _expected(connection)
+
+
+def test_insert(connection):
+    _write(connection, "INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) VALUES ('2030-01-01', 99000000, 1, 1, 1)")
+    _write(connection, "INSERT INTO car_management (purchase_date, purchase_price, car_make_id, fuel_type_id, pickup_location_id) VALUES ('1990-01-01', 1, 2, 4, 2)")
+
+
+def test_update_each_column(connection):
+    price_max, date_max = _extremes(connection, 1)
+    _write(connection, "UPDATE car_management SET pickup_location_id = pickup_location_id % 3 + 1 WHERE id = ?", (date_max,))
+    _write(connection, "UPDATE car_management SET car_make_id = car_make_id % 3 + 1 WHERE id = ?", (price_max,))
+    _write(connection, "UPDATE car_management SET fuel_type_id = 2 WHERE id = ?", (date_max,))
+    _write(connection, "UPDATE car_management SET purchase_price = 1 WHERE id = ?", (price_max,))
+    _write(connection, "UPDATE car_management SET purchase_date = '1990-01-01' WHERE id = ?", (price_max,))
+
+
+# An update that changes nothing, or moves a group extreme to its own group, keeps the stats
+def test_update_without_changes(connection):
+    for car in _extremes(connection, 1):
+        _write(connection, "UPDATE car_management SET pickup_location_id = pickup_location_id, purchase_price = purchase_price WHERE id = ?", (car,))
+
+
+def test_delete(connection):
+    for car in _extremes(connection, 1):
+        _write(connection, "DELETE FROM car_management WHERE id = ?", (car,))
+
+
+# Deleting every car of a group removes its row
+def test_delete_group(connection):
+    _write(connection, "DELETE FROM car_management WHERE car_make_id = 1")
+    assert not connection.execute("SELECT 1 FROM car_stats WHERE dimension = 'car_make_id' AND group_id = 1").fetchone()
+
+
+# One update trigger per dimension, and every min/max recompute is an index seek
+def test_update_triggers_and_indexes(connection):
+    triggers = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_car_management_stats_update%'")}
+    assert triggers == {f'trg_car_management_stats_update_{dimension}' for dimension in STATS_DIMENSIONS}
+
+    for dimension in STATS_DIMENSIONS:
+        for column in ('purchase_price', 'purchase_date'):
+            plan = " ".join(row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN SELECT MAX({column}) FROM car_management WHERE {dimension} = 1"))
+            assert 'COVERING INDEX' in plan and 'SCAN' not in plan
@@ -0,0 +1,56 @@
+import pytest
+from database import write_coalescer
+from database.write_coalescer import WriteCoalescer
+
+
+def _insert(connection, value):
+    connection.execute("INSERT INTO items (value) VALUES (?)", (value,))
+    return value
+
+
+@pytest.fixture
+def coalescer(tmp_path):
+    path = str(tmp_path / 'writes.db')
+    coalescer = WriteCoalescer(path)
+    coalescer.submit(lambda connection: connection.execute("CREATE TABLE items (value INTEGER)")).result(5)
+    return coalescer
+
+
+def _values(coalescer):
+    return coalescer.submit(lambda connection: [row[0] for row in connection.execute("SELECT value FROM items ORDER BY value")]).result(5)
+
+
+# A failure after the COMMIT, here while recording the batch size, must not
+# report committed writes as failed, and leaves the writer serving later batches
+def test_writer_survives_unexpected_errors(coalescer, monkeypatch):
+    def fail(value):
+        raise RuntimeError("metrics broke")
+
+    monkeypatch.setattr(write_coalescer.db_write_batch_size, 'observe', fail)
+    assert coalescer.submit(_insert, (1,)).result(5) == 1
+    assert coalescer.submit(_insert, (2,)).result(5) == 2
+
+    monkeypatch.undo()
+    assert coalescer.submit(_insert, (3,)).result(5) == 3
+    assert _values(coalescer) == [1, 2, 3]
+
+
+# Unexpected errors outside the COMMIT path still answer every caller
+def test_writer_survives_errors_before_commit(coalescer, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("connection broke")
+
+    monkeypatch.setattr(coalescer, '_commit', fail)
+    with pytest.raises(RuntimeError):
+        coalescer.submit(_insert, (1,)).result(5)
+
+    monkeypatch.undo()
+    assert coalescer.submit(_insert, (2,)).result(5) == 2
+    assert _values(coalescer) == [2]
+
+
+def test_writer_survives_connection_errors(tmp_path):
+    coalescer = WriteCoalescer(str(tmp_path / 'missing' / 'writes.db'))
+    for _ in range(2):
+        with pytest.raises(Exception):
+            coalescer.submit(_insert, (1,)).result(5)